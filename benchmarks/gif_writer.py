@@ -0,0 +1,58 @@
+"""
+Compare MoviePy's clip.write_gif with engine.gif.write_gif on the same clip.
+
+    python benchmarks/gif_writer.py VIDEO [--start 0] [--end 5] [--scale 0.5] [--fps 15]
+
+Prints wall time, frames per second and output bytes of both writers.
+"""
+from __future__ import division, print_function
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from engine.gif import write_gif
+
+
+def moviepy_writer( clip, gif_name, fps ):
+    clip.write_gif( gif_name, fps=fps, verbose=False )
+
+
+def gifer_writer( clip, gif_name, fps ):
+    write_gif( clip.iter_frames( fps=fps, dtype='uint8' ), gif_name, fps )
+
+
+def main( argv ):
+    from moviepy.editor import VideoFileClip
+
+    parser = argparse.ArgumentParser( description=__doc__.strip().splitlines()[ 0 ] )
+    parser.add_argument( 'video' )
+    parser.add_argument( '--start', type=float, default=0.0 )
+    parser.add_argument( '--end', type=float, default=5.0 )
+    parser.add_argument( '--scale', type=float, default=0.5 )
+    parser.add_argument( '--fps', type=float, default=15.0 )
+    args = parser.parse_args( argv )
+
+    video = VideoFileClip( args.video, audio=False )
+    clip  = video.subclip( args.start, args.end ).resize( args.scale )
+    frames = int( round( clip.duration * args.fps ) )
+    directory = tempfile.mkdtemp( prefix='gifer-bench-' )
+    try:
+        for name, writer in [ ( 'moviepy', moviepy_writer ), ( 'gifer', gifer_writer ) ]:
+            gif_name = os.path.join( directory, name + '.gif' )
+            started  = time.time()
+            writer( clip, gif_name, args.fps )
+            elapsed  = time.time() - started
+            print( '{:8s} {:8.2f} s {:8.1f} frames/s {:10d} bytes'.format(
+                name, elapsed, frames / elapsed, os.path.getsize( gif_name ) ) )
+            os.remove( gif_name )
+    finally:
+        video.reader.close()
+        os.rmdir( directory )
+
+
+if __name__ == '__main__':
+    main( sys.argv[ 1: ] )
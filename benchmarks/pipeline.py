@@ -0,0 +1,339 @@
+"""
+Reproducible benchmarks of the GIF pipeline on generated videos.
+
+    python benchmarks/pipeline.py videos [--videos DIR] [--sources ...] [--sizes 320x180 ...] [--durations 4 ...]
+    python benchmarks/pipeline.py run RESULTS [--sources ...] [--sizes ...] [--durations ...] [--scales 1 0.5]
+                                              [--fps 0 12] [--speeds 1 2] [--mirrored 0 1] [--stages ...]
+                                              [--engine moviepy] [--processes 1] [--repeat 1]
+    python benchmarks/pipeline.py compare BASELINE RESULTS [--time 0.1] [--memory 0.1] [--size 0.01]
+
+videos generates the test videos from ffmpeg lavfi sources, byte for byte
+the same on every run of a given ffmpeg. run measures every stage of every
+case of the parameter matrix (fps 0 is the source fps) in a Python process
+of its own, so peak RSS is the case's, and writes wall time, frames/s, peak
+RSS of Python and of ffmpeg and output bytes to RESULTS as JSON. compare
+prints the cases of RESULTS slower, bigger or using more memory than in
+BASELINE by more than the given fractions and exits with status 1 if any.
+
+Stages:
+    decode   - frames shown by the GIF out of the ffmpeg pipe (engine.render.gifer_reader),
+               bytes are the bytes read from the pipe, frames shown more than once count once.
+    encode   - engine.gif.write_gif of frames decoded beforehand, held in memory.
+    make_gif - the whole engine.render.make_gif job with --engine.
+"""
+from __future__ import division, print_function
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess as sp
+import sys
+import tempfile
+import time
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from engine.ffmpeg import ffmpeg_exe
+from engine.info import Info
+from engine.render import ENGINES
+
+
+# lavfi graphs of the test videos, filled with size, rate and duration.
+# screen is mostly still, like a screen capture: a grid with a small box
+# moving over it.
+SOURCES = {
+    'testsrc'   : 'testsrc=size={size}:rate={rate}:duration={duration}',
+    'mandelbrot': 'mandelbrot=size={size}:rate={rate},trim=duration={duration}',
+    'noise'     : 'color=c=gray:size={size}:rate={rate}:duration={duration},noise=alls=60:allf=t+u',
+    'screen'    : 'color=c=0xf0f0f0:size={size}:rate={rate}:duration={duration},'
+                  'drawgrid=width=80:height=20:thickness=1:color=0xc8c8c8[grid];'
+                  'color=c=0x2060c0:size=16x16:rate={rate}:duration={duration}[box];'
+                  "[grid][box]overlay=x='mod(t*60,W-w)':y=H/3",
+}
+RATE = 30
+# Single threaded, bit exact x264 with a keyframe every 2 s, so videos are
+# reproducible and seekable.
+VIDEO_ARGS = [ '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '20', '-g', str( 2 * RATE ), '-threads', '1',
+               '-pix_fmt', 'yuv420p', '-fflags', '+bitexact', '-flags:v', '+bitexact' ]
+VIDEO_DIR  = os.path.join( tempfile.gettempdir(), 'gifer-bench-videos' )
+
+# Default matrix.
+SIZES     = [ '320x180', '640x360' ]
+DURATIONS = [ 4 ]
+SCALES    = [ 1, 0.5 ]
+FPS       = [ 0, 12 ]
+SPEEDS    = [ 1, 2 ]
+MIRRORED  = [ 0, 1 ]
+STAGES    = [ 'decode', 'encode', 'make_gif' ]
+
+# Regression thresholds of compare, as fractions of the baseline. Wall times
+# within TIME_FLOOR seconds of each other are noise.
+TIME_THRESHOLD   = 0.1
+MEMORY_THRESHOLD = 0.1
+SIZE_THRESHOLD   = 0.01
+TIME_FLOOR       = 0.02
+
+
+def video_name( source, size, duration ):
+    return '{}-{}-{}s.mp4'.format( source, size, duration )
+
+
+def make_video( directory, source, size, duration ):
+    """ Path of the test video, generated unless it already exists. """
+    path = os.path.join( directory, video_name( source, size, duration ) )
+    if not os.path.exists( path ):
+        partial = path + '.partial.mp4'
+        graph   = SOURCES[ source ].format( size=size, rate=RATE, duration=duration )
+        sp.check_call( [ ffmpeg_exe(), '-v', 'error', '-nostdin', '-y', '-f', 'lavfi', '-i', graph ] +
+                       VIDEO_ARGS + [ partial ] )
+        os.rename( partial, path )
+    return path
+
+
+def peak_rss( children=False ):
+    """ Peak resident set size in bytes of this process or of its largest child, None on Windows. """
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage( resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF )
+    # Kilobytes on Linux, bytes on macOS.
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+def case_info( video, params ):
+    info = Info()
+    info.video = video
+    info.update_start( 0 )
+    info.update_scale( params[ 'scale' ] if params[ 'scale' ] != 1 else None )
+    info.update_fps( params[ 'fps' ] )
+    info.update_speed( params[ 'speed' ] )
+    info.update_mirror( bool( params[ 'mirrored' ] ) )
+    info.update_engine( params[ 'engine' ] )
+    info.update_encode_processes( params[ 'processes' ] )
+    return info
+
+
+def piped_frames( reader, sizes ):
+    """ Frames of reader, appending the bytes of every frame to sizes. """
+    for frame in reader:
+        sizes.append( frame.nbytes )
+        yield frame
+
+
+def decoded_frames( info, sizes=None ):
+    """ Frames shown by the GIF and its fps, with the bytes of the pipe appended to sizes if given. """
+    from engine.decode import planned_frames
+    from engine.render import gifer_reader
+
+    reader, plan, fps = gifer_reader( info )
+    try:
+        return planned_frames( piped_frames( reader, sizes ) if sizes is not None else reader, plan ), fps
+    except BaseException:
+        reader.close()
+        raise
+
+
+def decode_stage( info, gif_name ):
+    started   = time.time()
+    sizes     = []
+    frames, _ = decoded_frames( info, sizes )
+    count     = sum( 1 for _ in frames )
+    return count, sum( sizes ), time.time() - started
+
+
+def encode_stage( info, gif_name ):
+    from engine.gif import encoding_pool, write_gif
+
+    frames, fps = decoded_frames( info )
+    # Only the encoding is timed, frames are decoded first.
+    frames  = list( frames )
+    started = time.time()
+    with encoding_pool( info.encode_processes ) as pool:
+        count = write_gif( frames, gif_name, fps, mirrored=info.mirrored, quantizer=info.quantizer,
+                           colors=info.colors, sampling=info.sampling, delta=info.delta,
+                           dithering=info.dither, lossy=info.lossy, pool=pool, window=info.encode_window )
+    return count, os.path.getsize( gif_name ), time.time() - started
+
+
+def make_gif_stage( info, gif_name ):
+    from engine.render import make_gif
+
+    started = time.time()
+    frames  = make_gif( info, gif_name, verbose=False )
+    return frames, os.path.getsize( gif_name ), time.time() - started
+
+
+# Stages by name, ( frames, bytes, seconds ) of info writing to gif_name.
+STAGE_FUNCTIONS = { 'decode': decode_stage, 'encode': encode_stage, 'make_gif': make_gif_stage }
+
+
+def measure( video, stage, params ):
+    """ Measures of one stage of one case, in this process. """
+    info      = case_info( video, params )
+    directory = tempfile.mkdtemp( prefix='gifer-bench-' )
+    try:
+        frames, size, elapsed = STAGE_FUNCTIONS[ stage ]( info, os.path.join( directory, 'bench.gif' ) )
+    finally:
+        shutil.rmtree( directory )
+    return { 'wall': elapsed, 'frames': frames, 'fps': frames / elapsed if elapsed > 0 else None,
+             'peak_rss': peak_rss(), 'ffmpeg_rss': peak_rss( children=True ), 'bytes': size }
+
+
+def case_name( video, stage, params ):
+    """ e.g. 'screen-640x360-4s scale=0.5 fps=12 speed=2 mirrored make_gif'. """
+    parts = [ os.path.splitext( os.path.basename( video ) )[ 0 ], 'scale={:g}'.format( params[ 'scale' ] ),
+              'fps={:g}'.format( params[ 'fps' ] ) if params[ 'fps' ] else 'fps=source',
+              'speed={:g}'.format( params[ 'speed' ] ) ]
+    if params[ 'mirrored' ]:
+        parts.append( 'mirrored' )
+    if params[ 'engine' ] != 'moviepy' and stage == 'make_gif':
+        parts.append( params[ 'engine' ] )
+    return ' '.join( parts + [ stage ] )
+
+
+def run_case( video, stage, params, repeat ):
+    """ Best measures of repeat runs of a case, each in a new Python process. """
+    best = None
+    for _ in range( repeat ):
+        output  = sp.check_output( [ sys.executable, os.path.abspath( __file__ ), 'measure', video, stage,
+                                     json.dumps( params ) ] )
+        measure = json.loads( output.decode( 'utf-8' ).strip().splitlines()[ -1 ] )
+        if best is None or measure[ 'wall' ] < best[ 'wall' ]:
+            best = measure
+    return best
+
+
+def ffmpeg_version():
+    return sp.check_output( [ ffmpeg_exe(), '-version' ] ).decode( 'utf-8', 'replace' ).splitlines()[ 0 ]
+
+
+def format_rss( rss ):
+    return '{:8.1f} MB'.format( rss / 1024 / 1024 ) if rss is not None else '       - MB'
+
+
+def main_videos( args ):
+    if not os.path.isdir( args.videos ):
+        os.makedirs( args.videos )
+    for source, size, duration in itertools.product( args.sources, args.sizes, args.durations ):
+        print( make_video( args.videos, source, size, duration ) )
+
+
+def main_run( args ):
+    if not os.path.isdir( args.videos ):
+        os.makedirs( args.videos )
+    cases = []
+    for source, size, duration in itertools.product( args.sources, args.sizes, args.durations ):
+        video = make_video( args.videos, source, size, duration )
+        for scale, fps, speed, mirrored, stage in itertools.product( args.scales, args.fps, args.speeds,
+                                                                     args.mirrored, args.stages ):
+            params = { 'scale': scale, 'fps': fps, 'speed': speed, 'mirrored': mirrored,
+                       'engine': args.engine, 'processes': args.processes }
+            name   = case_name( video, stage, params )
+            result = run_case( video, stage, params, args.repeat )
+            result.update( name=name, video=os.path.basename( video ), stage=stage, params=params )
+            cases.append( result )
+            print( '{:62s} {:8.2f} s {:8.1f} frames/s {} {:10d} bytes'.format(
+                name, result[ 'wall' ], result[ 'fps' ] or 0, format_rss( result[ 'peak_rss' ] ),
+                result[ 'bytes' ] ) )
+
+    results = { 'created': time.strftime( '%Y-%m-%dT%H:%M:%S' ), 'python': platform.python_version(),
+                'platform': platform.platform(), 'ffmpeg': ffmpeg_version(), 'repeat': args.repeat,
+                'cases': cases }
+    with open( args.results, 'w' ) as output:
+        json.dump( results, output, indent=1, sort_keys=True )
+
+
+def regressions( baseline, current, time_threshold, memory_threshold, size_threshold ):
+    """ ( name, measure, baseline value, current value ) of the measures of current worse than in baseline. """
+    thresholds = [ ( 'wall', time_threshold ), ( 'peak_rss', memory_threshold ),
+                   ( 'ffmpeg_rss', memory_threshold ), ( 'bytes', size_threshold ) ]
+    found = []
+    for name, case in current.items():
+        before = baseline.get( name )
+        if before is None:
+            continue
+        for measure, threshold in thresholds:
+            old, new = before.get( measure ), case.get( measure )
+            if old is None or new is None or new <= old * ( 1 + threshold ):
+                continue
+            if measure == 'wall' and new - old < TIME_FLOOR:
+                continue
+            found.append( ( name, measure, old, new ) )
+    return sorted( found )
+
+
+def main_compare( args ):
+    with open( args.baseline ) as baseline_file:
+        baseline = json.load( baseline_file )
+    with open( args.results ) as results_file:
+        results = json.load( results_file )
+    if baseline[ 'ffmpeg' ] != results[ 'ffmpeg' ]:
+        print( 'Warning: different ffmpeg, test videos and timings may differ:\n  {}\n  {}'.format(
+            baseline[ 'ffmpeg' ], results[ 'ffmpeg' ] ) )
+    before  = dict( ( case[ 'name' ], case ) for case in baseline[ 'cases' ] )
+    current = dict( ( case[ 'name' ], case ) for case in results[ 'cases' ] )
+    for name in sorted( set( before ) - set( current ) ):
+        print( 'Missing: ' + name )
+    for name in sorted( set( current ) - set( before ) ):
+        print( 'New:     ' + name )
+
+    found = regressions( before, current, args.time, args.memory, args.size )
+    for name, measure, old, new in found:
+        print( '{:62s} {:10s} {:14.6g} -> {:14.6g} ({:+.1f}%)'.format( name, measure, old, new,
+                                                                      ( new / old - 1 ) * 100 if old else 0 ) )
+    print( '{} regressions in {} cases'.format( len( found ), len( set( before ) & set( current ) ) ) )
+    return 1 if found else 0
+
+
+def main( argv ):
+    parser   = argparse.ArgumentParser( description=__doc__.strip().splitlines()[ 0 ] )
+    commands = parser.add_subparsers( dest='command' )
+
+    matrix = argparse.ArgumentParser( add_help=False )
+    matrix.add_argument( '--videos', default=VIDEO_DIR, help='directory of the test videos' )
+    matrix.add_argument( '--sources', nargs='+', choices=sorted( SOURCES ), default=sorted( SOURCES ) )
+    matrix.add_argument( '--sizes', nargs='+', default=SIZES )
+    matrix.add_argument( '--durations', nargs='+', type=int, default=DURATIONS )
+
+    commands.add_parser( 'videos', parents=[ matrix ], help='generate the test videos' )
+
+    run = commands.add_parser( 'run', parents=[ matrix ], help='run the benchmarks' )
+    run.add_argument( 'results' )
+    run.add_argument( '--scales', nargs='+', type=float, default=SCALES )
+    run.add_argument( '--fps', nargs='+', type=float, default=FPS )
+    run.add_argument( '--speeds', nargs='+', type=float, default=SPEEDS )
+    run.add_argument( '--mirrored', nargs='+', type=int, choices=[ 0, 1 ], default=MIRRORED )
+    run.add_argument( '--stages', nargs='+', choices=STAGES, default=STAGES )
+    run.add_argument( '--engine', choices=ENGINES, default='moviepy', help='engine of make_gif, default moviepy' )
+    run.add_argument( '--processes', type=int, default=1 )
+    run.add_argument( '--repeat', type=int, default=1, help='runs per case, the fastest is kept' )
+
+    compare = commands.add_parser( 'compare', help='flag regressions against a baseline' )
+    compare.add_argument( 'baseline' )
+    compare.add_argument( 'results' )
+    compare.add_argument( '--time', type=float, default=TIME_THRESHOLD )
+    compare.add_argument( '--memory', type=float, default=MEMORY_THRESHOLD )
+    compare.add_argument( '--size', type=float, default=SIZE_THRESHOLD )
+
+    measure_case = commands.add_parser( 'measure', help='measure one stage of one case, used by run' )
+    measure_case.add_argument( 'video' )
+    measure_case.add_argument( 'stage', choices=STAGES )
+    measure_case.add_argument( 'params' )
+
+    args = parser.parse_args( argv )
+    if args.command == 'videos':
+        main_videos( args )
+    elif args.command == 'run':
+        main_run( args )
+    elif args.command == 'compare':
+        return main_compare( args )
+    elif args.command == 'measure':
+        print( json.dumps( measure( args.video, args.stage, json.loads( args.params ) ) ) )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit( main( sys.argv[ 1: ] ) )
@@ -0,0 +1,9 @@
+"""
+GIFer rendering engine.
+
+Everything needed to turn a video into a GIF animation without a GUI. Heavy
+dependencies (MoviePy, imageio) are only imported when a GIF is rendered, so
+importing this package is cheap.
+"""
+from engine.info import Info
+from engine.render import make_gif
@@ -0,0 +1,249 @@
+"""
+Batch conversion of many GIF jobs across a process pool.
+
+A manifest is either a JSON list of job objects (or an object with a "jobs"
+list), or a CSV file with a header line. Every job understands the keys
+
+    video, start, end, width, height, scale, size, resize_filter, fps, speed, mirrored, engine,
+    snap_keyframe, timelapse, timelapse_snap, quantizer, colors, sampling, delta, dither, lossy, max_size,
+    output
+
+where size is "WIDTHxHEIGHT" in CSV or [ width, height ] in JSON and max_size
+a size budget like "5M" (see engine.budget). Only video is required.
+
+Rows are checked before the batch starts: an invalid row, e.g. without a
+video, with start=abc or with engine=foo, gets an error in its summary row
+and is not rendered, the other jobs still are.
+"""
+from __future__ import division
+import csv
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+from engine import instrument
+from engine.budget import parse_size
+from engine.dither import DITHERS
+from engine.ffmpeg import RESIZE_FILTERS
+from engine.info import Info
+from engine.palette import QUANTIZERS, SAMPLINGS
+from engine.probe import probe_many
+from engine.progress import DEFAULT_INTERVAL, ProgressReporter, relay_events
+from engine.render import ENGINES, default_gif_name, make_gif
+
+
+SUMMARY_FIELDS = [ 'video', 'output', 'frames', 'wall_time', 'frames_per_second', 'bytes', 'error' ]
+TRUE_STRINGS   = [ '1', 'true', 'yes', 'y', 'on' ]
+
+
+def read_manifest( manifest ):
+    """ Read jobs from a JSON or CSV manifest, return a list of dicts. """
+    if manifest.lower().endswith( '.csv' ):
+        with open( manifest ) as manifest_file:
+            return [ dict( row ) for row in csv.DictReader( manifest_file ) ]
+
+    with open( manifest ) as manifest_file:
+        jobs = json.load( manifest_file )
+    if isinstance( jobs, dict ):
+        jobs = jobs[ 'jobs' ]
+    return jobs
+
+
+def _value( job, key ):
+    """ Value of key in job, empty CSV cells are treated as missing. """
+    value = job.get( key )
+    if value is None or value == '':
+        return None
+    return value
+
+
+def _choice( job, key, choices ):
+    """ Value of key in job, raise ValueError if it is not one of choices. """
+    value = _value( job, key )
+    if value is not None and value not in choices:
+        raise ValueError( 'Unknown {} {}, use one of {}'.format( key, value, choices ) )
+    return value
+
+
+def _to_bool( value ):
+    if isinstance( value, bool ):
+        return value
+    return value is not None and str( value ).strip().lower() in TRUE_STRINGS
+
+
+def job_to_info( job ):
+    """ Build the Info object of a manifest job, raise ValueError if it is invalid. """
+    info  = Info()
+    video = _value( job, 'video' )
+    if video is None:
+        raise ValueError( 'Job has no video' )
+    if isinstance( video, bytes ):
+        video = video.decode( 'utf-8' )
+    info.video = video
+
+    info.update_start( _value( job, 'start' ) or 0 )
+    info.update_end( _value( job, 'end' ) )
+
+    size = _value( job, 'size' )
+    if size is not None:
+        if not isinstance( size, ( list, tuple ) ):
+            size = str( size ).lower().split( 'x' )
+        info.update_width( size[ 0 ] )
+        info.update_height( size[ 1 ] )
+    info.update_width( _value( job, 'width' ) )
+    info.update_height( _value( job, 'height' ) )
+    info.update_scale( _value( job, 'scale' ) )
+    info.update_resize_filter( _choice( job, 'resize_filter', RESIZE_FILTERS ) )
+
+    info.update_fps( _value( job, 'fps' ) )
+    info.update_speed( _value( job, 'speed' ) or 1 )
+    info.update_mirror( _to_bool( _value( job, 'mirrored' ) ) )
+    info.update_engine( _choice( job, 'engine', ENGINES ) )
+    info.update_snap_keyframe( _to_bool( _value( job, 'snap_keyframe' ) ) )
+    info.update_timelapse( _to_bool( _value( job, 'timelapse' ) ), _value( job, 'timelapse_snap' ) )
+    info.update_quantizer( _choice( job, 'quantizer', QUANTIZERS ) )
+    info.update_colors( _value( job, 'colors' ) )
+    info.update_sampling( _choice( job, 'sampling', SAMPLINGS ) )
+    info.update_delta( _to_bool( _value( job, 'delta' ) ) )
+    info.update_dither( _choice( job, 'dither', DITHERS ) )
+    info.update_lossy( _value( job, 'lossy' ) )
+    max_size = _value( job, 'max_size' )
+    info.update_max_bytes( parse_size( max_size ) if max_size is not None else None )
+    return info
+
+
+def estimated_cost( job ):
+    """
+    Rough relative cost of a job, used to start the longest jobs first so
+    that short jobs fill the gaps at the end of the batch.
+    """
+    start = float( _value( job, 'start' ) or 0 )
+    end   = _value( job, 'end' )
+    if end is None:
+        # Unknown length, assume it is a long one.
+        return float( 'inf' )
+    cost = ( float( end ) - start ) / float( _value( job, 'speed' ) or 1 )
+    if _to_bool( _value( job, 'mirrored' ) ):
+        cost *= 2
+    return cost
+
+
+def run_job( indexed_job ):
+    """
+    Render one job in a worker process and return its index, summary row and
+    recording, see engine.instrument.start_worker, None without trace.
+    Progress events of the job are put on events, if given.
+    """
+    index, job, events, interval, trace = indexed_job
+    summary = _summary( job )
+    if trace:
+        instrument.start_worker( trace )
+
+    started = time.time()
+    try:
+        info     = job_to_info( job )
+        gif_name = _value( job, 'output' ) or default_gif_name( info.video )
+        summary[ 'video' ]  = info.video
+        summary[ 'output' ] = gif_name
+        progress = ProgressReporter( events.put if events is not None else None, interval=interval, job=index )
+        frames   = make_gif( info, gif_name, progress=progress )
+    except Exception as err:
+        summary[ 'error' ] = _error( err )
+    else:
+        summary[ 'frames' ] = frames
+        summary[ 'bytes' ]  = os.path.getsize( gif_name )
+    wall_time = time.time() - started
+
+    summary[ 'wall_time' ] = wall_time
+    if summary[ 'frames' ] and wall_time > 0:
+        summary[ 'frames_per_second' ] = summary[ 'frames' ] / wall_time
+    return index, summary, instrument.finish_worker() if trace else None
+
+
+def _summary( job ):
+    """ Summary row of job, before it runs. """
+    return { 'video': _value( job, 'video' ), 'output': _value( job, 'output' ), 'frames': None,
+             'wall_time': None, 'frames_per_second': None, 'bytes': None, 'error': None }
+
+
+def _error( err ):
+    return '{}: {}'.format( err.__class__.__name__, err )
+
+
+def check_jobs( jobs ):
+    """
+    Split jobs into ( index, job, cost ) of valid jobs and a dict of index
+    to the summary row of every invalid job, with its error.
+    """
+    valid, invalid = [], {}
+    for index, job in enumerate( jobs ):
+        try:
+            job_to_info( job )
+            cost = estimated_cost( job )
+        except Exception as err:
+            invalid[ index ] = _summary( job )
+            invalid[ index ][ 'error' ] = _error( err )
+        else:
+            valid.append( ( index, job, cost ) )
+    return valid, invalid
+
+
+def run_batch( jobs, processes=None, progress=None, interval=DEFAULT_INTERVAL ):
+    """
+    Render all jobs across a pool of processes, default one per CPU core.
+    Return summary rows in the order of jobs.
+    Progress events of every job, at most one per interval seconds and job,
+    are passed to progress in this process, their job is the job's index.
+
+    Jobs are handed out one at a time, longest first, so every worker stays
+    busy until the queue is empty even when job durations differ a lot.
+    Every video is probed once, up front, workers read the cached metadata.
+    Invalid jobs are not run, their summary rows hold the error.
+    When instrumentation is on, jobs are traced in the workers and added to
+    the trace of this process.
+    """
+    valid, invalid = check_jobs( jobs )
+    results = [ invalid.get( index ) for index in range( len( jobs ) ) ]
+    if not valid:
+        return results
+
+    probe_many( [ _value( job, 'video' ) for index, job, cost in valid ] )
+    manager = multiprocessing.Manager() if progress else None
+    events  = manager.Queue() if progress else None
+    trace   = instrument.worker_options()
+    indexed = [ ( index, job, events, interval, trace )
+                for index, job, cost in sorted( valid, key=lambda item: item[ 2 ], reverse=True ) ]
+
+    relay = None
+    if progress:
+        relay = threading.Thread( target=relay_events, args=( events, progress ) )
+        relay.daemon = True
+        relay.start()
+    pool = multiprocessing.Pool( processes=processes )
+    try:
+        for index, summary, recording in pool.imap_unordered( run_job, indexed, chunksize=1 ):
+            results[ index ] = summary
+            if recording:
+                instrument.merge_worker( recording )
+    finally:
+        pool.close()
+        pool.join()
+        if relay is not None:
+            events.put( None )
+            relay.join()
+            manager.shutdown()
+    return results
+
+
+def write_summary( summaries, summary_name ):
+    """ Write summary rows to a CSV file, or JSON unless the name ends with .csv. """
+    if summary_name.lower().endswith( '.csv' ):
+        with open( summary_name, 'w' ) as summary_file:
+            writer = csv.DictWriter( summary_file, fieldnames=SUMMARY_FIELDS )
+            writer.writeheader()
+            writer.writerows( summaries )
+    else:
+        with open( summary_name, 'w' ) as summary_file:
+            json.dump( summaries, summary_file, indent=2 )
@@ -0,0 +1,291 @@
+"""
+Output size budgets: the best GIF of a job that fits in a number of bytes.
+
+SizeModel decodes a few short runs of frames spread over the clip, at most
+MEASURE_SIDES[ 0 ] pixels wide, and encodes them with the job's own options
+at a few sizes and every quality step (colors and lossy strength). From
+those it estimates the bytes of the whole GIF at any scale, fps and quality
+step, so a plan is found without rendering anything. make_gif_for_size renders the plan and, if the GIF
+still exceeds the budget, corrects the estimates by how far off they were
+and renders once more.
+"""
+from __future__ import division
+import copy
+import io
+import logging
+import math
+import os
+import re
+
+from engine.cancel import CancelToken
+from engine.probe import video_metadata
+from engine.progress import ProgressReporter, print_event
+from engine.render import expected_frames, make_gif, output_size
+
+
+# Times sampled over the clip and GIF frames decoded at each of them.
+SAMPLE_POINTS = 4
+SAMPLE_RUN    = 3
+# Longest sides in pixels sampled frames are encoded at, capped by the
+# job's size, and the one quality steps are compared at.
+MEASURE_SIDES = ( 512, 256, 128, 64 )
+QUALITY_SIDE  = 128
+
+# fps tried, as fractions of the job's, never below MIN_FPS.
+FPS_STEPS = ( 1, 0.8, 0.6, 0.5 )
+MIN_FPS   = 5
+# ( colors, lossy ) quality steps, best first. Jobs keep fewer colors or
+# more loss if they already asked for it.
+QUALITY_STEPS = ( ( 256, 0 ), ( 256, 40 ), ( 128, 40 ), ( 128, 80 ), ( 64, 80 ), ( 32, 120 ) )
+# Score lost per quality step, halving the pixels or the fps loses 1.
+QUALITY_WEIGHT = 0.5
+# Smallest side of a GIF in pixels.
+MIN_SIDE = 16
+# Plans aim this much below the budget, estimates are rough.
+SAFETY = 0.95
+# Bounds of the power law exponent of bytes over pixels beyond the sizes
+# measured.
+MIN_EXPONENT = 0.5
+MAX_EXPONENT = 1.1
+
+_SIZE_UNITS = { '': 1, 'b': 1, 'k': 1024, 'kb': 1024, 'm': 1024 ** 2, 'mb': 1024 ** 2, 'g': 1024 ** 3,
+                'gb': 1024 ** 3 }
+
+
+def parse_size( text ):
+    """ Bytes of a size like '5M', '800 KB' or '123456'. """
+    match = re.match( r'^\s*([0-9.]+)\s*([a-zA-Z]*)\s*$', str( text ) )
+    if not match or match.group( 2 ).lower() not in _SIZE_UNITS:
+        raise ValueError( 'Invalid size {!r}, expected e.g. 5M or 800K'.format( text ) )
+    return int( float( match.group( 1 ) ) * _SIZE_UNITS[ match.group( 2 ).lower() ] )
+
+
+def interpolate( points, area ):
+    """
+    Bytes at area from ( area, bytes ) points sorted by area, linear in log
+    scales between points, along a power law (exponent clamped) outside.
+    """
+    if len( points ) == 1:
+        return points[ 0 ][ 1 ] * area / points[ 0 ][ 0 ]
+    if area <= points[ 0 ][ 0 ]:
+        pair = points[ :2 ]
+    elif area >= points[ -1 ][ 0 ]:
+        pair = points[ -2: ]
+    else:
+        pair = next( points[ index:index + 2 ] for index in range( len( points ) - 1 )
+                     if points[ index ][ 0 ] <= area <= points[ index + 1 ][ 0 ] )
+    ( low_area, low ), ( high_area, high ) = pair
+    if low <= 0 or high <= 0:
+        return max( low, high ) * area / high_area
+    exponent = math.log( high / low ) / math.log( high_area / low_area )
+    if not low_area <= area <= high_area:
+        exponent = min( max( exponent, MIN_EXPONENT ), MAX_EXPONENT )
+    return low * ( area / low_area ) ** exponent
+
+
+class SizeModel( object ):
+    """
+    Estimated GIF bytes of info at other scales, fps and quality steps, from
+    sampled frames. Measuring decodes and encodes the samples right away,
+    reported to progress as the plan stage.
+    """
+
+    def __init__( self, info, progress=None, cancel=None ):
+        from engine.decode import resize_frames
+
+        if progress is None:
+            progress = ProgressReporter()
+        if cancel is None:
+            cancel = CancelToken()
+        metadata   = video_metadata( info.video )
+        self.info  = info
+        self.size  = output_size( info, metadata[ 'size' ] ) or list( metadata[ 'size' ] )
+        self.fps   = info.fps or metadata[ 'fps' ]
+        self.steps = self.quality_steps()
+
+        progress.stage( 'plan', SAMPLE_POINTS )
+        sizes = []
+        for side in MEASURE_SIDES:
+            ratio = min( side / max( self.size ), 1 )
+            size  = [ max( int( round( length * ratio ) ), MIN_SIDE ) for length in self.size ]
+            if size not in sizes:
+                sizes.append( size )
+        runs = self.sample_runs( metadata, sizes[ 0 ], progress, cancel )
+        if not runs:
+            raise ValueError( 'No frames to sample in {}'.format( info.video ) )
+
+        # ( area, first frame bytes ) and ( area, bytes per further frame )
+        # of the best quality step by size, smallest first.
+        self.first = []
+        self.rest  = []
+        # Bytes of every quality step relative to the best one.
+        self.ratios = [ ( 1.0, 1.0 ) ] * len( self.steps )
+        quality     = min( sizes, key=lambda size: abs( max( size ) - QUALITY_SIDE ) )
+        for size in reversed( sizes ):
+            resized = [ list( resize_frames( run, size, info.resize_filter ) ) if size != sizes[ 0 ] else run
+                        for run in runs ]
+            first, rest = self.measure( resized, *self.steps[ 0 ], cancel=cancel )
+            self.first.append( ( size[ 0 ] * size[ 1 ], first ) )
+            self.rest.append( ( size[ 0 ] * size[ 1 ], rest ) )
+            if size == quality:
+                for step, ( colors, lossy ) in enumerate( self.steps[ 1: ], 1 ):
+                    step_first, step_rest = self.measure( resized, colors, lossy, cancel )
+                    self.ratios[ step ] = ( step_first / first if first else 1.0,
+                                            step_rest / rest if rest else 1.0 )
+
+    def quality_steps( self ):
+        """ ( colors, lossy ) steps for info, the job's own first. """
+        info  = self.info
+        steps = []
+        for colors, lossy in ( ( info.colors, info.lossy ), ) + QUALITY_STEPS:
+            colors = min( colors, info.colors )
+            # ffmpeg's GIF encoder is never lossy.
+            lossy  = 0 if info.engine == 'ffmpeg' else max( lossy, info.lossy )
+            if ( colors, lossy ) not in steps:
+                steps.append( ( colors, lossy ) )
+        return steps
+
+    def sample_runs( self, metadata, size, progress, cancel ):
+        """ Runs of SAMPLE_RUN consecutive GIF frames at size, at SAMPLE_POINTS times over the clip. """
+        from engine.decode import FrameReader, frame_plan, planned_frames, select_expression, selected_plan
+        from engine.keyframes import keyframes
+
+        info     = self.info
+        speed    = info.speed or 1
+        start    = info.start or 0
+        end      = info.end if info.end is not None else metadata[ 'duration' ]
+        duration = min( SAMPLE_RUN * speed / self.fps, max( end - start, 0 ) )
+        index    = keyframes( info.video )
+        runs     = []
+        for point in range( SAMPLE_POINTS ):
+            time   = start + ( end - start - duration ) * ( point + 0.5 ) / SAMPLE_POINTS
+            plan   = frame_plan( metadata[ 'fps' ], self.fps, speed, duration )
+            select = select_expression( metadata[ 'fps' ], self.fps, speed, plan )
+            if select:
+                plan = selected_plan( plan )
+            reader = FrameReader( info.video, metadata[ 'size' ], time, duration, keyframes=index,
+                                  output_size=size, resize_filter=info.resize_filter, select=select )
+            kill = cancel.on_cancel( reader.kill )
+            try:
+                run = list( planned_frames( reader, plan ) )
+            finally:
+                cancel.forget( kill )
+                reader.close()
+            cancel.check()
+            if run:
+                runs.append( run )
+            progress.advance( 1 )
+        return runs
+
+    def measure( self, runs, colors, lossy, cancel ):
+        """ Average ( first frame bytes, bytes per further frame ) of runs encoded with colors and lossy. """
+        first = rest = 0
+        for run in runs:
+            cancel.check()
+            alone  = self.encoded_bytes( run[ :1 ], colors, lossy )
+            first += alone
+            if len( run ) > 1:
+                rest += ( self.encoded_bytes( run, colors, lossy ) - alone ) / ( len( run ) - 1 )
+        return first / len( runs ), rest / len( runs )
+
+    def encoded_bytes( self, frames, colors, lossy ):
+        from engine.gif import write_gif
+
+        info   = self.info
+        buffer = io.BytesIO()
+        write_gif( frames, buffer, self.fps, quantizer=info.quantizer, colors=colors, sampling=info.sampling,
+                   delta=info.delta, dithering=info.dither, lossy=lossy )
+        return len( buffer.getvalue() )
+
+    def estimate( self, scale, fps, step ):
+        """ Estimated bytes of the GIF at scale times the job's size, fps and quality step number step. """
+        area   = scale * scale * self.size[ 0 ] * self.size[ 1 ]
+        first  = interpolate( self.first, area ) * self.ratios[ step ][ 0 ]
+        rest   = interpolate( self.rest, area ) * self.ratios[ step ][ 1 ]
+        frames = expected_frames( self.info, fps ) * ( 2 if self.info.mirrored else 1 )
+        return first + ( frames - 1 ) * rest
+
+    def largest_scale( self, max_bytes, fps, step, correction ):
+        """ Largest scale, at most 1, expected to fit max_bytes at fps and step, None if none does. """
+        low = max( MIN_SIDE / min( self.size ), 0.001 )
+        if low >= 1:
+            low = 1
+        if self.estimate( low, fps, step ) * correction > max_bytes:
+            return None
+        high = 1.0
+        if self.estimate( high, fps, step ) * correction <= max_bytes:
+            return high
+        for _ in range( 24 ):
+            middle = ( low + high ) / 2
+            if self.estimate( middle, fps, step ) * correction <= max_bytes:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def plan( self, max_bytes, correction=1.0 ):
+        """
+        Copy of info expected to be at most max_bytes, with estimates
+        multiplied by correction, and its estimated bytes. The plan keeps
+        the most pixels, then frames, then quality, see QUALITY_WEIGHT.
+        When nothing fits, the smallest plan.
+        """
+        target  = max_bytes * SAFETY
+        fps_set = sorted( set( max( self.fps * step, min( MIN_FPS, self.fps ) ) for step in FPS_STEPS ),
+                          reverse=True )
+        best = None
+        for fps in fps_set:
+            for step in range( len( self.steps ) ):
+                scale = self.largest_scale( target, fps, step, correction )
+                if scale is None:
+                    continue
+                score = 2 * math.log( scale, 2 ) + math.log( fps / self.fps, 2 ) - QUALITY_WEIGHT * step
+                if best is None or score > best[ 0 ]:
+                    best = ( score, scale, fps, step )
+        if best is None:
+            best = ( None, max( MIN_SIDE / min( self.size ), 0.001 ), fps_set[ -1 ], len( self.steps ) - 1 )
+        _, scale, fps, step = best
+        return self.planned_info( scale, fps, step ), self.estimate( scale, fps, step ) * correction
+
+    def planned_info( self, scale, fps, step ):
+        planned = copy.copy( self.info )
+        colors, lossy = self.steps[ step ]
+        planned.scale = None
+        planned.update_width( max( int( round( self.size[ 0 ] * min( scale, 1 ) ) ), 1 ) )
+        planned.update_height( max( int( round( self.size[ 1 ] * min( scale, 1 ) ) ), 1 ) )
+        planned.update_fps( fps )
+        planned.update_colors( colors )
+        planned.update_lossy( lossy )
+        planned.max_bytes = None
+        return planned
+
+
+def describe_plan( info ):
+    """ One line summary of the parameters a plan changes. """
+    return u'{}x{}, {:.3g} fps, {} colors, lossy {:g}'.format( int( info.width ), int( info.height ), info.fps,
+                                                              info.colors, info.lossy )
+
+
+def make_gif_for_size( info, gif_name, verbose=True, progress=None, cancel=None ):
+    """
+    Make the GIF of info (see make_gif) at the largest scale, fps and
+    quality expected to fit in info.max_bytes, found by a SizeModel. If the
+    GIF is still too big, it is made once more with estimates corrected by
+    how far off they were. Return the number of frames written.
+    """
+    if progress is None:
+        progress = ProgressReporter( print_event if verbose else None )
+    if cancel is None:
+        cancel = CancelToken()
+    max_bytes         = info.max_bytes
+    model             = SizeModel( info, progress, cancel )
+    planned, estimate = model.plan( max_bytes )
+    logging.info( u'Planned {} for {} bytes, about {:.0f}'.format( describe_plan( planned ), max_bytes, estimate ) )
+    frames = make_gif( planned, gif_name, verbose, progress, cancel )
+
+    size = os.path.getsize( gif_name )
+    if size > max_bytes:
+        planned, estimate = model.plan( max_bytes, correction=size / max( estimate, 1 ) )
+        logging.info( u'{} bytes is over budget, planned {}'.format( size, describe_plan( planned ) ) )
+        frames = make_gif( planned, gif_name, verbose, progress, cancel )
+    return frames
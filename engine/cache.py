@@ -0,0 +1,63 @@
+"""
+On disk cache of per-video data such as the keyframe index.
+
+Every video has one JSON entry, keyed by its absolute path, size and
+modification time, so an entry is dropped automatically when the video
+changes. The cache lives in GIFER_CACHE_DIR, default ~/.cache/gifer.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+
+def cache_dir( ):
+    return os.getenv( 'GIFER_CACHE_DIR' ) or os.path.join( os.path.expanduser( '~' ), '.cache', 'gifer' )
+
+
+def video_key( video ):
+    """ Cache key of a video file from its path, size and modification time. """
+    stat = os.stat( video )
+    path = os.path.abspath( video )
+    if not isinstance( path, bytes ):
+        path = path.encode( 'utf-8' )
+    key  = hashlib.sha1( path )
+    key.update( '{}:{}'.format( stat.st_size, stat.st_mtime ).encode( 'ascii' ) )
+    return key.hexdigest()
+
+
+def _entry_name( video ):
+    return os.path.join( cache_dir(), video_key( video ) + '.json' )
+
+
+def load_entry( video ):
+    """ Cached data of video as a dict, empty if nothing is cached. """
+    try:
+        with open( _entry_name( video ) ) as entry:
+            return json.load( entry )
+    except ( IOError, OSError, ValueError ):
+        return {}
+
+
+def update_entry( video, **sections ):
+    """ Add or replace sections of the cache entry of video. """
+    entry = load_entry( video )
+    entry.update( sections )
+    name  = _entry_name( video )
+    try:
+        if not os.path.isdir( cache_dir() ):
+            os.makedirs( cache_dir() )
+        # Write to a temporary file first so readers never see half an entry.
+        handle, temp_name = tempfile.mkstemp( dir=cache_dir(), suffix='.tmp' )
+        with os.fdopen( handle, 'w' ) as temp:
+            json.dump( entry, temp )
+        try:
+            os.rename( temp_name, name )
+        except OSError:
+            # Windows does not rename over an existing file.
+            os.remove( name )
+            os.rename( temp_name, name )
+    except ( IOError, OSError ) as err:
+        logging.warning( 'Could not write cache entry of {}: {}'.format( video, err ) )
+    return entry
@@ -0,0 +1,64 @@
+"""
+Cooperative cancellation of GIF jobs.
+
+A CancelToken is shared between the thread running a job and the one that
+may cancel it. The job checks it between frames and raises Cancelled, while
+cancel runs the callbacks registered by the job right away, which kill the
+ffmpeg processes it waits on, so a cancelled job never sits blocked in a pipe
+read.
+"""
+import threading
+
+
+class Cancelled( Exception ):
+    """ Raised inside a job whose CancelToken was cancelled. """
+
+
+class CancelToken( object ):
+    """ Cancellation flag of a job, with callbacks run once when it is cancelled. """
+
+    def __init__( self ):
+        self.event     = threading.Event()
+        self.lock      = threading.Lock()
+        self.callbacks = []
+
+    @property
+    def cancelled( self ):
+        return self.event.is_set()
+
+    def cancel( self ):
+        """ Cancel the job, run callbacks registered by on_cancel in the calling thread. """
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def check( self ):
+        """ Raise Cancelled if the job was cancelled. """
+        if self.event.is_set():
+            raise Cancelled( 'GIF making cancelled' )
+
+    def on_cancel( self, callback ):
+        """ Run callback on cancel, now if already cancelled. Return callback for forget. """
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append( callback )
+                return callback
+        callback()
+        return callback
+
+    def forget( self, callback ):
+        """ Do not run callback on cancel any more, e.g. once its process has exited. """
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove( callback )
+
+
+def checked( frames, cancel ):
+    """ Pass frames through, checking cancel before each. """
+    for frame in frames:
+        cancel.check()
+        yield frame
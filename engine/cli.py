@@ -0,0 +1,226 @@
+"""
+Command line interface of GIFer.
+
+    python -m engine video.mp4 -o out.gif --start 10 --end 15 --scale 0.5 --fps 15
+    python -m engine video.mp4 --start 10 --end 20 --max-size 5M
+    python -m engine --batch jobs.json --processes 32 --summary summary.json
+    python -m engine --probe videos/
+    python -m engine --optimize gifs/ --encode-processes 0
+    python -m engine video.mp4 --engine gifer --trace trace.json
+
+Only the engine is imported, PyQt4 is never loaded, so it runs on headless
+machines without a display.
+"""
+from __future__ import print_function
+import argparse
+import json
+import logging
+import os
+import sys
+
+from engine import instrument
+from engine.batch import read_manifest, run_batch, write_summary
+from engine.budget import parse_size
+from engine.decode import TIMELAPSE_SNAPS
+from engine.dither import DITHERS
+from engine.ffmpeg import RESIZE_FILTERS
+from engine.info import Info
+from engine.optimize import gif_files, optimize_gif
+from engine.palette import QUANTIZERS, SAMPLINGS
+from engine.progress import DEFAULT_INTERVAL, ProgressReporter, format_bytes, print_event
+from engine.probe import PROBE_THREADS, probe_directory, probe_many
+from engine.render import ENGINES, default_gif_name, make_gif
+
+
+def to_unicode( text ):
+    """ Command line arguments are bytes in Python 2.X, Info expects unicode. """
+    if isinstance( text, bytes ):
+        return text.decode( sys.getfilesystemencoding() or 'utf-8' )
+    return text
+
+
+def build_parser( ):
+    parser = argparse.ArgumentParser( prog='gifer', description='Make GIF animation from video file.' )
+    parser.add_argument( 'video', nargs='?', help='video source file to generate GIF' )
+    parser.add_argument( '-o', '--output', help='GIF file to write, default is video name with .gif extension' )
+    parser.add_argument( '--start', type=float, default=0.0, help='starting time in second, default 0' )
+    parser.add_argument( '--end', type=float, help='ending time in second, default end of video' )
+    parser.add_argument( '--width', type=float, help='width of animation in pixel' )
+    parser.add_argument( '--height', type=float, help='height of animation in pixel' )
+    parser.add_argument( '--scale', type=float, help='resize by multiplying (width, height) with scale' )
+    parser.add_argument( '--resize-filter', choices=RESIZE_FILTERS, default='lanczos',
+                         help='scaling filter, applied while decoding, default lanczos' )
+    parser.add_argument( '--fps', type=float, help="frames per second, default is video's fps" )
+    parser.add_argument( '--speed', type=float, default=1.0, help='play speed of animation, default 1.0' )
+    parser.add_argument( '--mirror', action='store_true', help='make time symmetric GIF animation' )
+    parser.add_argument( '--snap-keyframe', action='store_true',
+                         help='move start back to the keyframe before it, fastest to decode' )
+    parser.add_argument( '--engine', choices=ENGINES, default='moviepy', help='GIF writing engine, default moviepy' )
+    parser.add_argument( '--quantizer', choices=QUANTIZERS,
+                         help='build one global palette with this quantizer, default one palette per frame' )
+    parser.add_argument( '--colors', type=int, default=256, help='maximum colors of a palette, default 256' )
+    parser.add_argument( '--sampling', choices=SAMPLINGS, default='stride',
+                         help='how frames of the global palette are picked, default stride' )
+    parser.add_argument( '--delta', action='store_true',
+                         help='only write the changed rectangle of every frame, needs a global palette' )
+    parser.add_argument( '--timelapse', action='store_true',
+                         help='decode keyframes only, for very high speeds (ffmpeg and gifer engines)' )
+    parser.add_argument( '--timelapse-snap', choices=TIMELAPSE_SNAPS, default='before',
+                         help='show the keyframe before every frame time or the nearest one, default before' )
+    parser.add_argument( '--dither', choices=DITHERS,
+                         help="dithering, default none (ffmpeg's default with the ffmpeg engine)" )
+    parser.add_argument( '--lossy', type=float, default=0,
+                         help='lossy LZW strength, the color distance pixels may be off by for smaller files, '
+                              'e.g. 20 to 80, default 0 is lossless (not with the ffmpeg engine)' )
+    parser.add_argument( '--max-size', type=parse_size,
+                         help='size budget, e.g. 5M or 800K: scale, fps, colors and lossy are chosen to fit it' )
+    parser.add_argument( '--encode-processes', type=int, default=1,
+                         help='processes LZW encoding frames, 0 for one per CPU core, default 1' )
+    parser.add_argument( '--encode-window', type=int,
+                         help='maximum frames being encoded at once, default 4 per encoding process' )
+    parser.add_argument( '--progress-interval', type=float, default=DEFAULT_INTERVAL,
+                         help='seconds between progress lines, default {}'.format( DEFAULT_INTERVAL ) )
+    parser.add_argument( '-q', '--quiet', action='store_true', help='do not print progress' )
+    parser.add_argument( '--trace', metavar='FILE',
+                         help='time stages and frames, write a Chrome / Perfetto trace to FILE and print a '
+                              'summary, as the GIFER_TRACE environment variable does' )
+    parser.add_argument( '--trace-memory', action='store_true',
+                         help='with --trace, trace memory with tracemalloc at stage boundaries (slow)' )
+
+    batch = parser.add_argument_group( 'batch mode' )
+    batch.add_argument( '--batch', metavar='MANIFEST', help='JSON or CSV manifest of jobs to render' )
+    batch.add_argument( '-j', '--processes', type=int, help='number of worker processes, default is CPU count' )
+    batch.add_argument( '--summary', default='gifer_summary.json',
+                        help='per job timing summary, CSV if name ends with .csv, default gifer_summary.json' )
+
+    probe = parser.add_argument_group( 'probe mode' )
+    probe.add_argument( '--probe', metavar='PATH', nargs='+',
+                        help='print size, duration and fps of videos or directories of videos and cache them' )
+    probe.add_argument( '--threads', type=int, default=PROBE_THREADS,
+                        help='number of concurrent probes, default {}'.format( PROBE_THREADS ) )
+
+    optimize = parser.add_argument_group( 'optimize mode' )
+    optimize.add_argument( '--optimize', metavar='PATH', nargs='+',
+                           help='losslessly shrink GIFs or directories of GIFs in place, or to --output for one '
+                                'GIF, encoding with --encode-processes' )
+    return parser
+
+
+def info_from_args( args ):
+    """ Build Info object from parsed command line arguments. """
+    info = Info()
+    info.update_video( to_unicode( args.video ) )
+    info.update_start( args.start )
+    info.update_end( args.end )
+    info.update_width( args.width )
+    info.update_height( args.height )
+    info.update_scale( args.scale )
+    info.update_resize_filter( args.resize_filter )
+    info.update_fps( args.fps )
+    info.update_speed( args.speed )
+    info.update_mirror( args.mirror )
+    info.update_engine( args.engine )
+    info.update_snap_keyframe( args.snap_keyframe )
+    info.update_quantizer( args.quantizer )
+    info.update_colors( args.colors )
+    info.update_sampling( args.sampling )
+    info.update_delta( args.delta )
+    info.update_timelapse( args.timelapse, args.timelapse_snap )
+    info.update_dither( args.dither )
+    info.update_lossy( args.lossy )
+    info.update_max_bytes( args.max_size )
+    info.update_encode_processes( args.encode_processes )
+    info.update_encode_window( args.encode_window )
+    return info
+
+
+def main_batch( args ):
+    summaries = run_batch( read_manifest( args.batch ), processes=args.processes,
+                           progress=None if args.quiet else print_event, interval=args.progress_interval )
+    write_summary( summaries, args.summary )
+
+    failed = [ summary for summary in summaries if summary[ 'error' ] ]
+    for summary in failed:
+        print( u'{}: {}'.format( summary[ 'video' ], summary[ 'error' ] ), file=sys.stderr )
+    print( u'{} of {} jobs done, summary written to {}'.format( len( summaries ) - len( failed ),
+                                                                len( summaries ), args.summary ) )
+    return 1 if failed else 0
+
+
+def main_probe( args ):
+    results = {}
+    videos  = []
+    for path in args.probe:
+        if os.path.isdir( path ):
+            results.update( probe_directory( path, threads=args.threads ) )
+        else:
+            videos.append( path )
+    results.update( probe_many( videos, threads=args.threads ) )
+
+    failed = 0
+    for video in sorted( results ):
+        if isinstance( results[ video ], Exception ):
+            failed += 1
+            results[ video ] = { 'error': str( results[ video ] ) }
+    print( json.dumps( results, indent=2, sort_keys=True ) )
+    return 1 if failed else 0
+
+
+def main_optimize( args ):
+    files = gif_files( [ to_unicode( path ) for path in args.optimize ] )
+    if args.output and len( files ) != 1:
+        print( u'--output needs a single GIF to optimize', file=sys.stderr )
+        return 2
+
+    failed = 0
+    for gif_name in files:
+        progress = ProgressReporter( None if args.quiet else print_event, interval=args.progress_interval )
+        try:
+            before, after = optimize_gif( gif_name, to_unicode( args.output ) if args.output else None,
+                                          processes=args.encode_processes, window=args.encode_window,
+                                          progress=progress )
+        except ( IOError, OSError, ValueError ) as error:
+            failed += 1
+            print( u'{}: {}'.format( gif_name, error ), file=sys.stderr )
+            continue
+        print( u'{}: {} -> {} ({:.1f}%)'.format( gif_name, format_bytes( before ), format_bytes( after ),
+                                                 100.0 * after / max( before, 1 ) ) )
+    return 1 if failed else 0
+
+
+def main( argv ):
+    parser = build_parser()
+    args   = parser.parse_args( argv )
+    if args.trace:
+        instrument.start( to_unicode( args.trace ), memory=args.trace_memory )
+    try:
+        return main_mode( parser, args )
+    finally:
+        if args.trace:
+            instrument.finish()
+
+
+def main_mode( parser, args ):
+    if args.batch:
+        return main_batch( args )
+    if args.probe:
+        return main_probe( args )
+    if args.optimize:
+        return main_optimize( args )
+    if not args.video:
+        parser.error( 'a video file or --batch manifest is required' )
+
+    info     = info_from_args( args )
+    gif_name = to_unicode( args.output ) if args.output else default_gif_name( info.video )
+    if info.max_bytes and not args.quiet:
+        # Show the parameters planned for the size budget.
+        logging.basicConfig( level=logging.INFO, format='%(message)s' )
+
+    make_gif( info, gif_name, progress=ProgressReporter( None if args.quiet else print_event,
+                                                         interval=args.progress_interval ) )
+    print( gif_name )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit( main( sys.argv[ 1: ] ) )
@@ -0,0 +1,264 @@
+"""
+Frame decoding through an ffmpeg pipe.
+"""
+from __future__ import division
+import bisect
+import math
+import subprocess as sp
+import tempfile
+
+import numpy as np
+
+from engine.ffmpeg import ffmpeg_exe
+from engine.keyframes import seek_arguments
+
+
+TIMELAPSE_SNAPS = [ 'before', 'nearest' ]
+
+# Slack for frame times computed in floating point.
+PLAN_EPSILON = 0.00001
+
+
+class FrameReader( object ):
+    """
+    Iterate over RGB frames (numpy arrays) of video from start, for duration
+    seconds or till the end.
+
+    With a keyframe index ffmpeg jumps straight to the keyframe before start
+    and only decodes and drops the frames between the keyframe and start.
+
+    size is the size of the video. With output_size frames are scaled by
+    ffmpeg with resize_filter, one of engine.ffmpeg.RESIZE_FILTERS, so only
+    scaled frames go through the pipe. With select, an ffmpeg select
+    expression (see select_expression), only the frames it selects are
+    converted, scaled and sent.
+
+    With keyframes_only the decoder skips every frame but keyframes, from
+    the keyframe before start on, see keyframe_plan.
+
+    Raise IOError with ffmpeg's error output if ffmpeg fails, unless it was
+    killed by kill or close.
+    """
+
+    def __init__( self, video, size, start=0, duration=None, keyframes=None, output_size=None,
+                  resize_filter='lanczos', select=None, keyframes_only=False ):
+        self.video          = video
+        self.size           = size
+        self.start          = start or 0
+        self.duration       = duration
+        self.keyframes      = keyframes
+        self.output_size    = output_size
+        self.resize_filter  = resize_filter
+        self.select         = select
+        self.keyframes_only = keyframes_only
+        self.proc           = None
+        self.errors         = None
+        self.killed         = False
+
+    def command( self ):
+        seek, offset = seek_arguments( self.start, self.keyframes )
+        duration     = self.duration
+        if self.keyframes_only:
+            # The keyframe before start is the first frame.
+            seek     = [ '-skip_frame', 'nokey' ] + seek
+            duration = duration + offset if duration is not None else None
+            offset   = 0
+        cmd     = [ ffmpeg_exe(), '-v', 'error', '-nostdin' ] + seek + [ '-i', self.video ]
+        filters = []
+        trim    = []
+        if offset > 0:
+            # Frames between the keyframe and start are decoded and dropped.
+            trim.append( 'start={:.6f}'.format( offset ) )
+        if duration is not None:
+            trim.append( 'duration={:.6f}'.format( duration ) )
+        if trim:
+            filters += [ 'trim=' + ':'.join( trim ), 'setpts=PTS-STARTPTS' ]
+        if self.select:
+            # Frame numbers n count from start, after trim.
+            filters.append( "select='{}'".format( self.select ) )
+        if self.output_size:
+            filters.append( 'scale={}:{}:flags={}'.format( self.output_size[ 0 ], self.output_size[ 1 ],
+                                                           self.resize_filter ) )
+        if filters:
+            cmd += [ '-vf', ','.join( filters ) ]
+        # Pass frames through as they come, ffmpeg would otherwise duplicate
+        # or drop frames to keep a constant rate. -vsync works in old and new ffmpeg.
+        cmd += [ '-vsync', '0', '-an', '-sn', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-' ]
+        return cmd
+
+    def __iter__( self ):
+        width, height = self.output_size or self.size
+        frame_bytes   = width * height * 3
+        # Error output goes to a file, a full stderr pipe would block ffmpeg.
+        self.errors   = tempfile.TemporaryFile()
+        self.killed   = False
+        self.proc     = sp.Popen( self.command(), stdout=sp.PIPE, stderr=self.errors, bufsize=frame_bytes )
+        try:
+            while True:
+                data = self.proc.stdout.read( frame_bytes )
+                if len( data ) < frame_bytes:
+                    # Let ffmpeg exit by itself, close checks how it did.
+                    self.proc.wait()
+                    break
+                yield np.frombuffer( data, dtype=np.uint8 ).reshape( height, width, 3 )
+        finally:
+            self.close()
+
+    def kill( self ):
+        """
+        Kill ffmpeg, may be called from another thread: the one iterating
+        sees the end of the frames. close still has to be called.
+        """
+        proc = self.proc
+        if proc is not None and proc.poll() is None:
+            self.killed = True
+            proc.kill()
+
+    def close( self ):
+        """
+        Stop ffmpeg if it is still running. Raise IOError with its error
+        output if it exited with an error by itself.
+        """
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            # Kill, a terminated ffmpeg flushes its output first, which blocks
+            # forever if a forked process (an encoding pool) holds the pipe.
+            self.killed = True
+            self.proc.kill()
+        self.proc.stdout.close()
+        self.proc.wait()
+        code, self.proc = self.proc.returncode, None
+        self.errors.seek( 0 )
+        error = self.errors.read()
+        self.errors.close()
+        if code != 0 and not self.killed:
+            raise IOError( 'ffmpeg failed with code {} decoding {}:\n{}'.format(
+                code, self.video, error.decode( 'utf-8', 'replace' ) ) )
+
+
+def frame_step( source_fps, fps, speed ):
+    """ Source frames per GIF frame. """
+    return speed * source_fps / fps
+
+
+def frame_plan( source_fps, fps, speed, duration ):
+    """
+    Index of the source frame, counted from start, shown by every frame of
+    a GIF at fps played speed times faster. duration is the clip length in
+    the source. Like MoviePy, the frame shown at time t is the last one
+    decoded at or before t.
+    """
+    step  = frame_step( source_fps, fps, speed )
+    count = int( math.ceil( duration / speed * fps ) )
+    return [ int( index * step + PLAN_EPSILON ) for index in range( count ) ]
+
+
+def select_expression( source_fps, fps, speed, plan ):
+    """
+    ffmpeg select expression keeping exactly the source frames of plan (see
+    frame_plan), None when every frame is needed. Frame n is kept when some
+    GIF frame index k has int( k * step + PLAN_EPSILON ) == n.
+    """
+    step = frame_step( source_fps, fps, speed )
+    if step <= 1 or not plan:
+        return None
+    return 'lt(ceil((n-{epsilon})/{step}),(n+1-{epsilon})/{step})*lte(n,{last})'.format(
+        epsilon=PLAN_EPSILON, step=repr( step ), last=plan[ -1 ] )
+
+
+def selected_plan( plan ):
+    """ plan over the frames kept by select_expression: the rank of every index among those of plan. """
+    ranks = []
+    for position, index in enumerate( plan ):
+        ranks.append( ranks[ -1 ] + ( index != plan[ position - 1 ] ) if position else 0 )
+    return ranks
+
+
+def keyframe_plan( times, start, fps, speed, duration, nearest=False ):
+    """
+    Time-lapse plan: index of the keyframe shown by every frame of a GIF at
+    fps played speed times faster, counted from the keyframe before start.
+    times is the keyframe index of the video. Every GIF frame shows the
+    latest keyframe at or before its time, or with nearest the closest
+    keyframe within the clip.
+    """
+    first = max( bisect.bisect_right( times, start + 1e-6 ) - 1, 0 )
+    last  = max( bisect.bisect_right( times, start + duration + 1e-6 ) - 1, first )
+    plan  = []
+    for index in range( int( math.ceil( duration / speed * fps ) ) ):
+        time     = start + index * speed / fps
+        keyframe = max( bisect.bisect_right( times, time + 1e-6 ) - 1, first )
+        if nearest and keyframe < last and times[ keyframe + 1 ] - time < time - times[ keyframe ]:
+            keyframe += 1
+        plan.append( keyframe - first )
+    return plan
+
+
+def planned_frames( frames, plan ):
+    """
+    Frames shown by the GIF frames of plan, indices into frames in non
+    decreasing order. Every frame is read once and repeated as long as the
+    plan shows it, frames the plan skips are read and dropped.
+    """
+    source = iter( frames )
+    index  = -1
+    frame  = None
+    for wanted in plan:
+        while index < wanted:
+            # Keep showing the last frame if the video ends early.
+            frame  = next( source, frame )
+            index += 1
+        if frame is None:
+            return
+        yield frame
+
+
+def area_average( frame, size ):
+    """
+    Shrink frame to size ( width, height ) by integer factors, averaging
+    every block of pixels. Rows and columns of a block are added up slice by
+    slice, which is much faster than a sum over reshaped axes.
+    """
+    height, width = frame.shape[ :2 ]
+    x_factor      = width // size[ 0 ]
+    y_factor      = height // size[ 1 ]
+    pixels        = x_factor * y_factor
+    dtype         = np.uint16 if pixels <= 256 else np.uint32
+
+    rows  = frame.reshape( size[ 1 ], y_factor, -1 )
+    total = rows[ :, 0 ].astype( dtype )
+    for row in range( 1, y_factor ):
+        total += rows[ :, row ]
+    columns = total.reshape( size[ 1 ], size[ 0 ], x_factor, -1 )
+    total   = columns[ :, :, 0 ].copy()
+    for column in range( 1, x_factor ):
+        total += columns[ :, :, column ]
+    total += pixels // 2
+    total //= pixels
+    return total.astype( np.uint8 ).reshape( ( size[ 1 ], size[ 0 ] ) + frame.shape[ 2: ] )
+
+
+def resize_frames( frames, size, resize_filter='lanczos' ):
+    """
+    Resize frames to size ( width, height ) in process with resize_filter,
+    one of engine.ffmpeg.RESIZE_FILTERS. Prefer scaling while decoding (see
+    FrameReader) which moves fewer bytes. The area filter shrinking by
+    integer factors is a plain NumPy block average.
+    """
+    from PIL import Image
+
+    lanczos   = Image.LANCZOS if hasattr( Image, 'LANCZOS' ) else Image.ANTIALIAS
+    resamples = { 'fast_bilinear': Image.BILINEAR,
+                  'bilinear'     : Image.BILINEAR,
+                  'area'         : getattr( Image, 'BOX', Image.BILINEAR ),
+                  'bicubic'      : Image.BICUBIC,
+                  'lanczos'      : lanczos, }
+    resample  = resamples.get( resize_filter, lanczos )
+    for frame in frames:
+        height, width = frame.shape[ :2 ]
+        if ( resize_filter == 'area' and width % size[ 0 ] == 0 and height % size[ 1 ] == 0
+                and width >= size[ 0 ] and height >= size[ 1 ] ):
+            yield area_average( frame, size )
+        else:
+            yield np.asarray( Image.fromarray( frame ).resize( tuple( size ), resample ) )
@@ -0,0 +1,116 @@
+"""
+Dithering of RGB frames to palette indices.
+
+- none, nearest palette color of every pixel.
+- bayer4 / bayer8, ordered dithering with a 4x4 or 8x8 Bayer matrix.
+- blue-noise, threshold dithering with a 64x64 blue noise tile, no visible
+  pattern and, like ordered dithering, stable from frame to frame.
+- floyd-steinberg, error diffusion, by PIL's C implementation.
+
+Threshold modes add a tiled offset to the whole frame and look colors up in
+the palette's lookup table (see engine.palette.lookup), so they cost
+about the same as no dithering at all.
+"""
+from __future__ import division
+
+import numpy as np
+
+from engine.palette import lookup, palette_lut
+
+
+DITHERS = [ 'none', 'bayer4', 'bayer8', 'blue-noise', 'floyd-steinberg' ]
+
+BLUE_NOISE_SIZE = 64
+
+_thresholds = {}
+
+
+def bayer_matrix( size ):
+    """ size x size Bayer matrix, size a power of two, values 0 to size ** 2 - 1. """
+    matrix = np.zeros( ( 1, 1 ), dtype=np.int64 )
+    while len( matrix ) < size:
+        matrix = np.block( [ [ 4 * matrix,     4 * matrix + 2 ],
+                             [ 4 * matrix + 3, 4 * matrix + 1 ] ] )
+    return matrix
+
+
+def blue_noise( size=BLUE_NOISE_SIZE, seed=0 ):
+    """
+    size x size tile of blue noise ranks, values 0 to size ** 2 - 1.
+    White noise is high-pass filtered a few times (on the torus, so the tile
+    wraps) and ranked, which leaves mostly high frequencies.
+    """
+    noise     = np.random.RandomState( seed ).rand( size, size )
+    freq      = np.fft.fftfreq( size )
+    radius    = np.sqrt( freq[ :, None ] ** 2 + freq[ None, : ] ** 2 )
+    high_pass = 1 - np.exp( -( radius / 0.15 ) ** 2 )
+    for _ in range( 4 ):
+        noise = np.real( np.fft.ifft2( np.fft.fft2( noise ) * high_pass ) )
+        noise = np.argsort( np.argsort( noise.ravel() ) ).reshape( size, size ).astype( np.float64 )
+    return noise.astype( np.int64 )
+
+
+def threshold_map( method ):
+    """ Tile of thresholds in [ -0.5, 0.5 ) of an ordered or blue-noise method. """
+    if method not in _thresholds:
+        if method == 'bayer4':
+            ranks = bayer_matrix( 4 )
+        elif method == 'bayer8':
+            ranks = bayer_matrix( 8 )
+        elif method == 'blue-noise':
+            ranks = blue_noise()
+        else:
+            raise ValueError( 'No threshold map for dithering {}'.format( method ) )
+        _thresholds[ method ] = ( ranks + 0.5 ) / ranks.size - 0.5
+    return _thresholds[ method ]
+
+
+def spread( palette ):
+    """
+    Amplitude of threshold dithering. Palettes fit to a frame are denser
+    than a uniform grid of as many colors, half its step works best.
+    """
+    levels = max( len( palette ), 2 ) ** ( 1 / 3 )
+    return 0.5 * 255 / levels
+
+
+def threshold_dither( frame, palette, lut, method ):
+    """ Palette indices of frame offset by the tiled threshold map of method. """
+    thresholds    = threshold_map( method )
+    height, width = frame.shape[ :2 ]
+    tiles  = ( -( -height // len( thresholds ) ), -( -width // len( thresholds ) ) )
+    offset = np.tile( thresholds, tiles )[ :height, :width, None ] * spread( palette )
+    frame  = np.clip( frame + offset, 0, 255 ).astype( np.uint8 )
+    return lookup( frame, palette, lut )
+
+
+def error_diffusion( frame, palette ):
+    """ Floyd-Steinberg palette indices of frame. """
+    from PIL import Image
+
+    colors = np.zeros( ( 256, 3 ), dtype=np.uint8 )
+    colors[ : ] = palette[ 0 ]
+    colors[ :len( palette ) ] = palette
+    palette_image = Image.new( 'P', ( 1, 1 ) )
+    palette_image.putpalette( colors.tobytes() )
+    # Dithers with Floyd-Steinberg in every PIL version.
+    indices = np.array( Image.fromarray( frame ).quantize( palette=palette_image ) )
+    # Padding entries repeat the first color.
+    indices[ indices >= len( palette ) ] = 0
+    return indices
+
+
+def dither( frame, palette, lut=None, method='none' ):
+    """
+    Palette indices of an RGB frame with one of DITHERS. lut is the
+    palette's lookup table, built if not given.
+    """
+    if method == 'floyd-steinberg':
+        return error_diffusion( frame, palette )
+    if lut is None:
+        lut = palette_lut( palette )
+    if method in ( None, 'none' ):
+        return lookup( frame, palette, lut )
+    if method in DITHERS:
+        return threshold_dither( frame, palette, lut, method )
+    raise ValueError( 'Unknown dithering {}, use one of {}'.format( method, DITHERS ) )
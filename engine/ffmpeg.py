@@ -0,0 +1,277 @@
+"""
+Helpers to locate and drive the ffmpeg executable.
+
+Nothing here imports PyQt4, so it is safe to use from the command line and
+from worker processes.
+"""
+import logging
+import os
+import stat
+import subprocess as sp
+import tempfile
+
+
+def find_ffmpeg( auto=False ):
+    """ Get ffmpeg exe, modified from imageio.plugins.ffmpeg.get_exe """
+    # Is the ffmpeg exe overridden?
+    exe = os.getenv( 'IMAGEIO_FFMPEG_EXE', None )
+    if exe:  # pragma: no cover
+        return exe
+
+    from imageio.core import InternetNotAllowedError, NeedDownloadError, get_platform, get_remote_file
+    from imageio.plugins.ffmpeg import FNAME_PER_PLATFORM
+
+    # Check if ffmpeg is in PATH
+    try:
+        with open( os.devnull, "w" ) as null:
+            sp.check_call( [ "ffmpeg", "-version" ], stdout=null,
+                           stderr=sp.STDOUT )
+            return "ffmpeg"
+    # ValueError is raised on failure on OS X through Python 2.7.11
+    # https://bugs.python.org/issue26083
+    except (OSError, ValueError, sp.CalledProcessError):
+        pass
+
+    plat = get_platform( )
+
+    if plat and plat in FNAME_PER_PLATFORM:
+        try:
+            exe = get_remote_file( 'ffmpeg/' + FNAME_PER_PLATFORM[ plat ],
+                                   auto=auto )
+            os.chmod( exe, os.stat( exe ).st_mode | stat.S_IEXEC )  # executable
+            return exe
+        except NeedDownloadError:
+            raise NeedDownloadError( 'Need ffmpeg exe. '
+                                     'You can download it by calling:\n'
+                                     '  imageio.plugins.ffmpeg.download()' )
+        except InternetNotAllowedError:
+            pass  # explicitly disallowed by user
+        except OSError as err:  # pragma: no cover
+            logging.warning( "Warning: could not find imageio's "
+                             "ffmpeg executable:\n%s" %
+                             str( err ) )
+
+    # Fallback, let's hope the system has ffmpeg
+    return 'ffmpeg'
+
+
+# imageio's ffmpeg builds, see imageio.core.get_remote_file.
+FFMPEG_URL_ROOT  = 'https://github.com/imageio/imageio-binaries/raw/master/'
+DOWNLOAD_CHUNK   = 64 * 1024
+DOWNLOAD_TIMEOUT = 10
+
+
+def download_ffmpeg( progress=None, cancel=None ):
+    """
+    Download imageio's ffmpeg executable for this platform to where
+    find_ffmpeg looks for it and return its path. Bytes downloaded are
+    reported to progress, an engine.progress.ProgressReporter, in the
+    download stage, nothing is printed. Cancelling cancel, an
+    engine.cancel.CancelToken, stops the download and removes the part
+    downloaded, raising Cancelled.
+    """
+    try:
+        from urllib2 import urlopen
+    except ImportError:
+        from urllib.request import urlopen
+    from imageio.core import appdata_dir, get_platform
+    from imageio.plugins.ffmpeg import FNAME_PER_PLATFORM
+    from engine.cancel import CancelToken
+    from engine.progress import ProgressReporter
+
+    if progress is None:
+        progress = ProgressReporter()
+    if cancel is None:
+        cancel = CancelToken()
+    fname = FNAME_PER_PLATFORM[ get_platform( ) ]
+    exe   = os.path.join( appdata_dir( 'imageio' ), 'ffmpeg', os.path.normcase( fname ) )
+    if not os.path.isdir( os.path.dirname( exe ) ):
+        os.makedirs( os.path.dirname( exe ) )
+
+    remote = urlopen( FFMPEG_URL_ROOT + 'ffmpeg/' + fname, timeout=DOWNLOAD_TIMEOUT )
+    length = remote.headers.get( 'Content-Length' )
+    progress.stage( 'download', total_bytes=int( length ) if length else None )
+    try:
+        with open( exe + '.part', 'wb' ) as part:
+            for chunk in iter( lambda: remote.read( DOWNLOAD_CHUNK ), b'' ):
+                cancel.check()
+                part.write( chunk )
+                progress.advance( bytes=len( chunk ) )
+    except BaseException:
+        if os.path.exists( exe + '.part' ):
+            os.remove( exe + '.part' )
+        raise
+    finally:
+        remote.close()
+    if os.path.exists( exe ):
+        os.remove( exe )
+    os.rename( exe + '.part', exe )
+    os.chmod( exe, os.stat( exe ).st_mode | stat.S_IEXEC )
+    progress.finish()
+    return exe
+
+
+# paletteuse dithering closest to each of engine.dither.DITHERS. ffmpeg only
+# has an 8x8 Bayer matrix and no blue noise, sierra2_4a is its default.
+FFMPEG_DITHERS = { 'none'           : 'none',
+                   'bayer4'         : 'bayer:bayer_scale=1',
+                   'bayer8'         : 'bayer:bayer_scale=2',
+                   'blue-noise'     : 'sierra2_4a',
+                   'floyd-steinberg': 'floyd_steinberg', }
+
+# Scaling filters of ffmpeg's scale filter (sws_flags), fastest first.
+RESIZE_FILTERS = [ 'fast_bilinear', 'bilinear', 'area', 'bicubic', 'lanczos' ]
+
+_FFMPEG_EXE = None
+
+
+def ffmpeg_exe( ):
+    """ ffmpeg executable, looked up only once per process. """
+    global _FFMPEG_EXE
+    if _FFMPEG_EXE is None:
+        _FFMPEG_EXE = find_ffmpeg( auto=False )
+    return _FFMPEG_EXE
+
+
+def scale_filter( info, flags='lanczos' ):
+    """ ffmpeg scale filter for the resize parameters in info, None if no resize is needed. """
+    if info.scale:
+        size = 'iw*{scale}:ih*{scale}'.format( scale=info.scale )
+    elif info.width and info.height:
+        size = '{}:{}'.format( int( round( info.width ) ), int( round( info.height ) ) )
+    elif info.width:
+        size = '{}:-1'.format( int( round( info.width ) ) )
+    elif info.height:
+        size = '-1:{}'.format( int( round( info.height ) ) )
+    else:
+        return None
+    return 'scale={size}:flags={flags}'.format( size=size, flags=flags )
+
+
+def gif_filtergraph( info, fps, duration=None, offset=0 ):
+    """
+    Single ffmpeg filtergraph doing the whole GIF job: trim, speed, fps,
+    resize, mirror and a two pass palettegen / paletteuse.
+
+    The input is expected to be seeked to offset seconds before info.start,
+    duration is the length of the clip in the source video, None means till
+    the end.
+    """
+    chain = []
+    trim  = []
+    if offset > 0:
+        trim.append( 'start={:.6f}'.format( offset ) )
+    if duration is not None:
+        trim.append( 'duration={}'.format( duration ) )
+    if trim:
+        chain.append( 'trim=' + ':'.join( trim ) )
+    chain.append( 'setpts=PTS-STARTPTS' )
+    if info.speed and info.speed != 1:
+        chain.append( 'setpts=PTS/{}'.format( info.speed ) )
+    if fps:
+        chain.append( 'fps={}'.format( fps ) )
+    scale = scale_filter( info, info.resize_filter )
+    if scale:
+        chain.append( scale )
+
+    graph = [ '[0:v]' + ','.join( chain ) + '[clip]' ]
+    clip  = '[clip]'
+    if info.mirrored:
+        # Forward clip followed by the reversed clip, same as time_symmetrize.
+        graph.append( '[clip]split[forward][backward]' )
+        graph.append( '[backward]reverse[reversed]' )
+        graph.append( '[forward][reversed]concat=n=2:v=1:a=0[mirrored]' )
+        clip = '[mirrored]'
+    graph.append( clip + 'split[frames][palette_frames]' )
+    if info.colors and info.colors < 256:
+        graph.append( '[palette_frames]palettegen=max_colors={}[palette]'.format( int( info.colors ) ) )
+    else:
+        graph.append( '[palette_frames]palettegen[palette]' )
+    options = []
+    if info.dither:
+        options.append( 'dither=' + FFMPEG_DITHERS[ info.dither ] )
+    if info.delta:
+        # Only the changed rectangle of every frame is dithered and written.
+        options.append( 'diff_mode=rectangle' )
+    graph.append( '[frames][palette]paletteuse' + ( '=' + ':'.join( options ) if options else '' ) )
+    return ';'.join( graph )
+
+
+def run_ffmpeg( args, progress=None, cancel=None ):
+    """
+    Run ffmpeg with args and wait for it to finish.
+    Progress reported by ffmpeg (a dict of key=value pairs) is passed to
+    progress after each update. Return the last progress dict.
+    ffmpeg is killed as soon as cancel, an engine.cancel.CancelToken, is
+    cancelled, and Cancelled raised once it has exited.
+    Raise IOError with ffmpeg's error output on failure.
+    """
+    cmd    = [ ffmpeg_exe(), '-y', '-v', 'error', '-nostats', '-progress', 'pipe:1' ] + list( args )
+    # Errors go to a file, a pipe nobody reads while progress is read could
+    # fill up and block ffmpeg.
+    errors = tempfile.TemporaryFile()
+    proc   = sp.Popen( cmd, stdout=sp.PIPE, stderr=errors )
+    kill   = cancel.on_cancel( proc.kill ) if cancel else None
+
+    report = {}
+    try:
+        for line in iter( proc.stdout.readline, b'' ):
+            key, _, value = line.decode( 'utf-8', 'replace' ).strip().partition( '=' )
+            report[ key ] = value
+            if key == 'progress' and progress:
+                progress( dict( report ) )
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        if kill:
+            cancel.forget( kill )
+        errors.seek( 0 )
+        error = errors.read()
+        errors.close()
+
+    if cancel:
+        cancel.check()
+    if proc.returncode != 0:
+        raise IOError( 'ffmpeg failed with code {}:\n{}'.format( proc.returncode,
+                                                                 error.decode( 'utf-8', 'replace' ) ) )
+    return report
+
+
+_FFPROBE_EXE = None
+
+
+def ffprobe_exe( ):
+    """ ffprobe executable next to the ffmpeg in use, or the one in PATH. """
+    global _FFPROBE_EXE
+    if _FFPROBE_EXE is None:
+        directory, name = os.path.split( ffmpeg_exe() )
+        candidate       = os.path.join( directory, name.replace( 'ffmpeg', 'ffprobe' ) )
+        _FFPROBE_EXE    = candidate if directory and os.path.isfile( candidate ) else 'ffprobe'
+    return _FFPROBE_EXE
+
+
+def run_ffprobe( args, cancel=None ):
+    """
+    Run ffprobe with args and return its standard output.
+    Raise IOError if ffprobe is missing or fails. ffprobe is killed as soon
+    as cancel, an engine.cancel.CancelToken, is cancelled, and Cancelled
+    raised once it has exited.
+    """
+    cmd = [ ffprobe_exe(), '-v', 'error' ] + list( args )
+    try:
+        proc = sp.Popen( cmd, stdout=sp.PIPE, stderr=sp.PIPE )
+    except OSError as err:
+        raise IOError( 'ffprobe is not available: {}'.format( err ) )
+    kill = cancel.on_cancel( proc.kill ) if cancel else None
+    try:
+        output, error = proc.communicate()
+    finally:
+        if kill:
+            cancel.forget( kill )
+    if cancel:
+        cancel.check()
+    if proc.returncode != 0:
+        raise IOError( 'ffprobe failed with code {}:\n{}'.format( proc.returncode,
+                                                                  error.decode( 'utf-8', 'replace' ) ) )
+    return output
@@ -0,0 +1,586 @@
+"""
+Low level GIF89a writing.
+
+Frames are quantized and LZW encoded (engine.lzw) once into self-contained
+image blocks (image descriptor, optional local color table and image data).
+Blocks can then be written to a GIF file any number of times and in any
+order, which is how mirrored GIFs are made without decoding the video
+backwards or encoding frames twice. GifWriter streams blocks to any binary
+file object as they come, nothing but the blocks of a mirrored GIF is kept.
+
+Frames are quantized either by PIL, one adaptive palette per frame, or with
+a global palette from engine.palette built on a sample of the frames.
+"""
+import collections
+import contextlib
+import itertools
+import mmap
+import multiprocessing
+import struct
+import tempfile
+
+import numpy as np
+
+from engine import instrument
+from engine.cancel import CancelToken, checked
+from engine.lzw import image_data, similar_colors
+from engine.dither import dither
+from engine.palette import LOCAL_PALETTE_ERROR, FrameSampler, build_palette, palette_lut, remap_error, sample_pixels
+from engine.progress import ProgressReporter, counted
+
+
+# Encoded frames of a mirrored GIF are kept in memory up to this many bytes,
+# further frames are spilled to a memory-mapped temporary file.
+DEFAULT_SPILL_SIZE = 256 * 1024 * 1024
+
+# Frames in flight per LZW encoding process.
+ENCODE_WINDOW = 4
+
+TRAILER = b'\x3b'
+
+
+def color_table( palette ):
+    """ Size bits and bytes of a color table holding palette, padded to a power of two. """
+    palette = np.asarray( palette, dtype=np.uint8 ).reshape( -1, 3 )
+    bits    = max( 1, int( np.ceil( np.log2( max( len( palette ), 2 ) ) ) ) )
+    table   = np.zeros( ( 2 ** bits, 3 ), dtype=np.uint8 )
+    table[ :len( palette ) ] = palette
+    return bits - 1, table.tobytes()
+
+
+def header( width, height, loop=0, palette=None ):
+    """
+    GIF header, logical screen descriptor with palette as global color table
+    if given, and NETSCAPE2.0 looping extension, loop=0 loops forever and
+    loop=None leaves the extension out, the GIF plays once.
+    """
+    flags = 0
+    table = b''
+    if palette is not None:
+        size_bits, table = color_table( palette )
+        flags = 0x80 | 0x70 | size_bits
+    screen = struct.pack( '<6sHHBBB', b'GIF89a', width, height, flags, 0, 0 )
+    if loop is None:
+        return screen + table
+    looping = b'\x21\xff\x0bNETSCAPE2.0' + struct.pack( '<BBHB', 3, 1, loop, 0 )
+    return screen + table + looping
+
+
+def graphic_control( delay, disposal=0, transparent=None ):
+    """ Graphic control extension, delay in 1/100 second. """
+    flags = ( disposal & 0x07 ) << 2
+    if transparent is not None:
+        flags |= 0x01
+    return struct.pack( '<BBBBHBB', 0x21, 0xf9, 4, flags, delay, transparent or 0, 0 )
+
+
+def frame_delays( fps ):
+    """
+    Generator of frame delays in 1/100 second. Rounding is carried over from
+    frame to frame so the animation does not drift for fps like 30 or 24.
+    """
+    index = 0
+    while True:
+        yield int( round( 100.0 * ( index + 1 ) / fps ) ) - int( round( 100.0 * index / fps ) )
+        index += 1
+
+
+def image_descriptor( left, top, width, height, palette=None ):
+    """ Image descriptor, followed by palette as local color table if given. """
+    if palette is None:
+        return struct.pack( '<BHHHHB', 0x2c, left, top, width, height, 0 )
+    size_bits, table = color_table( palette )
+    return struct.pack( '<BHHHHB', 0x2c, left, top, width, height, 0x80 | size_bits ) + table
+
+
+def indexed_image( indices, palette, local_color_table=True, left=0, top=0, similar=None ):
+    """
+    Image block of a frame of palette indices placed at left, top, before
+    LZW encoding: ( descriptor, indices, colors, similar ), see
+    compress_image. Without local_color_table the block uses the global
+    color table, which must be palette. With similar, from
+    engine.lzw.similar_colors, it is LZW encoded lossily.
+    """
+    height, width = indices.shape
+    descriptor    = image_descriptor( left, top, width, height, palette if local_color_table else None )
+    return descriptor, indices, len( palette ), similar
+
+
+def compress_image( image ):
+    """ LZW encode an indexed_image to an image block. """
+    descriptor, indices, colors, similar = image
+    return descriptor + image_data( indices, colors, similar )
+
+
+def adaptive_palette( frame, colors=256 ):
+    """ Quantize an RGB frame to an adaptive PIL palette, return indices and palette. """
+    from PIL import Image
+
+    image   = Image.fromarray( frame ).convert( 'P', palette=Image.ADAPTIVE, colors=colors )
+    indices = np.asarray( image )
+    used    = int( indices.max() ) + 1
+    return indices, np.asarray( image.getpalette()[ :3 * used ], dtype=np.uint8 ).reshape( -1, 3 )
+
+
+class FrameEncoder( object ):
+    """
+    Turn RGB frames into image blocks, before LZW encoding (see
+    indexed_image), which is left to the writer.
+
+    Calling an encoder with a frame returns ( image, transparent, reverse ):
+    the image, its transparent color index or None, and what to write for
+    this frame in the reversed half of a mirrored GIF, an ( image,
+    transparent ) pair or None for nothing. The reversed half starts with
+    turnaround if it is not None.
+    """
+    # Disposal method written in the graphic control extension of every frame.
+    disposal   = 0
+    turnaround = None
+
+    def __call__( self, frame ):
+        raise NotImplementedError
+
+
+class AdaptiveEncoder( FrameEncoder ):
+    """
+    One adaptive PIL palette per frame, dithered with one of
+    engine.dither.DITHERS, LZW encoded lossily up to lossy (see
+    engine.lzw.similar_colors).
+    """
+
+    def __init__( self, colors=256, dithering='none', lossy=0 ):
+        self.colors    = colors
+        self.dithering = dithering or 'none'
+        self.lossy     = lossy
+
+    def __call__( self, frame ):
+        indices, palette = adaptive_palette( frame, self.colors )
+        if self.dithering != 'none':
+            indices = dither( frame, palette, method=self.dithering )
+        image = indexed_image( indices, palette, similar=similar_colors( palette, self.lossy ) )
+        return image, None, ( image, None )
+
+
+class PaletteEncoder( FrameEncoder ):
+    """
+    Encode RGB frames with a global palette. Frames too far from it, RMS
+    error above max_error, get a local palette of their own. With
+    transparent, local palettes leave room for one transparent color.
+    Frames are dithered with one of engine.dither.DITHERS and LZW encoded
+    lossily up to lossy (see engine.lzw.similar_colors).
+    """
+
+    def __init__( self, palette, quantizer='median-cut', colors=256, max_error=LOCAL_PALETTE_ERROR,
+                  transparent=False, dithering='none', lossy=0 ):
+        self.palette      = palette
+        self.lut          = palette_lut( palette )
+        self.lossy        = lossy
+        self.similar      = similar_colors( palette, lossy )
+        self.quantizer    = quantizer
+        self.colors       = colors - 1 if transparent else colors
+        self.max_error    = max_error
+        self.dithering    = dithering or 'none'
+        self.local_frames = 0
+
+    def quantize( self, frame ):
+        """ Return palette indices of frame, the palette used and whether it is a local one. """
+        if remap_error( frame, self.palette, self.lut ) <= self.max_error:
+            return dither( frame, self.palette, self.lut, self.dithering ), self.palette, False
+
+        self.local_frames += 1
+        local = build_palette( sample_pixels( frame ), self.quantizer, self.colors )
+        return dither( frame, local, method=self.dithering ), local, True
+
+    def similar_to( self, palette, local ):
+        """ Similar colors of palette for lossy encoding, as returned by quantize. """
+        return similar_colors( palette, self.lossy ) if local else self.similar
+
+    def __call__( self, frame ):
+        indices, palette, local = self.quantize( frame )
+        image = indexed_image( indices, palette, local_color_table=local, similar=self.similar_to( palette, local ) )
+        return image, None, ( image, None )
+
+
+def dirty_rectangle( changed ):
+    """ Bounding box top, bottom, left, right of the True pixels of changed, None if there is none. """
+    rows = np.flatnonzero( changed.any( axis=1 ) )
+    if not len( rows ):
+        return None
+    columns = np.flatnonzero( changed.any( axis=0 ) )
+    return rows[ 0 ], rows[ -1 ] + 1, columns[ 0 ], columns[ -1 ] + 1
+
+
+class DeltaEncoder( FrameEncoder ):
+    """
+    Encode only the rectangle that changed since the previous frame, pixels
+    inside it that did not change are transparent. Frames are compared
+    after quantization, so what is compared is exactly what is on screen.
+    Frames are not disposed, each one is drawn over the previous ones.
+
+    For the reversed half of a mirrored GIF, the rectangle of the previous
+    frame that restores it is encoded as well, the same rectangle and
+    transparency work in both directions.
+
+    palettes is a PaletteEncoder with transparent set, whose global palette
+    is followed by one transparent color in the global color table.
+    """
+    disposal = 1
+
+    def __init__( self, palettes, mirrored=False ):
+        self.palettes   = palettes
+        self.mirrored   = mirrored
+        self.previous   = None
+        self.turnaround = self._unchanged() if mirrored else None
+
+    @staticmethod
+    def _unchanged( ):
+        """ A single transparent pixel, the frame when nothing changed. """
+        return indexed_image( np.zeros( ( 1, 1 ), dtype=np.uint8 ), np.zeros( ( 2, 3 ), dtype=np.uint8 ) ), 0
+
+    def _patch( self, indices, palette, local, changed ):
+        rectangle = dirty_rectangle( changed )
+        if rectangle is None:
+            return self._unchanged()
+        top, bottom, left, right = rectangle
+        transparent = len( palette )
+        patch = indices[ top:bottom, left:right ].copy()
+        patch[ ~changed[ top:bottom, left:right ] ] = transparent
+        table = np.vstack( [ palette, np.zeros( ( 1, 3 ), dtype=np.uint8 ) ] )
+        # Similar colors of palette alone, the transparent index stays exact.
+        return indexed_image( patch, table, local_color_table=local, left=left, top=top,
+                              similar=self.palettes.similar_to( palette, local ) ), transparent
+
+    def __call__( self, frame ):
+        indices, palette, local = self.palettes.quantize( frame )
+        screen   = palette[ indices ]
+        previous = self.previous
+        self.previous = ( screen, indices, palette, local )
+        if previous is None:
+            return indexed_image( indices, palette, local_color_table=local,
+                                  similar=self.palettes.similar_to( palette, local ) ), None, None
+
+        changed = ( screen != previous[ 0 ] ).any( axis=2 )
+        image, transparent = self._patch( indices, palette, local, changed )
+        reverse = self._patch( previous[ 1 ], previous[ 2 ], previous[ 3 ], changed ) if self.mirrored else None
+        return image, transparent, reverse
+
+
+class FrameStore( object ):
+    """
+    Byte blocks, encoded image blocks or raw frames, kept for later use.
+    Blocks are held in memory until spill_size bytes are stored, then all
+    blocks are moved to a temporary file which is memory-mapped for reading.
+    """
+
+    def __init__( self, spill_size=DEFAULT_SPILL_SIZE ):
+        self.spill_size = spill_size
+        self.size       = 0
+        self._blocks    = []
+        self._offsets   = []
+        self._file      = None
+        self._map       = None
+
+    def __len__( self ):
+        return len( self._offsets ) if self._file else len( self._blocks )
+
+    @property
+    def spilled( self ):
+        return self._file is not None
+
+    def append( self, block ):
+        if self._file is None and self.size + len( block ) > self.spill_size:
+            self._spill()
+
+        if self._file is None:
+            self._blocks.append( block )
+        else:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.write( block )
+            self._offsets.append( ( self.size, len( block ) ) )
+        self.size += len( block )
+
+    def _spill( self ):
+        self._file = tempfile.TemporaryFile()
+        offset     = 0
+        for block in self._blocks:
+            self._file.write( block )
+            self._offsets.append( ( offset, len( block ) ) )
+            offset += len( block )
+        self._blocks = []
+
+    def __getitem__( self, index ):
+        if self._file is None:
+            return self._blocks[ index ]
+        if self._map is None:
+            self._file.flush()
+            self._map = mmap.mmap( self._file.fileno(), 0, access=mmap.ACCESS_READ )
+        offset, length = self._offsets[ index ]
+        return self._map[ offset:offset + length ]
+
+    def close( self ):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._blocks  = []
+        self._offsets = []
+        self.size     = 0
+
+
+def _buffer_frames( frames, sampler, spill_size ):
+    """ Keep raw frames in a FrameStore while sampler looks at them. """
+    store = FrameStore( spill_size )
+    shape = None
+    for frame in frames:
+        sampler.offer( frame )
+        store.append( np.ascontiguousarray( frame ).tobytes() )
+        shape = frame.shape
+    return store, shape
+
+
+def _stored_frames( store, shape ):
+    for index in range( len( store ) ):
+        yield np.frombuffer( store[ index ], dtype=np.uint8 ).reshape( shape )
+
+
+class GifWriter( object ):
+    """
+    Stream a GIF89a file to a binary file object, one image block at a time.
+    The header is written by start, once the size of the animation is known,
+    and close writes the trailer. The file object is not closed.
+    """
+
+    def __init__( self, gif_file, fps, palette=None, loop=0 ):
+        self.file    = gif_file
+        self.delays  = frame_delays( fps )
+        self.palette = palette
+        self.loop    = loop
+        self.frames  = 0
+        self.bytes   = 0
+
+    def start( self, width, height ):
+        self._write( header( width, height, self.loop, self.palette ) )
+
+    def write( self, block, disposal=0, transparent=None, delay=None ):
+        """
+        Write an image block as the next frame, shown for delay 1/100 s, by
+        default the next delay of fps. Return the number of bytes written.
+        """
+        if delay is None:
+            delay = next( self.delays )
+        written = self._write( graphic_control( delay, disposal, transparent ) )
+        written += self._write( block )
+        self.frames += 1
+        return written
+
+    def close( self ):
+        self._write( TRAILER )
+
+    def _write( self, data ):
+        self.file.write( data )
+        self.bytes += len( data )
+        return len( data )
+
+
+@contextlib.contextmanager
+def encoding_pool( processes=1 ):
+    """
+    Process pool for compress_images, None when encoding serially.
+    processes 0 or None means one per CPU core.
+
+    Create it before starting decoders: forked workers inherit the pipes
+    open at that moment and would keep a decoder's pipe from closing.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    if processes <= 1:
+        yield None
+        return
+
+    pool = multiprocessing.Pool( processes )
+    try:
+        yield pool
+        pool.close()
+    finally:
+        # Does nothing more after close, stops workers on errors.
+        pool.terminate()
+        pool.join()
+
+
+def compress_images( images, pool=None, window=None ):
+    """
+    Yield ( block, extra ) for every ( image, extra ) of images, in order,
+    with images LZW encoded by compress_image, in pool if given (see
+    encoding_pool).
+
+    Images are read from images only while less than window of them,
+    default ENCODE_WINDOW per pool process, are being encoded or waiting to
+    be written, so memory stays bounded however fast images come. Blocks
+    are the same bytes as when encoded serially.
+
+    Encoding is timed as lzw spans when instrumentation is on, see
+    engine.instrument.
+    """
+    if pool is None:
+        compress = instrument.timed_call( compress_image, 'lzw' )
+        for image, extra in images:
+            yield compress( image ), extra
+        return
+
+    traced  = instrument.recording()
+    task    = instrument.TimedTask( compress_image ) if traced else compress_image
+    window  = max( 1, window or ENCODE_WINDOW * pool._processes )
+    pending = collections.deque()
+    for image, extra in images:
+        pending.append( ( pool.apply_async( task, ( image, ) ), extra ) )
+        if len( pending ) >= window:
+            result, extra = pending.popleft()
+            yield _block( result, traced ), extra
+    while pending:
+        result, extra = pending.popleft()
+        yield _block( result, traced ), extra
+
+
+def _block( result, traced ):
+    """ Block of a compress_images pool result, recording its timing if traced. """
+    if not traced:
+        return result.get()
+    block, timing = result.get()
+    instrument.record_task( 'lzw', timing )
+    return block
+
+
+def _pack( block, transparent ):
+    """ Block with its transparent index in front, to keep both in a FrameStore. """
+    return struct.pack( '<H', 0 if transparent is None else transparent + 1 ) + block
+
+
+def _unpack( data ):
+    transparent = struct.unpack( '<H', data[ :2 ] )[ 0 ]
+    return data[ 2: ], ( transparent - 1 if transparent else None )
+
+
+def _encoded( frames, encoder, mirrored ):
+    """
+    ( image, ( transparent, write, keep ) ) of frames and of their reversed
+    counterparts: whether the image is a frame to write now and whether it
+    is kept for the reversed half of a mirrored GIF.
+    """
+    for frame in frames:
+        image, transparent, reverse = encoder( frame )
+        if not mirrored or reverse is None:
+            yield image, ( transparent, True, False )
+        elif reverse[ 0 ] is image:
+            yield image, ( transparent, True, True )
+        else:
+            yield image, ( transparent, True, False )
+            yield reverse[ 0 ], ( reverse[ 1 ], False, True )
+
+
+def write_gif( frames, gif_name, fps, mirrored=False, spill_size=DEFAULT_SPILL_SIZE,
+               quantizer=None, colors=256, sampling='stride', delta=False, dithering='none', lossy=0,
+               pool=None, window=None, progress=None, total=None, cancel=None ):
+    """
+    Write RGB frames (numpy arrays) to gif_name, a file name or a binary file
+    object, at fps. Frames are read only once, in order, and written as soon
+    as they are encoded. With mirrored the encoded frames are kept and
+    written again in reverse order after the last one, like time_symmetrize.
+
+    Without quantizer each frame gets an adaptive palette from PIL. With one
+    of engine.palette.QUANTIZERS, a global palette of colors colors is built
+    from frames picked by sampling; frames are buffered (spilling to disk like
+    mirrored frames) until it is ready.
+
+    With delta only the changed rectangle of every frame is written, see
+    DeltaEncoder. It needs a global palette, median-cut is used if no
+    quantizer is given.
+
+    Frames are dithered with one of engine.dither.DITHERS.
+    With lossy, LZW encoding lets pixels be up to lossy off in color (RGB
+    distance) when that makes longer strings, see engine.lzw.
+    Frames are LZW encoded in pool, see encoding_pool, with at most window
+    frames in flight, see compress_images.
+    Progress is reported to progress, an engine.progress.ProgressReporter,
+    expecting total source frames if known, twice as many written when
+    mirrored.
+    cancel, an engine.cancel.CancelToken, is checked between frames, a
+    cancelled write raises Cancelled, leaving gif_name incomplete.
+    Raise ValueError if there are no frames, a GIF needs one.
+    Return the number of frames written.
+    """
+    if delta and not quantizer:
+        quantizer = 'median-cut'
+    if progress is None:
+        progress = ProgressReporter()
+    if cancel is None:
+        cancel = CancelToken()
+
+    owned   = not hasattr( gif_name, 'write' )
+    store   = FrameStore( spill_size ) if mirrored else None
+    raw     = None
+    table   = None
+    encoder = AdaptiveEncoder( colors, dithering, lossy )
+    try:
+        if quantizer:
+            sampler    = FrameSampler( sampling )
+            progress.stage( 'decode', total )
+            raw, shape = _buffer_frames( checked( counted( frames, progress ), cancel ), sampler, spill_size )
+            progress.stage( 'palette' )
+            # Keep one color of the global color table for transparency.
+            palette    = build_palette( sampler.pixels(), quantizer, colors - 1 if delta else colors )
+            cancel.check()
+            encoder    = PaletteEncoder( palette, quantizer, colors, transparent=delta, dithering=dithering,
+                                         lossy=lossy )
+            table      = palette
+            if delta:
+                encoder = DeltaEncoder( encoder, mirrored=mirrored )
+                table   = np.vstack( [ palette, np.zeros( ( 1, 3 ), dtype=np.uint8 ) ] )
+            frames     = _stored_frames( raw, shape )
+
+        frames = iter( frames )
+        first  = next( frames, None )
+        # A decoder killed on cancel ends without frames, the clip is not empty.
+        cancel.check()
+        if first is None:
+            raise ValueError( 'No frames to write, the clip is empty' )
+        gif    = open( gif_name, 'wb' ) if owned else gif_name
+        writer = GifWriter( gif, fps, palette=table )
+        try:
+            # The reversed half of a mirrored GIF has as many frames again.
+            progress.stage( 'encode', total * 2 if mirrored and total else total )
+            writer.start( first.shape[ 1 ], first.shape[ 0 ] )
+            progress.advance( bytes=writer.bytes )
+            images = _encoded( checked( itertools.chain( [ first ], frames ), cancel ),
+                               instrument.timed_call( encoder, 'quantize' ), mirrored )
+            for block, ( transparent, write, keep ) in compress_images( images, pool, window ):
+                if write:
+                    progress.advance( 1, writer.write( block, encoder.disposal, transparent ) )
+                if keep:
+                    store.append( _pack( block, transparent ) )
+            # Decoders killed on cancel end early instead of failing.
+            cancel.check()
+
+            if store is not None:
+                replay = []
+                if encoder.turnaround:
+                    image, transparent = encoder.turnaround
+                    replay.append( ( compress_image( image ), transparent ) )
+                replay = itertools.chain( replay, ( _unpack( store[ index ] )
+                                                    for index in range( len( store ) - 1, -1, -1 ) ) )
+                for block, transparent in replay:
+                    cancel.check()
+                    progress.advance( 1, writer.write( block, encoder.disposal, transparent ) )
+            writer.close()
+            progress.advance( bytes=len( TRAILER ) )
+        finally:
+            if owned:
+                gif.close()
+        return writer.frames
+    finally:
+        if store is not None:
+            store.close()
+        if raw is not None:
+            raw.close()
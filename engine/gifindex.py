@@ -0,0 +1,256 @@
+"""
+Random access to the frames of GIF files.
+
+GifIndex reads the block structure of a GIF once, without decompressing
+anything, and records where every frame is with its rectangle, delay,
+disposal and transparency, so any frame's image data can be decoded on its
+own. The file is memory mapped, multi-hundred-MB GIFs are indexed in about a
+second and never read into memory.
+
+Frames are drawn on the canvas left by the frames before them. Full canvases
+are kept (compressed) every few frames as checkpoints, so composing frame n
+only replays the frames since the checkpoint before it.
+"""
+from __future__ import division
+import collections
+import io
+import mmap
+import struct
+import zlib
+
+import numpy as np
+
+
+# Frames between two checkpoints, doubled whenever checkpoints take more
+# than CHECKPOINT_BYTES (compressed).
+CHECKPOINT_INTERVAL = 16
+CHECKPOINT_BYTES    = 64 * 1024 * 1024
+
+EXTENSION        = 0x21
+IMAGE_DESCRIPTOR = 0x2c
+TRAILER          = 0x3b
+GRAPHIC_CONTROL  = 0xf9
+APPLICATION      = 0xff
+
+# start - offset of the image descriptor, end - offset after the image data.
+# data - offset of the LZW minimum code size byte.
+# delay in 1/100 s, transparent index or None, palette offset and number of
+# colors of the local color table, None if the global one is used.
+GifFrame = collections.namedtuple( 'GifFrame', [ 'start', 'data', 'end', 'left', 'top', 'width', 'height',
+                                                 'delay', 'disposal', 'transparent', 'palette', 'interlaced' ] )
+
+
+def _skip_sub_blocks( view, pos ):
+    """ Offset after the data sub-blocks starting at pos. """
+    size = int( view[ pos ] )
+    while size:
+        pos  += size + 1
+        size  = int( view[ pos ] )
+    return pos + 1
+
+
+def _table_size( packed ):
+    """ Number of colors of a color table from a packed fields byte. """
+    return 2 << ( packed & 0x07 ) if packed & 0x80 else 0
+
+
+def parse_gif( view ):
+    """
+    Parse the blocks of a GIF in view, a uint8 array. Return the screen
+    width, height, global palette (offset, colors) or None, loop count
+    (None without NETSCAPE extension) and the list of GifFrames. Stop at
+    the trailer or at the first block that is cut or unknown.
+    """
+    if len( view ) < 13 or view[ :3 ].tobytes() != b'GIF':
+        raise ValueError( 'Not a GIF file' )
+    width, height, packed = struct.unpack( '<HHB', view[ 6:11 ].tobytes() )
+    colors  = _table_size( packed )
+    palette = ( 13, colors ) if colors else None
+    pos     = 13 + 3 * colors
+
+    frames  = []
+    loop    = None
+    control = None
+    try:
+        while pos < len( view ):
+            block = int( view[ pos ] )
+            if block == EXTENSION:
+                label = int( view[ pos + 1 ] )
+                if label == GRAPHIC_CONTROL and view[ pos + 2 ] == 4:
+                    fields, delay, transparent = struct.unpack( '<BHB', view[ pos + 3:pos + 7 ].tobytes() )
+                    control = ( delay, ( fields >> 2 ) & 0x07, transparent if fields & 0x01 else None )
+                elif label == APPLICATION and view[ pos + 3:pos + 14 ].tobytes() == b'NETSCAPE2.0':
+                    loop = struct.unpack( '<H', view[ pos + 16:pos + 18 ].tobytes() )[ 0 ]
+                pos = _skip_sub_blocks( view, pos + 2 )
+            elif block == IMAGE_DESCRIPTOR:
+                left, top, frame_width, frame_height, packed = struct.unpack( '<HHHHB',
+                                                                               view[ pos + 1:pos + 10 ].tobytes() )
+                colors = _table_size( packed )
+                data   = pos + 10 + 3 * colors
+                end    = _skip_sub_blocks( view, data + 1 )
+                if end > len( view ):
+                    break
+                delay, disposal, transparent = control or ( 0, 0, None )
+                frames.append( GifFrame( pos, data, end, left, top, frame_width, frame_height, delay, disposal,
+                                         transparent, ( pos + 10, colors ) if colors else None,
+                                         bool( packed & 0x40 ) ) )
+                control = None
+                pos     = end
+            else:
+                break
+    except IndexError:
+        # Cut in the middle of a block, keep the frames before it.
+        pass
+    return width, height, palette, loop, frames
+
+
+class GifIndex( object ):
+    """
+    Frames of a GIF file by number. indices decodes the palette indices of
+    one frame, composed the RGBA canvas showing it.
+    """
+
+    def __init__( self, gif_name ):
+        self.file = open( gif_name, 'rb' )
+        try:
+            self.map = mmap.mmap( self.file.fileno(), 0, access=mmap.ACCESS_READ )
+        except ValueError:
+            self.file.close()
+            raise ValueError( 'Empty GIF file {}'.format( gif_name ) )
+        self.view = np.frombuffer( self.map, dtype=np.uint8 )
+        self.width, self.height, self.global_palette, self.loop, self.frames = parse_gif( self.view )
+        if not self.frames:
+            self.close()
+            raise ValueError( 'No frames in GIF file {}'.format( gif_name ) )
+
+        # Canvas before frame n by n, zlib compressed.
+        self.checkpoints = { 0: zlib.compress( self.blank().tobytes(), 1 ) }
+        self.checkpoint_bytes = len( self.checkpoints[ 0 ] )
+        self.interval         = CHECKPOINT_INTERVAL
+        # Canvas before frame cursor, for playing in order.
+        self.cursor = ( 0, self.blank() )
+        # Next frame and canvas of prepare.
+        self.prepared = ( 0, None )
+
+    def __len__( self ):
+        return len( self.frames )
+
+    def blank( self ):
+        return np.zeros( ( self.height, self.width, 4 ), dtype=np.uint8 )
+
+    def palette( self, frame ):
+        """ Colors of frame, an array of RGB rows. """
+        offset, colors = frame.palette or self.global_palette or ( 0, 0 )
+        if not colors:
+            # No color table at all, decoders fall back to gray levels.
+            return np.repeat( np.arange( 256, dtype=np.uint8 )[ :, None ], 3, axis=1 )
+        return self.view[ offset:offset + 3 * colors ].reshape( colors, 3 )
+
+    def image_block( self, index ):
+        """ Bytes of the image descriptor, color table and data of frame index. """
+        frame = self.frames[ index ]
+        return self.view[ frame.start:frame.end ].tobytes()
+
+    def indices( self, index ):
+        """
+        Palette indices of frame index, a frame.height x frame.width array.
+        The frame alone is handed to PIL as a one frame GIF, its C decoder
+        does the LZW decompression and de-interlacing.
+        """
+        from PIL import Image
+
+        frame  = self.frames[ index ]
+        block  = bytearray( self.image_block( index ) )
+        # Move the image to the top left of a screen of its own size.
+        block[ 1:5 ] = b'\x00\x00\x00\x00'
+        screen = struct.pack( '<HHBBB', frame.width, frame.height, 0, 0, 0 )
+        image  = Image.open( io.BytesIO( b'GIF89a' + screen + bytes( block ) + b'\x3b' ) )
+        image.load()
+        return np.asarray( image, dtype=np.uint8 ).reshape( frame.height, frame.width )
+
+    def draw( self, canvas, index ):
+        """ Draw frame index on a copy of canvas, return the copy. """
+        frame   = self.frames[ index ]
+        drawn   = canvas.copy()
+        indices = self.indices( index )
+        height  = max( min( frame.height, self.height - frame.top ), 0 )
+        width   = max( min( frame.width, self.width - frame.left ), 0 )
+        indices = indices[ :height, :width ]
+
+        palette = self.palette( frame )
+        colors  = np.zeros( ( 256, 4 ), dtype=np.uint8 )
+        colors[ :len( palette ), :3 ] = palette
+        colors[ :, 3 ] = 255
+        region  = drawn[ frame.top:frame.top + height, frame.left:frame.left + width ]
+        if frame.transparent is None:
+            region[ ... ] = colors[ indices ]
+        else:
+            opaque = indices != frame.transparent
+            region[ opaque ] = colors[ indices[ opaque ] ]
+        return drawn
+
+    def dispose( self, canvas, drawn, index ):
+        """ Canvas before the frame after index, from canvas before and after drawing it. """
+        frame = self.frames[ index ]
+        if frame.disposal == 2:
+            drawn[ frame.top:frame.top + frame.height, frame.left:frame.left + frame.width ] = 0
+            return drawn
+        if frame.disposal == 3:
+            return canvas
+        return drawn
+
+    def checkpoint( self, index ):
+        """ Canvas before frame index from the nearest checkpoint, and that checkpoint. """
+        start = max( key for key in self.checkpoints if key <= index )
+        data  = zlib.decompress( self.checkpoints[ start ] )
+        return start, np.frombuffer( data, dtype=np.uint8 ).reshape( self.height, self.width, 4 ).copy()
+
+    def remember( self, index, canvas ):
+        """ Keep canvas before frame index if index is a checkpoint. """
+        if index % self.interval or index in self.checkpoints:
+            return
+        self.checkpoints[ index ]  = zlib.compress( canvas.tobytes(), 1 )
+        self.checkpoint_bytes     += len( self.checkpoints[ index ] )
+        while self.checkpoint_bytes > CHECKPOINT_BYTES and self.interval < len( self.frames ):
+            # Keep every other checkpoint.
+            self.interval *= 2
+            for key in [ key for key in self.checkpoints if key % self.interval ]:
+                self.checkpoint_bytes -= len( self.checkpoints.pop( key ) )
+
+    def composed( self, index ):
+        """ RGBA canvas showing frame index, a height x width x 4 array. """
+        position, canvas = self.cursor
+        if not position <= index or index - position > self.interval:
+            position, canvas = self.checkpoint( index )
+        for frame in range( position, index ):
+            canvas = self.dispose( canvas, self.draw( canvas, frame ), frame )
+            self.remember( frame + 1, canvas )
+        drawn       = self.draw( canvas, index )
+        self.cursor = ( index + 1, self.dispose( canvas, drawn.copy(), index ) )
+        self.remember( index + 1, self.cursor[ 1 ] )
+        return drawn
+
+    def prepare( self, frames=CHECKPOINT_INTERVAL ):
+        """
+        Compose the next frames frames to build checkpoints ahead of time,
+        return whether there are frames left. Seeking anywhere is fast once
+        it returns False.
+        """
+        position, canvas = self.prepared
+        if canvas is None:
+            canvas = self.blank()
+        for frame in range( position, min( position + frames, len( self.frames ) ) ):
+            canvas    = self.dispose( canvas, self.draw( canvas, frame ), frame )
+            position  = frame + 1
+            self.remember( position, canvas )
+        self.prepared = ( position, canvas )
+        return position < len( self.frames )
+
+    def close( self ):
+        self.view = None
+        try:
+            self.map.close()
+        except BufferError:
+            # Arrays still viewing the map keep it open until they are gone.
+            pass
+        self.file.close()
@@ -0,0 +1,165 @@
+class Info( object ):
+    """ Info object used to hold custom parameters to make GIF animation. """
+
+    def __init__( self ):
+        # Video name.
+        self.video = None
+        # Clip time.
+        self.original_duration = None
+        self.start             = None
+        self.end               = None
+        # Clip size.
+        self.original_size = None
+        self.width         = None
+        self.height        = None
+        self.scale         = None
+        # Scaling filter, one of engine.ffmpeg.RESIZE_FILTERS.
+        self.resize_filter = 'lanczos'
+        # Generate time symmetric GIF or not.
+        self.mirrored      = False
+        # Default GIF writing options.
+        # fps - frames per second.
+        # speed - change playing speed of the animation, default 1x.
+        self.original_fps = None
+        self.fps          = None
+        self.speed        = 1
+        # Engine used to write GIF, one of engine.render.ENGINES.
+        self.engine       = 'moviepy'
+        # Move start back to the keyframe before it, fastest to decode.
+        self.snap_keyframe = False
+        # Palette options, see engine.palette.
+        # quantizer - one of QUANTIZERS for a global palette, None for one
+        #             adaptive palette per frame.
+        # colors - maximum number of colors of a palette.
+        # sampling - how frames of the global palette are picked, one of SAMPLINGS.
+        self.quantizer    = None
+        self.colors       = 256
+        self.sampling     = 'stride'
+        # Only write the part of every frame that changed, see engine.gif.DeltaEncoder.
+        self.delta        = False
+        # Time-lapse, decode keyframes only. Every frame shows the keyframe
+        # before its time, or the nearest one with timelapse_snap 'nearest'.
+        self.timelapse      = False
+        self.timelapse_snap = 'before'
+        # One of engine.dither.DITHERS, None for the default of the engine.
+        self.dither       = None
+        # Lossy LZW strength, the color distance a pixel may be off by to
+        # make longer LZW strings, 0 for lossless, see engine.lzw.
+        self.lossy        = 0
+        # Size budget in bytes, None for none. Scale, fps, colors and lossy
+        # are then chosen to fit it, see engine.budget.
+        self.max_bytes    = None
+        # LZW encoding processes, 0 for one per CPU core, and the maximum
+        # number of frames in flight, None for the default of engine.gif.
+        self.encode_processes = 1
+        self.encode_window    = None
+
+    @property
+    def size( self ):
+        """ GIF animation size. """
+        return [ self.width, self.height ]
+
+    def is_valid( self ):
+        """
+        Validate whether existing parameters are already enough to make a GIF animation.
+        """
+        return all( [ x is not None for x in [ self.video, self.start, self.end ] ] )
+
+    def update_video( self, name ):
+        """ Update the video to process. """
+        assert isinstance( name, unicode )
+        self.video = name
+
+    def update_start( self, start=None ):
+        """ Update clip starting time. """
+        if start is not None:
+            self.start = float( start )
+
+    def update_end( self, end=None ):
+        """ Update clip ending time. """
+        if end is not None:
+            self.end = float( end )
+
+    def update_width( self, width=None ):
+        """ Update clip resize width. """
+        if width is not None:
+            self.width = float( width )
+
+    def update_height( self, height=None ):
+        """ Update clip resize height. """
+        if height is not None:
+            self.height = float( height )
+
+    def update_scale( self, scale=None ):
+        """ Update clip resize scale. """
+        if scale is not None:
+            self.scale = float( scale )
+        else:
+            self.scale = None
+
+    def update_resize_filter( self, resize_filter=None ):
+        if resize_filter:
+            self.resize_filter = resize_filter
+
+    def update_fps( self, fps=None ):
+        if fps:
+            self.fps = float( fps )
+        else:
+            self.fps = None
+
+    def update_speed( self, speed=None ):
+        if speed:
+            self.speed = float( speed )
+        else:
+            self.speed = None
+
+    def update_mirror( self, mirrored=None ):
+        if mirrored is not None:
+            self.mirrored = mirrored
+
+    def update_engine( self, engine=None ):
+        if engine:
+            self.engine = engine
+
+    def update_snap_keyframe( self, snap=None ):
+        if snap is not None:
+            self.snap_keyframe = snap
+
+    def update_quantizer( self, quantizer=None ):
+        self.quantizer = quantizer or None
+
+    def update_colors( self, colors=None ):
+        if colors:
+            self.colors = min( max( int( colors ), 2 ), 256 )
+
+    def update_sampling( self, sampling=None ):
+        if sampling:
+            self.sampling = sampling
+
+    def update_delta( self, delta=None ):
+        if delta is not None:
+            self.delta = delta
+
+    def update_timelapse( self, timelapse=None, snap=None ):
+        if timelapse is not None:
+            self.timelapse = timelapse
+        if snap:
+            self.timelapse_snap = snap
+
+    def update_dither( self, dither=None ):
+        self.dither = dither or None
+
+    def update_lossy( self, lossy=None ):
+        if lossy is not None:
+            self.lossy = max( float( lossy ), 0 )
+
+    def update_max_bytes( self, max_bytes=None ):
+        self.max_bytes = int( max_bytes ) if max_bytes else None
+
+    def update_encode_processes( self, processes=None ):
+        if processes is not None:
+            self.encode_processes = max( int( processes ), 0 )
+
+    def update_encode_window( self, window=None ):
+        if window:
+            self.encode_window = int( window )
@@ -0,0 +1,388 @@
+"""
+Optional timing and memory instrumentation of GIF jobs.
+
+Off by default. Turned on by the --trace FILE option of the command line,
+or for any process running jobs by the GIFER_TRACE environment variable
+naming the trace file, written when the process exits. Once on, the engine
+records:
+
+- a span per stage of every job (see engine.progress.STAGES), started and
+  ended by ProgressReporter.stage and finish,
+- a span per frame for decode (frames out of the ffmpeg pipe, scaled by
+  ffmpeg, with their bytes), remap (frames picked for the GIF's speed and
+  fps), quantize and lzw, in worker processes too when encoding in a pool,
+- the same for every job of a batch, recorded in the pool process running
+  it and merged into the trace of the main process (see start_worker),
+- with --trace-memory or GIFER_TRACE_MEMORY=1, tracemalloc snapshots at
+  stage boundaries: traced memory, the peak of the stage and the lines that
+  allocated most since the previous boundary. tracemalloc slows Python
+  down a lot and does not exist in Python 2.
+
+The trace file is in the Chrome trace event format, opened by
+chrome://tracing and https://ui.perfetto.dev, and finish prints a summary
+table of the stages and spans.
+
+When off, timed and timed_call hand back what they are given and stage
+only looks up a global, so jobs run the same code as without
+instrumentation.
+"""
+from __future__ import division, print_function
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+
+TRACE_VARIABLE  = 'GIFER_TRACE'
+MEMORY_VARIABLE = 'GIFER_TRACE_MEMORY'
+
+# Lines allocating most listed per tracemalloc snapshot, and frames kept per
+# allocation traceback.
+MEMORY_TOP    = 10
+MEMORY_FRAMES = 1
+
+# Thread id of the lane of stage spans in the trace.
+STAGE_LANE = 0
+
+MB = 1024 * 1024
+
+# Recorder of the process, None when instrumentation is off.
+_recorder = None
+
+
+class Recorder( object ):
+    """
+    Spans and memory snapshots of the jobs of a process, as Chrome trace
+    events and totals by span name. Spans nested in the same thread, e.g.
+    remap pulling frames through decode, count in the total of both and in
+    the self time of the innermost only. Thread safe.
+    """
+
+    def __init__( self, trace_name=None, memory=False, clock=time.time, started=None, name='gifer' ):
+        self.trace_name = trace_name
+        self.clock      = clock
+        self.started    = clock() if started is None else started
+        self.pid        = os.getpid()
+        self.lock       = threading.Lock()
+        self.local      = threading.local()
+        self.events     = [ metadata( 'process_name', self.pid, STAGE_LANE, name ),
+                            metadata( 'thread_name', self.pid, STAGE_LANE, 'stages' ) ]
+        self.threads    = set()
+        self.workers    = set()
+        # count, seconds, self seconds, longest, bytes by span name.
+        self.totals     = {}
+        # ( stage, seconds, memory peak or None ) in order.
+        self.stages     = []
+        self.current    = None
+        self.tracemalloc = start_tracemalloc() if memory else None
+        self.snapshot    = None
+
+    def timestamp( self, moment ):
+        """ Trace time of clock value moment, in microseconds. """
+        return int( round( ( moment - self.started ) * 1e6 ) )
+
+    def begin( self ):
+        """ Open a span in this thread, closed by end. """
+        stack = getattr( self.local, 'stack', None )
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append( 0.0 )
+
+    def end( self, name, started, bytes=None ):
+        """ Close the span opened by the last begin of this thread, named name, started at started. """
+        finished = self.clock()
+        seconds  = finished - started
+        stack    = self.local.stack
+        children = stack.pop()
+        if stack:
+            stack[ -1 ] += seconds
+        self.add( name, started, seconds, seconds - children, bytes, self.pid, threading.current_thread() )
+
+    def task( self, name, timing ):
+        """ Record a span of a pool process, timing as returned by a TimedTask. """
+        pid, started, finished = timing
+        self.add( name, started, finished - started, finished - started, None, pid, None )
+
+    def add( self, name, started, seconds, self_seconds, bytes, pid, thread ):
+        event = { 'name': name, 'cat': 'frame', 'ph': 'X', 'pid': pid, 'ts': self.timestamp( started ),
+                  'dur': int( round( seconds * 1e6 ) ), 'tid': thread.ident if thread else 0 }
+        if bytes is not None:
+            event[ 'args' ] = { 'bytes': bytes }
+        with self.lock:
+            if thread is not None and thread.ident not in self.threads:
+                self.threads.add( thread.ident )
+                self.events.append( metadata( 'thread_name', pid, thread.ident, thread.name ) )
+            if thread is None and pid not in self.workers:
+                self.workers.add( pid )
+                self.events.append( metadata( 'process_name', pid, 0, 'gifer worker' ) )
+            self.events.append( event )
+            total = self.totals.setdefault( name, [ 0, 0.0, 0.0, 0.0, 0 ] )
+            total[ 0 ] += 1
+            total[ 1 ] += seconds
+            total[ 2 ] += self_seconds
+            total[ 3 ]  = max( total[ 3 ], seconds )
+            total[ 4 ] += bytes or 0
+
+    def stage( self, stage ):
+        """ End the current stage span, snapshot memory and start stage, 'done' starts nothing. """
+        now = self.clock()
+        with self.lock:
+            peak = self.memory( stage ) if self.tracemalloc else None
+            if self.current is not None:
+                name, started = self.current
+                self.events.append( { 'name': name, 'cat': 'stage', 'ph': 'X', 'pid': self.pid,
+                                      'tid': STAGE_LANE, 'ts': self.timestamp( started ),
+                                      'dur': int( round( ( now - started ) * 1e6 ) ) } )
+                self.stages.append( ( name, now - started, peak ) )
+            self.current = ( stage, now ) if stage != 'done' else None
+
+    def memory( self, stage ):
+        """ Record a tracemalloc snapshot before stage, return the peak since the last one. """
+        tracemalloc   = self.tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot      = tracemalloc.take_snapshot().filter_traces(
+            [ tracemalloc.Filter( False, tracemalloc.__file__ ), tracemalloc.Filter( False, __file__ ) ] )
+        if self.snapshot is None:
+            top = snapshot.statistics( 'lineno' )
+        else:
+            top = snapshot.compare_to( self.snapshot, 'lineno' )
+        self.snapshot = snapshot
+        if hasattr( tracemalloc, 'reset_peak' ):
+            tracemalloc.reset_peak()
+        moment = self.timestamp( self.clock() )
+        self.events.append( { 'name': 'memory', 'ph': 'C', 'pid': self.pid, 'tid': STAGE_LANE, 'ts': moment,
+                              'args': { 'traced MB': current / MB, 'peak MB': peak / MB } } )
+        self.events.append( { 'name': 'snapshot before ' + stage, 'cat': 'memory', 'ph': 'i', 's': 'p',
+                              'pid': self.pid, 'tid': STAGE_LANE, 'ts': moment,
+                              'args': { 'top': [ str( stat ) for stat in top[ :MEMORY_TOP ] ] } } )
+        return peak
+
+    def export( self ):
+        """ Events, totals and stages recorded, picklable, for merge in another process. """
+        with self.lock:
+            return { 'events': list( self.events ), 'totals': dict( self.totals ), 'stages': list( self.stages ) }
+
+    def merge( self, exported ):
+        """ Add the events, totals and stages exported by the recorder of another process. """
+        with self.lock:
+            named = set( ( event[ 'name' ], event[ 'pid' ], event[ 'tid' ] )
+                         for event in self.events if event[ 'ph' ] == 'M' )
+            for event in exported[ 'events' ]:
+                if event[ 'ph' ] == 'M' and ( event[ 'name' ], event[ 'pid' ], event[ 'tid' ] ) in named:
+                    # A pool process names itself again for every job it runs.
+                    continue
+                self.events.append( event )
+            for name, ( count, seconds, self_seconds, longest, size ) in exported[ 'totals' ].items():
+                total = self.totals.setdefault( name, [ 0, 0.0, 0.0, 0.0, 0 ] )
+                total[ 0 ] += count
+                total[ 1 ] += seconds
+                total[ 2 ] += self_seconds
+                total[ 3 ]  = max( total[ 3 ], longest )
+                total[ 4 ] += size
+            self.stages.extend( exported[ 'stages' ] )
+
+    def write( self, trace_name ):
+        with self.lock:
+            events = list( self.events )
+        with open( trace_name, 'w' ) as trace:
+            json.dump( { 'traceEvents': events, 'displayTimeUnit': 'ms' }, trace )
+
+    def summary( self ):
+        """ Lines of a table of the stages and of the spans by name. """
+        with self.lock:
+            stages = list( self.stages )
+            totals = sorted( self.totals.items(), key=lambda item: -item[ 1 ][ 2 ] )
+        memory = self.tracemalloc is not None
+        lines  = [ '{:12s} {:>10s}'.format( 'stage', 'seconds' ) + ( ' {:>10s}'.format( 'peak MB' ) if memory else '' ) ]
+        for name, seconds, peak in stages:
+            line = '{:12s} {:10.3f}'.format( name, seconds )
+            if memory:
+                line += ' {:10.1f}'.format( peak / MB )
+            lines.append( line )
+        lines.append( '' )
+        lines.append( '{:12s} {:>8s} {:>10s} {:>10s} {:>9s} {:>9s} {:>10s} {:>9s}'.format(
+            'span', 'count', 'total s', 'self s', 'mean ms', 'max ms', 'MB', 'MB/s' ) )
+        for name, ( count, seconds, self_seconds, longest, size ) in totals:
+            line = '{:12s} {:8d} {:10.3f} {:10.3f} {:9.2f} {:9.2f}'.format(
+                name, count, seconds, self_seconds, seconds / count * 1000, longest * 1000 )
+            if size:
+                line += ' {:10.1f} {:9.1f}'.format( size / MB, size / MB / seconds if seconds > 0 else 0 )
+            lines.append( line )
+        return lines
+
+
+def metadata( name, pid, tid, value ):
+    """ Trace event naming a process or thread. """
+    return { 'name': name, 'ph': 'M', 'pid': pid, 'tid': tid, 'args': { 'name': value } }
+
+
+def start_tracemalloc( ):
+    """ The tracemalloc module, tracing, None if this Python has none. """
+    try:
+        import tracemalloc
+    except ImportError:
+        logging.warning( 'tracemalloc needs Python 3.4 or later, memory is not traced' )
+        return None
+    if not tracemalloc.is_tracing():
+        tracemalloc.start( MEMORY_FRAMES )
+    return tracemalloc
+
+
+class TimedTask( object ):
+    """
+    function run in a pool process, returning ( result, timing ) for
+    record_task. Picklable if function is a module level function.
+    """
+
+    def __init__( self, function ):
+        self.function = function
+
+    def __call__( self, *args ):
+        tracemalloc = sys.modules.get( 'tracemalloc' )
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            # Forked from a process tracing memory, only that one is traced.
+            tracemalloc.stop()
+        started = time.time()
+        result  = self.function( *args )
+        return result, ( os.getpid(), started, time.time() )
+
+
+def recording( ):
+    """ Whether instrumentation is on. """
+    return _recorder is not None
+
+
+def worker_options( ):
+    """ What a pool process needs to record a job, see start_worker, None when off. """
+    recorder = _recorder
+    if recorder is None:
+        return None
+    return recorder.started, recorder.tracemalloc is not None
+
+
+def start_worker( options ):
+    """
+    Record the next job run by a pool process on the timeline of the main
+    process, options from worker_options in the main process. The recording
+    is handed back by finish_worker and added with merge_worker.
+    """
+    global _recorder
+    started, memory = options
+    _recorder = Recorder( memory=memory, started=started, name='gifer worker' )
+
+
+def finish_worker( ):
+    """ Stop recording in a pool process, return the recording for merge_worker. """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder.current is not None:
+        recorder.stage( 'done' )
+    if recorder.tracemalloc is not None:
+        recorder.tracemalloc.stop()
+    return recorder.export()
+
+
+def merge_worker( exported ):
+    """ Add the recording of finish_worker in a pool process, if recording. """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.merge( exported )
+
+
+def start( trace_name=None, memory=False ):
+    """ Turn instrumentation on, for a trace written to trace_name by finish if given. """
+    global _recorder
+    _recorder = Recorder( trace_name, memory )
+    return _recorder
+
+
+def finish( stream=None ):
+    """
+    Turn instrumentation off, write the trace file and print the summary
+    table to stream, standard error by default. Return the recorder, None if
+    instrumentation was off.
+    """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is None:
+        return None
+    if recorder.current is not None:
+        # Interrupted job, end its last stage.
+        recorder.stage( 'done' )
+    if recorder.tracemalloc is not None:
+        recorder.tracemalloc.stop()
+    if recorder.trace_name:
+        recorder.write( recorder.trace_name )
+    stream = stream or sys.stderr
+    for line in recorder.summary():
+        print( line, file=stream )
+    if recorder.trace_name:
+        print( 'Trace written to {}'.format( recorder.trace_name ), file=stream )
+    return recorder
+
+
+def stage( name ):
+    """ Stage name of a job starts, see Recorder.stage. """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.stage( name )
+
+
+def timed( items, name, count_bytes=False ):
+    """ items as they are, or, when recording, timing every next as a span name, with the bytes of frames. """
+    recorder = _recorder
+    if recorder is None:
+        return items
+    return _timed( iter( items ), name, count_bytes, recorder )
+
+
+def _timed( items, name, count_bytes, recorder ):
+    while True:
+        recorder.begin()
+        started = recorder.clock()
+        item    = None
+        try:
+            item = next( items, None )
+        finally:
+            recorder.end( name, started, item.nbytes if count_bytes and item is not None else None )
+        if item is None:
+            return
+        yield item
+
+
+def timed_call( function, name ):
+    """ function, or, when recording, a function timing every call of function as a span name. """
+    recorder = _recorder
+    if recorder is None:
+        return function
+
+    def timed_function( *args, **kwargs ):
+        recorder.begin()
+        started = recorder.clock()
+        try:
+            return function( *args, **kwargs )
+        finally:
+            recorder.end( name, started )
+    return timed_function
+
+
+def record_task( name, timing ):
+    """ Record the timing of a TimedTask as a span name, if recording. """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.task( name, timing )
+
+
+def _start_from_environment( ):
+    """ Turn instrumentation on if GIFER_TRACE is set, in the main process only: pools share its trace. """
+    trace_name = os.environ.get( TRACE_VARIABLE )
+    if trace_name and multiprocessing.current_process().name == 'MainProcess':
+        start( trace_name, memory=os.environ.get( MEMORY_VARIABLE, '' ) not in ( '', '0' ) )
+        atexit.register( finish )
+
+
+_start_from_environment()
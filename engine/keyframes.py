@@ -0,0 +1,85 @@
+"""
+Keyframe index of a video.
+
+The index is built once with a single ffprobe packet scan, no frame is
+decoded, and kept in the video's cache entry. Decoding can then start at
+the keyframe right before the wanted time and only the few frames between
+the keyframe and that time are decoded and dropped.
+"""
+import bisect
+import logging
+
+from engine.cache import load_entry, update_entry
+from engine.ffmpeg import run_ffprobe
+
+
+def scan_keyframes( video ):
+    """
+    Sorted timestamps in second of the keyframes of the first video stream,
+    relative to the start of the file as used by ffmpeg -ss.
+    """
+    output = run_ffprobe( [ '-select_streams', 'v:0',
+                            '-show_entries', 'packet=pts_time,dts_time,flags:format=start_time',
+                            '-of', 'csv', video ] )
+    times  = []
+    origin = 0.0
+    for line in output.decode( 'utf-8', 'replace' ).splitlines():
+        fields = line.strip().split( ',' )
+        if fields[ 0 ] == 'format':
+            origin = _to_float( fields[ 1 ] ) or 0.0
+        elif fields[ 0 ] == 'packet' and len( fields ) >= 4 and 'K' in fields[ 3 ]:
+            # pts_time is N/A for some containers, fall back to dts_time.
+            time = _to_float( fields[ 1 ] )
+            time = time if time is not None else _to_float( fields[ 2 ] )
+            if time is not None:
+                times.append( time )
+    return sorted( max( time - origin, 0.0 ) for time in times )
+
+
+def _to_float( text ):
+    try:
+        return float( text )
+    except ValueError:
+        return None
+
+
+def keyframes( video ):
+    """
+    Cached keyframe timestamps of video, scanned on first use.
+    Return None if the index cannot be built, e.g. ffprobe is missing.
+    """
+    entry = load_entry( video )
+    if 'keyframes' in entry:
+        return entry[ 'keyframes' ]
+    try:
+        times = scan_keyframes( video )
+    except IOError as err:
+        logging.warning( 'No keyframe index for {}: {}'.format( video, err ) )
+        return None
+    update_entry( video, keyframes=times )
+    return times
+
+
+def keyframe_before( times, time ):
+    """ Latest keyframe at or before time, 0 if there is none. """
+    if not times:
+        return 0.0
+    index = bisect.bisect_right( times, time + 1e-6 )
+    return times[ index - 1 ] if index else 0.0
+
+
+def seek_arguments( start, times ):
+    """
+    ffmpeg input options seeking to start, and the offset in second that is
+    left to skip after decoding. With keyframe index times the seek lands
+    exactly on the keyframe before start, without it ffmpeg seeks accurately
+    on its own.
+    """
+    if start <= 0:
+        return [], 0
+    if times is None:
+        return [ '-ss', '{:.6f}'.format( start ) ], 0
+    # Seek a little after the keyframe, so that rounding never lands before
+    # it, ffmpeg starts at the keyframe with timestamps relative to seek.
+    seek = keyframe_before( times, start ) + 0.0005
+    return [ '-noaccurate_seek', '-ss', '{:.6f}'.format( seek ) ], max( start - seek, 0 )
@@ -0,0 +1,194 @@
+"""
+GIF flavoured LZW compression of palette index frames.
+
+The string table is a flat array indexed by prefix code * 256 + pixel, so
+extending a string is a single array lookup instead of hashing byte
+strings. Codes start at minimum code size + 1 bits, grow up to 12 bits and
+the table is cleared when it is full.
+
+Lossy compression, like gifsicle's --lossy, lets a string go on with a pixel
+of a similar color when the exact one would end it: longer strings, fewer
+codes, and every pixel still within a bounded color distance of its own.
+Everything else, and the single pass over the pixels, stays the same.
+
+compress runs in Python, a pixel at a time. image_data hands lossless
+frames to PIL's C GIF encoder, an order of magnitude faster, and only falls
+back to compress when that encoder is missing.
+"""
+import io
+from array import array
+
+import numpy as np
+
+
+MAX_CODE  = 4095
+MAX_BITS  = 12
+SUB_BLOCK = 255
+
+# Most similar colors tried for a pixel ending a string, nearest first.
+LOSSY_CANDIDATES = 16
+
+# Empty string table, copied instead of allocated for every frame.
+_EMPTY_TABLE = array( 'H', [ 0 ] ) * ( ( MAX_CODE + 1 ) << 8 )
+
+
+def min_code_size( colors ):
+    """ LZW minimum code size for a color table of colors entries, at least 2 as GIF requires. """
+    bits = 2
+    while ( 1 << bits ) < colors:
+        bits += 1
+    return bits
+
+
+def similar_colors( palette, lossy, transparent=None ):
+    """
+    For every index of palette, the other indices whose colors are at most
+    lossy away (Euclidean RGB distance), nearest first, at most
+    LOSSY_CANDIDATES of them: the pixels compress may put in its place.
+    The transparent index, if any, is never swapped with a color. None if
+    lossy is 0.
+    """
+    if not lossy:
+        return None
+    palette  = np.asarray( palette, dtype=np.float64 ).reshape( -1, 3 )
+    distance = np.sqrt( ( ( palette[ :, None, : ] - palette[ None, :, : ] ) ** 2 ).sum( axis=2 ) )
+    np.fill_diagonal( distance, np.inf )
+    if transparent is not None and transparent < len( palette ):
+        distance[ transparent, : ] = np.inf
+        distance[ :, transparent ] = np.inf
+    similar = [ () ] * 256
+    for index, row in enumerate( distance[ :256 ] ):
+        nearest = np.argsort( row, kind='stable' )[ :LOSSY_CANDIDATES ]
+        similar[ index ] = tuple( int( other ) for other in nearest if row[ other ] <= lossy )
+    return similar
+
+
+def compress( indices, code_size, similar=None ):
+    """
+    LZW compress palette indices (any uint8 array) with minimum code size
+    code_size, return bytes. With similar, from similar_colors, strings
+    may go on with a similar pixel instead of the exact one, lossy.
+    """
+    pixels = bytearray( np.ascontiguousarray( indices, dtype=np.uint8 ).tobytes() )
+    clear  = 1 << code_size
+    end    = clear + 1
+    output = bytearray()
+    if not pixels:
+        # A clear code and end of information, in code_size + 1 bits.
+        bits = clear | ( end << ( code_size + 1 ) )
+        for _ in range( ( 2 * ( code_size + 1 ) + 7 ) // 8 ):
+            output.append( bits & 0xff )
+            bits >>= 8
+        return bytes( output )
+
+    table     = array( 'H', _EMPTY_TABLE )
+    used      = []
+    next_code = end + 1
+    bits_size = code_size + 1
+    limit     = 1 << bits_size
+    buffer    = clear
+    buffered  = bits_size
+    append    = output.append
+    remember  = used.append
+
+    prefix = pixels[ 0 ]
+    for pixel in pixels[ 1: ]:
+        key  = ( prefix << 8 ) | pixel
+        code = table[ key ]
+        if code:
+            prefix = code
+            continue
+        if similar is not None:
+            base = prefix << 8
+            for other in similar[ pixel ]:
+                code = table[ base | other ]
+                if code:
+                    break
+            if code:
+                prefix = code
+                continue
+
+        buffer   |= prefix << buffered
+        buffered += bits_size
+        while buffered >= 8:
+            append( buffer & 0xff )
+            buffer   >>= 8
+            buffered  -= 8
+
+        if next_code <= MAX_CODE:
+            table[ key ] = next_code
+            remember( key )
+            # The decoder adds its code one step behind, widen codes after it.
+            if next_code == limit and bits_size < MAX_BITS:
+                bits_size += 1
+                limit    <<= 1
+            next_code += 1
+        else:
+            buffer   |= clear << buffered
+            buffered += bits_size
+            for key in used:
+                table[ key ] = 0
+            del used[ : ]
+            next_code = end + 1
+            bits_size = code_size + 1
+            limit     = 1 << bits_size
+        prefix = pixel
+
+    # The last string, then end of information. The decoder adds a code
+    # after reading the last string, which may widen the end code.
+    widen = next_code == limit and bits_size < MAX_BITS
+    for code, size in ( ( prefix, bits_size ), ( end, bits_size + 1 if widen else bits_size ) ):
+        buffer   |= code << buffered
+        buffered += size
+        while buffered >= 8:
+            append( buffer & 0xff )
+            buffer   >>= 8
+            buffered  -= 8
+    if buffered:
+        append( buffer & 0xff )
+    return bytes( output )
+
+
+def sub_blocks( data ):
+    """ Split data into GIF data sub-blocks, terminated by an empty one. """
+    chunks = [ bytearray( [ len( data[ pos:pos + SUB_BLOCK ] ) ] ) + data[ pos:pos + SUB_BLOCK ]
+               for pos in range( 0, len( data ), SUB_BLOCK ) ]
+    return b''.join( bytes( chunk ) for chunk in chunks ) + b'\x00'
+
+
+def pil_sub_blocks( indices, code_size ):
+    """
+    LZW sub-blocks of a frame of palette indices (a 2D uint8 array) with
+    minimum code size code_size, without the terminating empty one, from
+    PIL's C GIF encoder. None if PIL has no GIF encoder.
+    """
+    try:
+        from PIL import Image, ImageFile
+    except ImportError:
+        return None
+    height, width = indices.shape
+    image = Image.frombuffer( 'L', ( width, height ), np.ascontiguousarray( indices, dtype=np.uint8 ).tobytes(),
+                              'raw', 'L', 0, 1 )
+    # Minimum code size and interlacing, as PIL's GIF plugin sets them.
+    image.encoderconfig = ( code_size, False )
+    output = io.BytesIO()
+    try:
+        ImageFile._save( image, output, [ ( 'gif', ( 0, 0, width, height ), 0, 'L' ) ] )
+    except ( IOError, OSError ):
+        return None
+    return output.getvalue()
+
+
+def image_data( indices, colors, similar=None ):
+    """
+    Table based image data of a GIF image: minimum code size and LZW
+    sub-blocks, lossy with similar. Lossless frames are encoded by PIL's C
+    encoder if it is there, see pil_sub_blocks.
+    """
+    code_size = min_code_size( colors )
+    start     = bytes( bytearray( [ code_size ] ) )
+    if similar is None and np.ndim( indices ) == 2 and np.size( indices ):
+        blocks = pil_sub_blocks( indices, code_size )
+        if blocks is not None:
+            return start + blocks + b'\x00'
+    return start + sub_blocks( compress( indices, code_size, similar ) )
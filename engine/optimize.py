@@ -0,0 +1,317 @@
+"""
+Lossless optimization of existing GIF files.
+
+optimize_gif rewrites a GIF so that every frame shows exactly the same
+pixels for exactly as long, in fewer bytes:
+
+- consecutive identical frames are merged, their delays added up,
+- every frame is cropped to the rectangle that changed, unchanged pixels in
+  it become transparent so they compress to long runs,
+- the disposal method of every frame is the one leaving the least to draw
+  for the next frame,
+- color tables only hold colors that are drawn, the global one whenever it
+  covers a frame, and the LZW minimum code size of a frame only covers the
+  indices it uses.
+
+Frames are composed one at a time by engine.gifindex.GifIndex, so files of
+any size are streamed, and LZW encoding runs in a process pool like
+write_gif's.
+"""
+from __future__ import division
+import os
+import shutil
+
+import numpy as np
+
+from engine.cancel import CancelToken, checked
+from engine.gif import GifWriter, compress_images, encoding_pool, image_descriptor
+from engine.gifindex import GifIndex
+from engine.progress import ProgressReporter, counted
+from engine.render import partial_gif_name
+
+
+# Longest delay of a GIF frame, in 1/100 s.
+MAX_DELAY = 0xffff
+
+# Disposal methods tried for a frame: keep it, clear its rectangle or restore
+# the canvas from before it.
+DISPOSALS = ( 1, 2, 3 )
+
+
+class Unoptimizable( ValueError ):
+    """ A frame cannot be drawn losslessly with the 256 colors of a color table. """
+
+
+def packed_colors( canvas ):
+    """ RGB of an RGBA canvas (or of RGB rows) as one integer per pixel. """
+    return ( canvas[ ..., 0 ].astype( np.uint32 ) << 16 ) | ( canvas[ ..., 1 ].astype( np.uint32 ) << 8 ) | \
+        canvas[ ..., 2 ]
+
+
+def color_palette( colors, transparent=False ):
+    """ Palette of packed colors, with a black transparent color after them if transparent. """
+    colors  = np.asarray( colors, dtype=np.uint32 )
+    palette = np.stack( [ colors >> 16, ( colors >> 8 ) & 0xff, colors & 0xff ], axis=-1 ).astype( np.uint8 )
+    if transparent:
+        palette = np.vstack( [ palette.reshape( -1, 3 ), np.zeros( ( 1, 3 ), dtype=np.uint8 ) ] )
+    return palette
+
+
+def used_colors( index, progress, cancel ):
+    """
+    Sorted packed colors of the global color table of index drawn by the
+    frames without a local one, None if there is no global color table.
+    """
+    if index.global_palette is None:
+        return None
+    offset, size = index.global_palette
+    # Indices past the end of the table are drawn black, as by GifIndex.
+    palette = np.zeros( ( 256, 3 ), dtype=np.uint8 )
+    palette[ :size ] = index.view[ offset:offset + 3 * size ].reshape( size, 3 )
+
+    used = np.zeros( 256, dtype=bool )
+    for number in checked( counted( range( len( index ) ), progress ), cancel ):
+        frame = index.frames[ number ]
+        if frame.palette is None:
+            counts = np.bincount( index.indices( number ).ravel(), minlength=256 )
+            if frame.transparent is not None:
+                counts[ frame.transparent ] = 0
+            used |= counts > 0
+    return np.unique( packed_colors( palette[ used ] ) )
+
+
+def merged_frames( index, numbers ):
+    """
+    ( canvas, delay, disposal ) of frames numbers of index, consecutive
+    identical canvases merged into one frame showing as long as they did
+    together. Frames with the delays browsers replace, 0 and 1, are not
+    merged.
+    """
+    pending = None
+    for number in numbers:
+        frame  = index.frames[ number ]
+        canvas = index.composed( number )
+        if pending is not None:
+            previous, delay, _ = pending
+            if delay > 1 and frame.delay > 1 and delay + frame.delay <= MAX_DELAY and \
+                    np.array_equal( previous, canvas ):
+                pending = ( previous, delay + frame.delay, frame.disposal )
+                continue
+            yield pending
+        pending = ( canvas, frame.delay, frame.disposal )
+    if pending is not None:
+        yield pending
+
+
+def canvas_pixels( canvas ):
+    """ ( packed colors, opaque mask ) of an RGBA canvas, the form frames are compared in. """
+    return packed_colors( canvas ), canvas[ ..., 3 ] > 0
+
+
+def changed_image( target, base, table=None, full=False ):
+    """
+    Smallest frame turning canvas base into canvas target, both as of
+    canvas_pixels: ( left, top, indices, colors, transparent ), colors the
+    sorted packed colors of a local color table, None when the frame uses
+    table, the colors of the global one. Unchanged pixels of the frame are
+    transparent. The whole screen is drawn if full.
+
+    Return None if pixels of base would have to become transparent, which
+    drawing cannot do, raise Unoptimizable if the frame needs more colors
+    than a color table holds.
+    """
+    target_colors, target_opaque = target
+    base_colors, base_opaque     = base
+    if ( base_opaque & ~target_opaque ).any():
+        return None
+    changed = target_opaque & ( ~base_opaque | ( target_colors != base_colors ) )
+
+    height, width = changed.shape
+    if full:
+        top, bottom, left, right = 0, height, 0, width
+    elif changed.any():
+        rows    = np.flatnonzero( changed.any( axis=1 ) )
+        columns = np.flatnonzero( changed.any( axis=0 ) )
+        top, bottom, left, right = rows[ 0 ], rows[ -1 ] + 1, columns[ 0 ], columns[ -1 ] + 1
+    else:
+        # Nothing changed, one transparent pixel keeps the frame's delay.
+        top, bottom, left, right = 0, 1, 0, 1
+    drawn  = changed[ top:bottom, left:right ]
+    pixels = target_colors[ top:bottom, left:right ]
+    colors = np.unique( pixels[ drawn ] )
+    if len( colors ) + ( not drawn.all() ) > 256:
+        # No room for a transparent color, draw every pixel of the rectangle.
+        if not target_opaque[ top:bottom, left:right ].all():
+            raise Unoptimizable( 'Frame with transparency and more than 255 colors' )
+        drawn  = np.ones_like( drawn )
+        colors = np.unique( pixels )
+        if len( colors ) > 256:
+            raise Unoptimizable( 'Frame with more than 256 colors' )
+    keep = not drawn.all()
+
+    if table is not None and len( colors ) <= len( table ) and ( len( table ) < 256 or not keep ):
+        found = np.minimum( np.searchsorted( table, colors ), len( table ) - 1 )
+        if ( table[ found ] == colors ).all():
+            colors = None
+    lookup      = table if colors is None else colors
+    transparent = len( lookup ) if keep else None
+    indices     = np.empty( drawn.shape, dtype=np.uint8 )
+    if keep:
+        indices[ ... ]   = transparent
+        indices[ drawn ] = np.searchsorted( lookup, pixels[ drawn ] )
+    else:
+        indices[ ... ] = np.searchsorted( lookup, pixels )
+    return left, top, indices, colors, transparent
+
+
+def choose_image( target, canvas, base, rect, table ):
+    """
+    Best way to draw target after the frame that left canvas when drawn on
+    base at rect ( left, top, width, height ), canvases as of canvas_pixels:
+    ( disposal of that frame, image as of changed_image, canvas target is
+    drawn on ). The image with the fewest pixels wins, then one using table.
+    """
+    best = None
+    for disposal in DISPOSALS:
+        if disposal == 1:
+            before = canvas
+        elif disposal == 2:
+            left, top, width, height = rect
+            colors, opaque = canvas[ 0 ], canvas[ 1 ].copy()
+            opaque[ top:top + height, left:left + width ] = False
+            before = ( colors, opaque )
+        else:
+            before = base
+        try:
+            image = changed_image( target, before, table )
+        except Unoptimizable:
+            # Too many colors changed on this base, others may do.
+            continue
+        if image is None:
+            continue
+        score = ( image[ 2 ].size, image[ 3 ] is not None )
+        if best is None or score < best[ 0 ]:
+            best = ( score, disposal, image, before )
+    if best is None:
+        raise Unoptimizable( 'Frame cannot be drawn over the frames before it' )
+    return best[ 1: ]
+
+
+def optimized_images( frames, width, height, table ):
+    """
+    ( image, ( delay, disposal, transparent ) ) of frames from merged_frames,
+    images as of indexed_image. The disposal of a frame is only known once
+    the next one is chosen, images come one frame behind.
+    """
+    previous = None
+    canvas   = base = rect = None
+    for target, delay, disposal in frames:
+        target = canvas_pixels( target )
+        if previous is None:
+            before = ( np.zeros( ( height, width ), dtype=np.uint32 ), np.zeros( ( height, width ), dtype=bool ) )
+            image  = changed_image( target, before, table, full=True )
+        else:
+            chosen, image, before = choose_image( target, canvas, base, rect, table )
+            image_block, ( last_delay, _, last_transparent ) = previous
+            yield image_block, ( last_delay, chosen, last_transparent )
+
+        left, top, indices, colors, transparent = image
+        frame_height, frame_width = indices.shape
+        palette    = None if colors is None else color_palette( colors, transparent is not None )
+        descriptor = image_descriptor( left, top, frame_width, frame_height, palette )
+        # The minimum code size only has to cover the indices drawn.
+        previous = ( ( descriptor, indices, int( indices.max() ) + 1, None ), ( delay, disposal, transparent ) )
+        canvas   = target
+        base     = before
+        rect     = ( left, top, frame_width, frame_height )
+    if previous is not None:
+        yield previous
+
+
+def write_optimized( index, gif_file, processes=1, window=None, progress=None, cancel=None ):
+    """
+    Write the optimized GIF of index to gif_file, a binary file object,
+    encoding in processes processes (see write_gif). Return the number of
+    frames written.
+    """
+    if progress is None:
+        progress = ProgressReporter()
+    if cancel is None:
+        cancel = CancelToken()
+
+    progress.stage( 'palette', len( index ) )
+    table   = used_colors( index, progress, cancel )
+    palette = None
+    if table is not None and len( table ):
+        # Room for a transparent color after the colors drawn, if any.
+        palette = color_palette( table, len( table ) < 256 )
+    else:
+        table = None
+
+    progress.stage( 'optimize', len( index ) )
+    # Frames keep their own delays, the writer's fps is not used.
+    writer = GifWriter( gif_file, 100, palette=palette, loop=index.loop )
+    writer.start( index.width, index.height )
+    progress.advance( bytes=writer.bytes )
+    frames = merged_frames( index, checked( counted( range( len( index ) ), progress ), cancel ) )
+    images = optimized_images( frames, index.width, index.height, table )
+    with encoding_pool( processes ) as pool:
+        for block, ( delay, disposal, transparent ) in compress_images( images, pool, window ):
+            progress.advance( bytes=writer.write( block, disposal, transparent, delay ) )
+    writer.close()
+    return writer.frames
+
+
+def optimize_gif( gif_name, output_name=None, processes=1, window=None, progress=None, cancel=None ):
+    """
+    Optimize GIF file gif_name to output_name, in place by default. Return
+    the sizes in bytes of gif_name and of the result.
+
+    The original bytes are kept when the optimized GIF would not be smaller
+    or when a frame cannot be rewritten losslessly. As make_gif, the result
+    is written to a partial file renamed once complete, progress and cancel
+    are an engine.progress.ProgressReporter and an engine.cancel.CancelToken.
+    """
+    if progress is None:
+        progress = ProgressReporter()
+    output_name = output_name or gif_name
+    in_place    = os.path.abspath( output_name ) == os.path.abspath( gif_name )
+    partial     = partial_gif_name( output_name )
+    size        = os.path.getsize( gif_name )
+    frames      = None
+    try:
+        index = GifIndex( gif_name )
+        try:
+            with open( partial, 'wb' ) as gif:
+                frames = write_optimized( index, gif, processes, window, progress, cancel )
+        except Unoptimizable:
+            pass
+        finally:
+            index.close()
+
+        if frames is None or os.path.getsize( partial ) >= size:
+            os.remove( partial )
+            if not in_place:
+                shutil.copyfile( gif_name, partial )
+        if os.path.exists( partial ):
+            if os.path.exists( output_name ):
+                # Windows does not rename over an existing file.
+                os.remove( output_name )
+            os.rename( partial, output_name )
+    finally:
+        if os.path.exists( partial ):
+            os.remove( partial )
+    progress.finish( frames )
+    return size, os.path.getsize( output_name )
+
+
+def gif_files( paths ):
+    """ GIF files of paths, files or directories of GIFs (not searched recursively). """
+    files = []
+    for path in paths:
+        if os.path.isdir( path ):
+            files.extend( os.path.join( path, name ) for name in sorted( os.listdir( path ) )
+                          if name.lower().endswith( '.gif' ) and not name.lower().endswith( '.partial.gif' ) )
+        else:
+            files.append( path )
+    return files
@@ -0,0 +1,298 @@
+"""
+Color quantization for GIF frames.
+
+Three quantizers turn a sample of RGB pixels into a palette of at most 256
+colors, all vectorized with NumPy:
+
+- median-cut, recursively splits the color box with the widest range.
+- octree, merges the least used octree nodes bottom-up.
+- kmeans, mini-batch k-means seeded with the median-cut palette.
+
+A global palette is built from a bounded sample of frames picked while
+frames stream by, so its cost depends on the number of sampled pixels and
+not on the length of the clip. Frames are mapped to a palette through a
+lookup table on a 32x32x32 color grid, pixels of the few cells where the
+table would miss a palette color get their exact nearest color.
+"""
+from __future__ import division
+
+import numpy as np
+
+
+QUANTIZERS = [ 'median-cut', 'octree', 'kmeans' ]
+# Frame sampling for global palettes.
+# stride - every n-th frame, n doubles when too many frames are sampled.
+# scene  - the first frame and every frame that differs from the last sampled one.
+SAMPLINGS  = [ 'stride', 'scene' ]
+
+MAX_SAMPLE_FRAMES   = 32
+SAMPLE_PIXELS       = 16384
+# Mean absolute difference per channel treated as a scene change.
+SCENE_THRESHOLD     = 24.0
+# RMS error per channel above which a frame gets its own local palette.
+LOCAL_PALETTE_ERROR = 12.0
+
+LUT_BITS = 5
+
+
+def _as_pixels( pixels ):
+    return np.asarray( pixels, dtype=np.uint8 ).reshape( -1, 3 )
+
+
+def median_cut( pixels, colors=256 ):
+    """
+    Median cut palette, uint8 array of shape ( n, 3 ) with n the smaller of
+    colors and the number of distinct colors of pixels. Boxes are split at
+    the color boundary nearest to the median, so a color is never shared by
+    two boxes and boxes of a single color are not split further.
+    """
+    pixels = _as_pixels( pixels )
+    if not len( pixels ):
+        return np.zeros( ( 1, 3 ), dtype=np.uint8 )
+
+    def score( box ):
+        ranges = box.max( axis=0 ).astype( np.int32 ) - box.min( axis=0 )
+        return int( ranges.max() ) * len( box ), int( ranges.argmax() )
+
+    boxes  = [ pixels ]
+    scores = [ score( pixels ) ]
+    while len( boxes ) < colors:
+        index = max( range( len( boxes ) ), key=lambda i: scores[ i ][ 0 ] )
+        if scores[ index ][ 0 ] <= 0:
+            # Every box holds a single color.
+            break
+        box    = boxes.pop( index )
+        axis   = scores.pop( index )[ 1 ]
+        values = box[ :, axis ]
+        median = np.partition( values, len( box ) // 2 )[ len( box ) // 2 ]
+        lower  = values < median
+        if not lower.any():
+            # The median is the lowest value, split right above it.
+            lower = values <= median
+        for half in ( box[ lower ], box[ ~lower ] ):
+            boxes.append( half )
+            scores.append( score( half ) )
+
+    return np.array( [ box.mean( axis=0 ) for box in boxes ] ).round().astype( np.uint8 )
+
+
+def _octree_keys( pixels, level ):
+    """ Octree node keys of pixels at level 1 ( 8 nodes ) to 8 ( single colors ). """
+    shift = 8 - level
+    r, g, b = [ ( pixels[ :, channel ].astype( np.int64 ) >> shift ) for channel in range( 3 ) ]
+    keys = np.zeros( len( pixels ), dtype=np.int64 )
+    for bit in range( level - 1, -1, -1 ):
+        keys = ( keys << 3 ) | ( ( ( r >> bit ) & 1 ) << 2 ) | ( ( ( g >> bit ) & 1 ) << 1 ) | ( ( b >> bit ) & 1 )
+    return keys
+
+
+def octree( pixels, colors=256 ):
+    """
+    Octree palette, uint8 array of shape ( n, 3 ) with n the smaller of
+    colors and the number of distinct colors of pixels. Leaves start at
+    single colors, the children of the least populated nodes of the deepest
+    level are merged into their parent until colors leaves are left. The
+    last parent merged only gets as many of its least populated children as
+    needed.
+    """
+    pixels = _as_pixels( pixels )
+    if not len( pixels ):
+        return np.zeros( ( 1, 3 ), dtype=np.uint8 )
+
+    keys, inverse, counts = np.unique( _octree_keys( pixels, 8 ), return_inverse=True, return_counts=True )
+    sums   = np.stack( [ np.bincount( inverse.ravel(), weights=pixels[ :, channel ] )
+                         for channel in range( 3 ) ], axis=1 )
+    levels = np.full( len( keys ), 8, dtype=np.int64 )
+
+    while len( keys ) > colors:
+        level   = levels.max()
+        deepest = np.flatnonzero( levels == level )
+        parents, parent_inverse, children = np.unique( keys[ deepest ] >> 3, return_inverse=True,
+                                                       return_counts=True )
+        parent_counts = np.bincount( parent_inverse.ravel(), weights=counts[ deepest ] )
+
+        # Merge least populated parents first, just enough of them.
+        parent_inverse = parent_inverse.ravel()
+        order   = np.argsort( parent_counts, kind='mergesort' )
+        removed = np.cumsum( children[ order ] - 1 )
+        needed  = len( keys ) - colors
+        last    = np.searchsorted( removed, needed )
+        merged  = np.zeros( len( parents ), dtype=bool )
+        merged[ order[ :last ] ] = True
+        merging = deepest[ merged[ parent_inverse ] ]
+
+        if last < len( order ):
+            # Then as many children of the next parent as still needed.
+            left     = needed - ( removed[ last - 1 ] if last else 0 )
+            siblings = deepest[ parent_inverse == order[ last ] ]
+            siblings = siblings[ np.argsort( counts[ siblings ], kind='mergesort' ) ][ :left + 1 ]
+            merging  = np.concatenate( [ merging, siblings ] )
+        keys[ merging ]   >>= 3
+        levels[ merging ] -= 1
+
+        # Collapse leaves that now share a node.
+        node_ids = levels * ( 1 << 24 ) + keys
+        _, first, inverse = np.unique( node_ids, return_index=True, return_inverse=True )
+        inverse = inverse.ravel()
+        keys    = keys[ first ]
+        levels  = levels[ first ]
+        counts  = np.bincount( inverse, weights=counts )
+        sums    = np.stack( [ np.bincount( inverse, weights=sums[ :, channel ] ) for channel in range( 3 ) ],
+                            axis=1 )
+
+    return ( sums / counts[ :, None ] ).round().clip( 0, 255 ).astype( np.uint8 )
+
+
+def nearest( points, palette, chunk=16384 ):
+    """ Index of the nearest palette color of every point. """
+    points  = np.asarray( points, dtype=np.float32 ).reshape( -1, 3 )
+    palette = np.asarray( palette, dtype=np.float32 )
+    norms   = ( palette ** 2 ).sum( axis=1 )
+    result  = np.empty( len( points ), dtype=np.intp )
+    for start in range( 0, len( points ), chunk ):
+        block = points[ start:start + chunk ]
+        # |p - c|^2 without the |p|^2 term, which does not change the argmin.
+        result[ start:start + chunk ] = ( norms[ None, : ] - 2 * block.dot( palette.T ) ).argmin( axis=1 )
+    return result
+
+
+def kmeans( pixels, colors=256, iterations=32, batch_size=4096, seed=0 ):
+    """
+    Mini-batch k-means palette seeded with the median cut palette,
+    uint8 array of shape ( n, 3 ) with n <= colors.
+    """
+    pixels  = _as_pixels( pixels )
+    centers = median_cut( pixels, colors ).astype( np.float64 )
+    if len( pixels ) <= len( centers ):
+        return centers.astype( np.uint8 )
+
+    random = np.random.RandomState( seed )
+    totals = np.zeros( len( centers ) )
+    for _ in range( iterations ):
+        batch  = pixels[ random.randint( 0, len( pixels ), size=min( batch_size, len( pixels ) ) ) ]
+        labels = nearest( batch, centers )
+        counts = np.bincount( labels, minlength=len( centers ) ).astype( np.float64 )
+        sums   = np.stack( [ np.bincount( labels, weights=batch[ :, channel ], minlength=len( centers ) )
+                             for channel in range( 3 ) ], axis=1 )
+        totals += counts
+        hit     = counts > 0
+        # Per center learning rate decreasing with the pixels it has seen.
+        rate    = ( counts[ hit ] / totals[ hit ] )[ :, None ]
+        centers[ hit ] += rate * ( sums[ hit ] / counts[ hit ][ :, None ] - centers[ hit ] )
+
+    return centers.round().clip( 0, 255 ).astype( np.uint8 )
+
+
+def build_palette( pixels, method='median-cut', colors=256 ):
+    """ Palette of pixels made by one of QUANTIZERS. """
+    if method == 'octree':
+        return octree( pixels, colors )
+    if method == 'kmeans':
+        return kmeans( pixels, colors )
+    if method == 'median-cut':
+        return median_cut( pixels, colors )
+    raise ValueError( 'Unknown quantizer {}, use one of {}'.format( method, QUANTIZERS ) )
+
+
+def palette_lut( palette, bits=LUT_BITS ):
+    """ Nearest palette index of every cell of a ( 2 ** bits ) ** 3 color grid. """
+    levels  = ( np.arange( 2 ** bits ) << ( 8 - bits ) ) + ( 1 << ( 7 - bits ) )
+    r, g, b = np.meshgrid( levels, levels, levels, indexing='ij' )
+    cells   = np.stack( [ r.ravel(), g.ravel(), b.ravel() ], axis=1 )
+    return nearest( cells, palette ).astype( np.uint8 )
+
+
+def color_cells( frame, bits=LUT_BITS ):
+    """ Color grid cell of every pixel of an RGB frame, see palette_lut. """
+    shift = 8 - bits
+    frame = np.asarray( frame )
+    r     = ( frame[ ..., 0 ] >> shift ).astype( np.intp )
+    g     = ( frame[ ..., 1 ] >> shift ).astype( np.intp )
+    b     = ( frame[ ..., 2 ] >> shift ).astype( np.intp )
+    return ( r << ( 2 * bits ) ) | ( g << bits ) | b
+
+
+def lookup( frame, palette, lut ):
+    """
+    Palette indices of an RGB frame through lut. A cell holding several
+    palette colors maps to a single one, pixels of cells holding a palette
+    color lut maps elsewhere get their nearest color, so palette colors
+    always map to themselves.
+    """
+    cells    = color_cells( palette )
+    missed   = np.zeros( len( lut ), dtype=bool )
+    missed[ cells[ ( palette[ lut[ cells ] ] != palette ).any( axis=1 ) ] ] = True
+    frame    = np.asarray( frame )
+    cells    = color_cells( frame )
+    indices  = lut[ cells ]
+    refine   = missed[ cells ]
+    if refine.any():
+        # Frames repeat colors a lot, look every color up once.
+        pixels = frame[ refine ]
+        keys   = ( pixels[ :, 0 ].astype( np.int32 ) << 16 ) | ( pixels[ :, 1 ].astype( np.int32 ) << 8 ) | pixels[ :, 2 ]
+        _, first, inverse = np.unique( keys, return_index=True, return_inverse=True )
+        indices[ refine ] = nearest( pixels[ first ], palette )[ inverse.ravel() ]
+    return indices
+
+
+def remap_error( frame, palette, lut ):
+    """
+    RMS error per channel of mapping an RGB frame to palette through lut,
+    estimated on every fourth pixel in both directions.
+    """
+    sample = frame[ ::4, ::4 ]
+    error  = sample.astype( np.int32 ) - palette[ lookup( sample, palette, lut ) ]
+    return float( np.sqrt( ( error ** 2 ).mean() ) )
+
+
+def sample_pixels( frame, count=SAMPLE_PIXELS, seed=0 ):
+    """ At most count pixels of frame picked at random, shape ( n, 3 ). """
+    pixels = _as_pixels( frame )
+    if len( pixels ) <= count:
+        return pixels
+    return pixels[ np.random.RandomState( seed ).randint( 0, len( pixels ), size=count ) ]
+
+
+class FrameSampler( object ):
+    """
+    Pick frames for a global palette while frames stream by.
+
+    At most max_frames frames are kept. When more are picked every other
+    sample is dropped and, in stride mode, the stride doubles, so the
+    number of sampled pixels stays bounded however long the clip is.
+    """
+
+    def __init__( self, sampling='stride', max_frames=MAX_SAMPLE_FRAMES, pixels_per_frame=SAMPLE_PIXELS ):
+        if sampling not in SAMPLINGS:
+            raise ValueError( 'Unknown sampling {}, use one of {}'.format( sampling, SAMPLINGS ) )
+        self.sampling         = sampling
+        self.max_frames       = max_frames
+        self.pixels_per_frame = pixels_per_frame
+        self.stride           = 1
+        self.count            = 0
+        self.samples          = []
+        self._last            = None
+
+    def offer( self, frame ):
+        """ Look at the next frame of the clip, keep its pixels if it is picked. """
+        index       = self.count
+        self.count += 1
+        if self.sampling == 'scene':
+            thumbnail = frame[ ::8, ::8 ].astype( np.int16 )
+            picked    = self._last is None or np.abs( thumbnail - self._last ).mean() > SCENE_THRESHOLD
+            if picked:
+                self._last = thumbnail
+        else:
+            picked = index % self.stride == 0
+        if not picked:
+            return
+
+        self.samples.append( sample_pixels( frame, self.pixels_per_frame, seed=index ) )
+        if len( self.samples ) > self.max_frames:
+            self.samples = self.samples[ ::2 ]
+            self.stride *= 2
+
+    def pixels( self ):
+        if not self.samples:
+            return np.zeros( ( 0, 3 ), dtype=np.uint8 )
+        return np.concatenate( self.samples )
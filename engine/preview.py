@@ -0,0 +1,69 @@
+"""
+Small, fast previews of GIF jobs.
+
+A preview renders the same clip as the job, shrunk to PREVIEW_SIZE pixels,
+at no more than PREVIEW_FPS and PREVIEW_FRAMES, with the fastest options of
+the gifer engine, to a temporary file. It takes a fraction of a second for
+short clips, so the GUI can render one after every parameter change.
+"""
+from __future__ import division
+import copy
+import os
+import tempfile
+
+from engine.probe import video_metadata
+from engine.render import make_gif, output_size
+
+
+# Longest side of a preview in pixels, its maximum fps and number of frames.
+PREVIEW_SIZE   = 240
+PREVIEW_FPS    = 10
+PREVIEW_FRAMES = 100
+
+
+def preview_info( info, size=PREVIEW_SIZE, fps=PREVIEW_FPS, frames=PREVIEW_FRAMES ):
+    """ Copy of info rendering a preview of at most size pixels, fps and frames. """
+    metadata = video_metadata( info.video )
+    preview  = copy.copy( info )
+
+    width, height = output_size( info, metadata[ 'size' ] ) or metadata[ 'size' ]
+    ratio         = min( size / max( width, height ), 1 )
+    preview.scale = None
+    preview.update_width( max( int( round( width * ratio ) ), 1 ) )
+    preview.update_height( max( int( round( height * ratio ) ), 1 ) )
+
+    start    = info.start or 0
+    end      = info.end if info.end is not None else metadata[ 'duration' ]
+    duration = max( end - start, 0 ) / ( info.speed or 1 )
+    fps      = min( info.fps or metadata[ 'fps' ], fps )
+    if duration * fps > frames:
+        fps = max( frames / duration, 1 )
+    preview.fps = fps
+
+    # Fastest settings, the palette and dithering hardly show at this size.
+    preview.engine           = 'gifer'
+    preview.resize_filter    = 'fast_bilinear'
+    preview.quantizer        = None
+    preview.delta            = False
+    preview.dither           = 'none'
+    preview.encode_processes = 1
+    preview.encode_window    = None
+    # Previews are small anyway, planning a size budget would take longer.
+    preview.max_bytes        = None
+    return preview
+
+
+def make_preview( info, progress=None, cancel=None ):
+    """
+    Render a preview of info to a new temporary GIF file and return its
+    name, the caller removes it. progress and cancel as in make_gif.
+    """
+    handle, gif_name = tempfile.mkstemp( prefix='gifer_preview_', suffix='.gif' )
+    os.close( handle )
+    try:
+        make_gif( preview_info( info ), gif_name, verbose=False, progress=progress, cancel=cancel )
+    except BaseException:
+        if os.path.exists( gif_name ):
+            os.remove( gif_name )
+        raise
+    return gif_name
@@ -0,0 +1,114 @@
+"""
+Video metadata needed to make GIF animations: size, duration and fps.
+
+Videos are probed with a single ffprobe JSON call and the result is kept in
+the video's cache entry (see engine.cache) and in memory, so a known video
+is never probed twice. Many videos can be probed at once by a bounded pool
+of threads, each thread just waits for its ffprobe process.
+"""
+from __future__ import division
+import json
+import logging
+import os
+from multiprocessing.pool import ThreadPool
+
+from engine.cache import load_entry, update_entry, video_key
+from engine.ffmpeg import run_ffprobe
+
+
+VIDEO_EXTENSIONS = [ '.mp4', '.m4v', '.mkv', '.mov', '.avi', '.wmv', '.flv', '.webm', '.mpg', '.mpeg', '.ts' ]
+PROBE_THREADS    = 8
+
+# Metadata probed by this process, keyed by engine.cache.video_key.
+_metadata = {}
+
+
+def _frame_rate( rate ):
+    """ Frame rate from ffprobe's fraction string like 30000/1001, None if unknown. """
+    numerator, _, denominator = ( rate or '' ).partition( '/' )
+    try:
+        return float( numerator ) / float( denominator or 1 )
+    except ( ValueError, ZeroDivisionError ):
+        return None
+
+
+def probe_video( video, cancel=None ):
+    """ Probe video with ffprobe, return dict with size, duration and fps. """
+    output = run_ffprobe( [ '-select_streams', 'v:0',
+                            '-show_entries', 'stream=width,height,avg_frame_rate,r_frame_rate,duration'
+                                             ':format=duration',
+                            '-of', 'json', video ], cancel=cancel )
+    data    = json.loads( output.decode( 'utf-8' ) )
+    streams = data.get( 'streams' )
+    if not streams:
+        raise IOError( 'No video stream in {}'.format( video ) )
+    stream   = streams[ 0 ]
+    fps      = _frame_rate( stream.get( 'avg_frame_rate' ) ) or _frame_rate( stream.get( 'r_frame_rate' ) )
+    duration = data.get( 'format', {} ).get( 'duration' ) or stream.get( 'duration' )
+    return { 'size'    : [ int( stream[ 'width' ] ), int( stream[ 'height' ] ) ],
+             'duration': float( duration ) if duration else None,
+             'fps'     : fps, }
+
+
+def probe_video_moviepy( video ):
+    """ Probe video by parsing ffmpeg's output, used when ffprobe is missing. """
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    infos = ffmpeg_parse_infos( video )
+    return { 'size'    : list( infos[ 'video_size' ] ),
+             'duration': infos[ 'duration' ],
+             'fps'     : infos[ 'video_fps' ], }
+
+
+def video_metadata( video, cancel=None ):
+    """
+    Return dict with size [ width, height ], duration in second and fps of video.
+    Raise engine.cancel.Cancelled if cancel is cancelled while probing.
+    """
+    key = video_key( video )
+    if key in _metadata:
+        return _metadata[ key ]
+
+    metadata = load_entry( video ).get( 'metadata' )
+    if metadata is None:
+        try:
+            metadata = probe_video( video, cancel=cancel )
+        except IOError as err:
+            logging.warning( 'ffprobe failed on {}, falling back to ffmpeg: {}'.format( video, err ) )
+            if cancel:
+                cancel.check()
+            metadata = probe_video_moviepy( video )
+        update_entry( video, metadata=metadata )
+    _metadata[ key ] = metadata
+    return metadata
+
+
+def _metadata_or_error( video ):
+    try:
+        return video, video_metadata( video )
+    except Exception as err:
+        return video, err
+
+
+def probe_many( videos, threads=PROBE_THREADS ):
+    """
+    Metadata of many videos, probed concurrently by at most threads threads.
+    Return dict of video to its metadata, or to the exception raised while
+    probing it.
+    """
+    unique = list( dict.fromkeys( videos ) )
+    if not unique:
+        return {}
+    pool = ThreadPool( min( threads, len( unique ) ) )
+    try:
+        return dict( pool.map( _metadata_or_error, unique ) )
+    finally:
+        pool.close()
+        pool.join()
+
+
+def probe_directory( directory, threads=PROBE_THREADS ):
+    """ Metadata of all videos in directory, see probe_many. """
+    videos = [ os.path.join( directory, name ) for name in sorted( os.listdir( directory ) )
+               if os.path.splitext( name )[ 1 ].lower() in VIDEO_EXTENSIONS ]
+    return probe_many( videos, threads=threads )
@@ -0,0 +1,189 @@
+"""
+Progress reporting of GIF jobs.
+
+The engine reports ProgressEvents to a callback through a ProgressReporter
+instead of printing. Reporters are rate limited, so the callback is called at
+most once per interval however fast frames come, and thread safe, so several
+decoder or writer threads can share one. Worker processes report through a
+queue, see relay_events.
+"""
+from __future__ import division, print_function
+import threading
+import time
+
+from engine import instrument
+
+
+# Stages of a job, in order. decode and palette only happen when frames are
+# buffered for a global palette, optimize when an existing GIF is rewritten
+# by engine.optimize, plan when frames are sampled to fit a size budget
+# (engine.budget). encode counts the reversed half of mirrored GIFs too.
+STAGES = [ 'start', 'plan', 'decode', 'palette', 'encode', 'download', 'optimize', 'done' ]
+
+# Seconds between two events of a reporter.
+DEFAULT_INTERVAL = 0.5
+
+
+class ProgressEvent( object ):
+    """
+    Progress of a job at one moment. frames and fps count the frames of the
+    current stage, bytes the bytes written so far, eta is in seconds and None
+    when the stage's total is unknown. Plain attributes, so events can be
+    pickled and sent between processes.
+    """
+
+    def __init__( self, stage, frames=0, total_frames=None, bytes=0, total_bytes=None,
+                  elapsed=0.0, fps=None, eta=None, job=None ):
+        self.stage        = stage
+        self.frames       = frames
+        self.total_frames = total_frames
+        self.bytes        = bytes
+        self.total_bytes  = total_bytes
+        self.elapsed      = elapsed
+        self.fps          = fps
+        self.eta          = eta
+        self.job          = job
+
+    def message( self ):
+        """ One line description of the event, e.g. u'[encode] 12/30 frames, 48.2 KB, 25.0 fps, ETA 0:01'. """
+        parts = []
+        if self.frames or self.total_frames:
+            total = '/{}'.format( self.total_frames ) if self.total_frames else ''
+            parts.append( u'{}{} frames'.format( self.frames, total ) )
+        if self.bytes or self.total_bytes:
+            total = u'/' + format_bytes( self.total_bytes ) if self.total_bytes else u''
+            parts.append( format_bytes( self.bytes ) + total )
+        if self.fps:
+            parts.append( u'{:.1f} fps'.format( self.fps ) )
+        if self.eta is not None:
+            parts.append( u'ETA ' + format_seconds( self.eta ) )
+        prefix = u'[{}]'.format( self.stage ) if self.job is None else u'[job {} {}]'.format( self.job, self.stage )
+        return u' '.join( [ prefix, u', '.join( parts ) ] ).rstrip()
+
+
+def format_bytes( size ):
+    """ Human readable size, e.g. u'48.2 KB'. """
+    for unit in ( u'B', u'KB', u'MB' ):
+        if size < 1024:
+            return u'{:.1f} {}'.format( size, unit ) if unit != u'B' else u'{} B'.format( int( size ) )
+        size /= 1024
+    return u'{:.1f} GB'.format( size )
+
+
+def format_seconds( seconds ):
+    """ Seconds as u'M:SS'. """
+    minutes, seconds = divmod( int( round( seconds ) ), 60 )
+    return u'{}:{:02d}'.format( minutes, seconds )
+
+
+def print_event( event ):
+    """ Callback printing the message of every event, used by the command line. """
+    print( event.message() )
+
+
+class ProgressReporter( object ):
+    """
+    Count frames and bytes of a job and pass ProgressEvents to callback, at
+    most one every interval seconds. Stage changes, the last frame of a
+    stage and finish are always reported. Without callback nothing is
+    reported, engines can report unconditionally.
+
+    All methods may be called from several threads at once.
+    """
+
+    def __init__( self, callback=None, interval=DEFAULT_INTERVAL, job=None, clock=time.time ):
+        self.callback     = callback
+        self.interval     = interval
+        self.job          = job
+        self.clock        = clock
+        self.lock         = threading.Lock()
+        self.current      = 'start'
+        self.frames       = 0
+        self.total_frames = None
+        self.bytes        = 0
+        self.total_bytes  = None
+        self.started      = clock()
+        self.stage_start  = self.started
+        self.last_event   = None
+
+    def stage( self, stage, total_frames=None, total_bytes=None ):
+        """ Start stage, expecting total_frames frames or total_bytes bytes if known. """
+        instrument.stage( stage )
+        with self.lock:
+            self.current      = stage
+            self.frames       = 0
+            self.total_frames = total_frames
+            self.total_bytes  = total_bytes
+            self.stage_start  = self.clock()
+            self._report( force=True )
+
+    def advance( self, frames=0, bytes=0 ):
+        """ Count frames more frames of the current stage and bytes more bytes written. """
+        with self.lock:
+            self.frames += frames
+            self.bytes  += bytes
+            self._report( force=bool( frames ) and self.frames == self.total_frames )
+
+    def update( self, frames=None, bytes=None ):
+        """ Set the frames of the current stage or the bytes written, for sources reporting totals. """
+        with self.lock:
+            if frames is not None:
+                self.frames = frames
+            if bytes is not None:
+                self.bytes = bytes
+            self._report()
+
+    def finish( self, frames=None ):
+        """ Report the done stage with frames frames in total. """
+        instrument.stage( 'done' )
+        with self.lock:
+            self.current      = 'done'
+            self.total_frames = None
+            self.total_bytes  = None
+            self.stage_start  = self.started
+            if frames is not None:
+                self.frames = frames
+            self._report( force=True )
+
+    def event( self ):
+        """ ProgressEvent of the current state. """
+        with self.lock:
+            return self._event( self.clock() )
+
+    def _event( self, now ):
+        elapsed = now - self.stage_start
+        fps     = self.frames / elapsed if self.frames and elapsed > 0 else None
+        eta     = None
+        if self.total_frames and fps:
+            eta = max( self.total_frames - self.frames, 0 ) / fps
+        elif self.total_bytes and self.bytes and elapsed > 0:
+            eta = max( self.total_bytes - self.bytes, 0 ) / ( self.bytes / elapsed )
+        return ProgressEvent( self.current, self.frames, self.total_frames, self.bytes, self.total_bytes,
+                              elapsed=now - self.started, fps=fps, eta=eta, job=self.job )
+
+    def _report( self, force=False ):
+        """ Pass the current event to callback if forced or interval has passed, holding lock. """
+        if self.callback is None:
+            return
+        now = self.clock()
+        if not force and self.last_event is not None and now - self.last_event < self.interval:
+            return
+        self.last_event = now
+        self.callback( self._event( now ) )
+
+
+def counted( frames, progress ):
+    """ Pass frames through, counting each in progress. """
+    for frame in frames:
+        progress.advance( 1 )
+        yield frame
+
+
+def relay_events( queue, callback ):
+    """
+    Pass events put on queue (e.g. by ProgressReporters of worker processes
+    with queue.put as callback) to callback, until None is put. Run it in a
+    thread of the parent process.
+    """
+    for event in iter( queue.get, None ):
+        callback( event )
@@ -0,0 +1,242 @@
+"""
+GIF rendering pipeline: decode, resize, change speed, mirror and write.
+
+The pipeline is driven by an Info object and does not depend on PyQt4, the
+GUI thread only wraps it.
+"""
+import copy
+import os
+
+from engine import instrument
+from engine.cancel import CancelToken
+from engine.ffmpeg import gif_filtergraph, run_ffmpeg
+from engine.keyframes import keyframe_before, keyframes, seek_arguments
+from engine.probe import video_metadata
+from engine.progress import ProgressReporter, print_event
+
+
+# GIF writing engines.
+# moviepy - decode with MoviePy and write frames with engine.gif.write_gif.
+# ffmpeg  - one ffmpeg process with a palettegen / paletteuse filtergraph.
+# gifer   - decode through an ffmpeg pipe seeking by keyframe index and write
+#           frames with engine.gif.write_gif.
+ENGINES = [ 'moviepy', 'ffmpeg', 'gifer' ]
+
+
+def default_gif_name( video_name ):
+    """ GIF file name used when none is given, the video name with .gif extension. """
+    return os.path.splitext( video_name )[ 0 ] + '.gif'
+
+
+def output_size( info, source_size ):
+    """ GIF size [ width, height ] for the resize parameters in info, None if not resized. """
+    width, height = source_size
+    if info.scale:
+        return [ int( round( width * info.scale ) ), int( round( height * info.scale ) ) ]
+    if info.width and info.height:
+        return [ int( round( info.width ) ), int( round( info.height ) ) ]
+    if info.width:
+        return [ int( round( info.width ) ), int( round( height * info.width / float( width ) ) ) ]
+    if info.height:
+        return [ int( round( width * info.height / float( height ) ) ), int( round( info.height ) ) ]
+    return None
+
+
+def source_fps( info ):
+    """ Frame rate of the video in info, probed if it is not known yet. """
+    if info.original_fps:
+        return info.original_fps
+    return video_metadata( info.video )[ 'fps' ]
+
+
+def snap_to_keyframe( info ):
+    """ Copy of info whose start is moved back to the keyframe before it. """
+    times = keyframes( info.video )
+    if times is None:
+        return info
+    snapped = copy.copy( info )
+    snapped.update_start( keyframe_before( times, info.start ) )
+    return snapped
+
+
+def partial_gif_name( gif_name ):
+    """ File a GIF is written to until it is complete, still ending with .gif for ffmpeg. """
+    root, ext = os.path.splitext( gif_name )
+    return root + '.partial' + ( ext or '.gif' )
+
+
+def kill_reader( reader ):
+    """ Kill the ffmpeg process of a MoviePy reader, from any thread, close reaps it. """
+    proc = getattr( reader, 'proc', None )
+    if proc is not None and proc.poll() is None:
+        proc.kill()
+
+
+def expected_frames( info, fps ):
+    """ Rough number of frames of the GIF for info at fps, before mirroring. """
+    start = info.start or 0
+    end   = info.end if info.end is not None else video_metadata( info.video )[ 'duration' ]
+    return max( int( round( ( end - start ) / ( info.speed or 1 ) * fps ) ), 1 )
+
+
+def make_gif( info, gif_name, verbose=True, progress=None, cancel=None ):
+    """
+    Make GIF animation gif_name from the video and parameters in info, using
+    the engine chosen by info.engine. Return the number of frames written.
+    MoviePy cannot decode keyframes only, time-lapses use the gifer engine.
+
+    Progress is reported to progress, an engine.progress.ProgressReporter,
+    printed if none is given and verbose.
+
+    Cancelling cancel, an engine.cancel.CancelToken, from another thread
+    kills the ffmpeg processes of the job at once and makes it raise
+    Cancelled after the frame at hand. The GIF is written to a partial file
+    renamed to gif_name once it is complete, and removed if the job is
+    cancelled or fails, so gif_name is never left half-written.
+
+    With info.max_bytes, the GIF is planned to fit that many bytes, see
+    engine.budget.make_gif_for_size.
+    """
+    if progress is None:
+        progress = ProgressReporter( print_event if verbose else None )
+    if cancel is None:
+        cancel = CancelToken()
+    if info.max_bytes:
+        from engine.budget import make_gif_for_size
+        return make_gif_for_size( info, gif_name, verbose, progress, cancel )
+    if info.snap_keyframe and info.start:
+        info = snap_to_keyframe( info )
+    partial = partial_gif_name( gif_name )
+    try:
+        cancel.check()
+        if info.engine == 'ffmpeg':
+            frames = make_gif_ffmpeg( info, partial, progress, cancel )
+        elif info.engine == 'gifer' or info.timelapse:
+            frames = make_gif_gifer( info, partial, progress, cancel )
+        else:
+            frames = make_gif_moviepy( info, partial, progress, cancel )
+        if os.path.exists( gif_name ):
+            # Windows does not rename over an existing file.
+            os.remove( gif_name )
+        os.rename( partial, gif_name )
+    finally:
+        if os.path.exists( partial ):
+            os.remove( partial )
+    progress.finish( frames )
+    return frames
+
+
+def make_gif_ffmpeg( info, gif_name, progress, cancel ):
+    """ Make GIF animation with a single ffmpeg filtergraph, see gif_filtergraph. """
+    start    = info.start or 0
+    duration = info.end - start if info.end is not None else None
+    # Without fps filter ffmpeg keeps one frame per source frame after the speed
+    # change, while write_gif samples at the source fps, keep the two equivalent.
+    fps      = info.fps or ( source_fps( info ) if info.speed and info.speed != 1 else None )
+
+    def show_progress( report ):
+        progress.update( frames=int( report.get( 'frame' ) or 0 ), bytes=int( report.get( 'total_size' ) or 0 ) )
+
+    # Jump to the keyframe before start, the filtergraph trims the rest.
+    seek, offset = seek_arguments( start, keyframes( info.video ) if start > 0 else None )
+    if info.timelapse:
+        # Decode keyframes only, from the one before start, the fps filter
+        # spreads them over the timeline.
+        seek     = [ '-skip_frame', 'nokey' ] + seek
+        duration = duration + offset if duration is not None else None
+        offset   = 0
+
+    total = expected_frames( info, fps or source_fps( info ) )
+    progress.stage( 'encode', total * 2 if info.mirrored else total )
+    report = run_ffmpeg( seek + [ '-i', info.video,
+                                  '-filter_complex', gif_filtergraph( info, fps, duration, offset ),
+                                  '-loop', '0', gif_name ],
+                         progress=show_progress, cancel=cancel )
+    return int( report.get( 'frame', 0 ) )
+
+
+def gifer_reader( info ):
+    """
+    FrameReader of the source frames shown by the GIF for info, the plan
+    placing them on the GIF timeline (see planned_frames) and the GIF's fps.
+    Only the source frames shown by the GIF come out of ffmpeg, see
+    frame_plan. In time-lapse mode only keyframes are decoded, see
+    keyframe_plan.
+    """
+    from engine.decode import FrameReader, frame_plan, keyframe_plan, select_expression, selected_plan
+
+    metadata = video_metadata( info.video )
+    start    = info.start or 0
+    end      = info.end if info.end is not None else metadata[ 'duration' ]
+    fps      = info.fps or metadata[ 'fps' ]
+    index    = keyframes( info.video ) if start > 0 or info.timelapse else None
+    speed    = info.speed or 1
+    select   = None
+    if info.timelapse and index:
+        plan = keyframe_plan( index, start, fps, speed, end - start, nearest=info.timelapse_snap == 'nearest' )
+    else:
+        plan   = frame_plan( metadata[ 'fps' ], fps, speed, end - start )
+        select = select_expression( metadata[ 'fps' ], fps, speed, plan )
+        if select:
+            plan = selected_plan( plan )
+    reader = FrameReader( info.video, metadata[ 'size' ], start, end - start, keyframes=index,
+                          output_size=output_size( info, metadata[ 'size' ] ),
+                          resize_filter=info.resize_filter, select=select,
+                          keyframes_only=bool( info.timelapse and index ) )
+    return reader, plan, fps
+
+
+def make_gif_gifer( info, gif_name, progress, cancel ):
+    """
+    Make GIF animation from frames decoded by FrameReader, which seeks with
+    the keyframe index of the video and scales frames while decoding, see
+    gifer_reader.
+    """
+    from engine.decode import planned_frames
+    from engine.gif import encoding_pool, write_gif
+
+    with encoding_pool( info.encode_processes ) as pool:
+        reader, plan, fps = gifer_reader( info )
+        kill = cancel.on_cancel( reader.kill )
+        try:
+            decoded = instrument.timed( reader, 'decode', count_bytes=True )
+            frames  = instrument.timed( planned_frames( decoded, plan ), 'remap' )
+            return write_gif( frames, gif_name, fps, mirrored=info.mirrored,
+                              quantizer=info.quantizer, colors=info.colors, sampling=info.sampling,
+                              delta=info.delta, dithering=info.dither, lossy=info.lossy, pool=pool,
+                              window=info.encode_window, progress=progress, total=len( plan ), cancel=cancel )
+        finally:
+            cancel.forget( kill )
+            reader.close()
+
+
+def make_gif_moviepy( info, gif_name, progress, cancel ):
+    """
+    Make GIF animation from frames decoded by MoviePy, written with
+    engine.gif.write_gif. Mirrored GIFs decode and encode every frame once
+    instead of time_symmetrize, which reads the clip backwards. Frames are
+    scaled by MoviePy's ffmpeg reader, not resized one by one.
+    """
+    from moviepy.editor import VideoFileClip
+    from engine.gif import encoding_pool, write_gif
+
+    size = output_size( info, video_metadata( info.video )[ 'size' ] )
+    with encoding_pool( info.encode_processes ) as pool:
+        # GIF has no sound, do not spawn an audio reader.
+        video = VideoFileClip( info.video, audio=False, target_resolution=size and size[ ::-1 ],
+                               resize_algorithm=info.resize_filter )
+        kill = cancel.on_cancel( lambda: kill_reader( video.reader ) )
+        try:
+            clip = video.subclip( info.start or 0, info.end )
+            if info.speed:
+                clip = clip.speedx( info.speed )
+            fps    = info.fps or clip.fps
+            frames = instrument.timed( clip.iter_frames( fps=fps, dtype='uint8' ), 'decode', count_bytes=True )
+            return write_gif( frames, gif_name, fps, mirrored=info.mirrored,
+                              quantizer=info.quantizer, colors=info.colors, sampling=info.sampling,
+                              delta=info.delta, dithering=info.dither, lossy=info.lossy, pool=pool,
+                              window=info.encode_window, progress=progress, total=int( clip.duration * fps ),
+                              cancel=cancel )
+        finally:
+            cancel.forget( kill )
+            video.reader.close()
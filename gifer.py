@@ -1,159 +1,131 @@
-import logging
+import copy
 import os
-import re
-import stat
-import subprocess as sp
 import sys
 
 from PyQt4 import QtCore, QtGui
-from imageio.core import InternetNotAllowedError, NeedDownloadError, get_platform, get_remote_file
-from imageio.plugins.ffmpeg import FNAME_PER_PLATFORM
-
+from imageio.core import NeedDownloadError
+
+from engine import Info, make_gif
+from engine.cancel import CancelToken, Cancelled
+from engine.ffmpeg import download_ffmpeg, find_ffmpeg
+from engine.optimize import optimize_gif
+from engine.preview import make_preview
+from engine.probe import video_metadata
+from engine.progress import ProgressReporter, format_bytes
+from player import GifPlayer
 from resources.central_widget_ui import Ui_Form
 import resources.icon
 
 
-class Info( object ):
-    """ Info object used to hold custom parameters to make GIF animation. """
+# Seconds between two progress messages sent to the GUI thread.
+PROGRESS_INTERVAL = 0.2
+# Milliseconds without parameter changes before a preview is rendered.
+PREVIEW_DELAY     = 400
+
+
+class GIFMakingThread( QtCore.QThread ):
 
     def __init__( self ):
-        # Video name.
-        self.video = None
-        # Clip time.
-        self.original_duration = None
-        self.start             = None
-        self.end               = None
-        # Clip size.
-        self.original_size = None
-        self.width         = None
-        self.height        = None
-        self.scale         = None
-        # Generate time symmetric GIF or not.
-        self.mirrored      = False
-        # Default GIF writing options.
-        # fps - frames per second.
-        # speed - change playing speed of the animation, default 1x.
-        self.original_fps = None
-        self.fps          = None
-        self.speed        = 1
-
-    @property
-    def size( self ):
-        """ GIF animation size. """
-        return [ self.width, self.height ]
-
-    def is_valid( self ):
-        """
-        Validate whether existing parameters are already enough to make a GIF animation.
-        """
-        return all( [ x is not None for x in [ self.video, self.start, self.end ] ] )
-
-    def update_video( self, name ):
-        """ Update the video to process. """
-        assert isinstance( name, unicode )
-        self.video = name
-
-    def update_start( self, start=None ):
-        """ Update clip starting time. """
-        if start is not None:
-            self.start = float( start )
-
-    def update_end( self, end=None ):
-        """ Update clip ending time. """
-        if end is not None:
-            self.end = float( end )
-
-    def update_width( self, width=None ):
-        """ Update clip resize width. """
-        if width is not None:
-            self.width = float( width )
-
-    def update_height( self, height=None ):
-        """ Update clip resize height. """
-        if height is not None:
-            self.height = float( height )
-
-    def update_scale( self, scale=None ):
-        """ Update clip resize scale. """
-        if scale is not None:
-            self.scale = float( scale )
-        else:
-            self.scale = None
+        # Init with params to make GIF
+        QtCore.QThread.__init__( self )
+        self.info         = None
+        self.gif_name     = None
+        self.cancel_token = CancelToken()
 
-    def update_fps( self, fps=None ):
-        if fps:
-            self.fps = float( fps )
-        else:
-            self.fps = None
+    def set_params( self, info, gif_name ):
+        """ Info is copied so that editing parameters does not affect a running job. """
+        self.info         = copy.copy( info )
+        self.gif_name     = gif_name
+        self.cancel_token = CancelToken()
 
-    def update_speed( self, speed=None ):
-        if speed:
-            self.speed = float( speed )
+    def cancel( self ):
+        """ Stop making the GIF, the thread finishes shortly after with GIF_making_cancelled. """
+        self.cancel_token.cancel()
+
+    def run( self ):
+        self.make_gif()
+
+    def make_gif( self ):
+        progress = ProgressReporter( self.update_progress, interval=PROGRESS_INTERVAL )
+        try:
+            make_gif( self.info, self.gif_name, progress=progress, cancel=self.cancel_token )
+        except Cancelled:
+            self.emit( QtCore.SIGNAL( 'GIF_making_cancelled' ) )
+        except Exception as err:
+            self.emit( QtCore.SIGNAL( 'GIF_making_failed' ), self.gif_name, err )
         else:
-            self.speed = None
+            self.emit( QtCore.SIGNAL( 'GIF_making_finished' ), self.gif_name )
 
-    def update_mirror( self, mirrored=None ):
-        if mirrored is not None:
-            self.mirrored = mirrored
+    def update_progress( self, event ):
+        """ Send progress signal """
+        self.emit( QtCore.SIGNAL( 'GIF_making_progress' ), event.message() )
 
 
-class ProgressCapture( QtCore.QObject ):
-    """
-    Class to capture console output when making GIF using moviepy.
-    The progress info is parsed from the output and sent to main thread.
-    """
-    text_written = QtCore.pyqtSignal( str )
-    text_content = ''
+class PreviewThread( QtCore.QThread ):
+    """ Render a preview of info in the background, see engine.preview. """
 
-    def write( self, text ):
-        self.text_content = text
-        self.text_written.emit( self.text_content )
+    def __init__( self, info, request ):
+        QtCore.QThread.__init__( self )
+        self.info         = copy.copy( info )
+        self.request      = request
+        self.cancel_token = CancelToken()
 
-    def flush( self ):
-        self.text_written.emit( self.text_content )
+    def cancel( self ):
+        self.cancel_token.cancel()
 
+    def run( self ):
+        try:
+            gif_name = make_preview( self.info, cancel=self.cancel_token )
+        except Cancelled:
+            return
+        except Exception as err:
+            self.emit( QtCore.SIGNAL( 'preview_failed' ), self.request, err )
+        else:
+            self.emit( QtCore.SIGNAL( 'preview_finished' ), self.request, gif_name )
 
-class GIFMakingThread( QtCore.QThread ):
 
-    def __init__( self ):
-        # Init with params to make GIF
-        QtCore.QThread.__init__( self )
-        self.params = None
+class OptimizeThread( QtCore.QThread ):
+    """ Losslessly optimize a GIF file in place in the background, see engine.optimize. """
 
-    def set_params( self, params ):
-        self.params = params
+    def __init__( self, gif_name ):
+        QtCore.QThread.__init__( self )
+        self.gif_name = gif_name
 
     def run( self ):
-        import sys
-        output     = ProgressCapture( text_written=self.update_progress )
-        sys.stdout = output
-        self.make_gif()
+        progress = ProgressReporter( self.update_progress, interval=PROGRESS_INTERVAL )
+        try:
+            before, after = optimize_gif( self.gif_name, progress=progress )
+        except Exception as err:
+            self.emit( QtCore.SIGNAL( 'GIF_optimize_failed' ), self.gif_name, err )
+        else:
+            self.emit( QtCore.SIGNAL( 'GIF_optimized' ), self.gif_name, before, after )
 
-    def make_gif( self ):
-        video_name = self.params[ 'video_name' ]
-        start      = self.params[ 'start' ]
-        end        = self.params[ 'end' ]
-        scale      = self.params[ 'scale' ]
-        size       = self.params[ 'size' ]
-        speed      = self.params[ 'speed' ]
-        mirrored   = self.params[ 'mirrored' ]
-        fps        = self.params[ 'fps' ]
-        gif_name   = self.params[ 'gif_name' ]
-        from moviepy.editor import VideoFileClip
-        import moviepy.video.fx.all as afx
-        clip = VideoFileClip( video_name )
-        clip = clip.subclip( start, end )
-        clip = clip.resize( scale if scale else size )
-        if speed:
-            clip = clip.speedx( speed )
-        if mirrored:
-            clip = afx.time_symmetrize( clip )
-        clip.write_gif( gif_name, fps=fps )
-        self.emit( QtCore.SIGNAL( 'GIF_making_finished' ), gif_name )
+    def update_progress( self, event ):
+        self.emit( QtCore.SIGNAL( 'GIF_making_progress' ), event.message() )
 
-    def update_progress( self, progress ):
-        """ Send progress signal """
-        self.emit( QtCore.SIGNAL( 'GIF_making_progress' ), progress )
+
+class VideoProbeThread( QtCore.QThread ):
+    """ A QThread to read video metadata without blocking the GUI. """
+
+    def __init__( self, video_name, request ):
+        QtCore.QThread.__init__( self )
+        self.video_name   = video_name
+        self.request      = request
+        self.cancel_token = CancelToken()
+
+    def cancel( self ):
+        """ Kill ffprobe, the thread finishes shortly after without a signal. """
+        self.cancel_token.cancel()
+
+    def run( self ):
+        try:
+            metadata = video_metadata( self.video_name, cancel=self.cancel_token )
+        except Cancelled:
+            return
+        except Exception as err:
+            self.emit( QtCore.SIGNAL( 'video_probe_failed' ), self.request, self.video_name, err )
+        else:
+            self.emit( QtCore.SIGNAL( 'video_probed' ), self.request, self.video_name, metadata )
 
 
 class MagicBox( QtCore.QObject ):
@@ -178,25 +150,42 @@ class MagicBoxGui( QtGui.QMainWindow ):
     def __init__( self ):
         super( MagicBoxGui, self ).__init__()
 
-        from moviepy.editor import VideoFileClip
-        self.VideoFileClipCls = VideoFileClip
-
         # MagicBox() does all editing / writing things.
         self.magic_box      = MagicBox()
         # CentralWidget draw by QT Designer.
         self.central_widget = MagicBoxCentralWidget()
         # GIF to be loaded in the player.
         self.loaded_gif     = None
+        # GIF file opened or generated last, which Optimize GIF rewrites, and
+        # the thread optimizing it.
+        self.opened_gif      = None
+        self.optimize_thread = None
         # Last directory where user opened a video, default is current dir.
         self.last_video_dir = QtCore.QString()
         # Last directory where user saved a gif, default is current dir.
         self.last_gif_dir   = QtCore.QString()
+        # Number of the latest open video request and threads still probing.
+        self.video_request  = 0
+        self.probe_threads  = []
+        # Live preview: whether it is on, number of the latest preview
+        # request, threads still rendering and the preview file shown.
+        self.preview_enabled = False
+        self.preview_request = 0
+        self.preview_threads = []
+        self.preview_gif     = None
+        # Parameter changes are coalesced, a preview starts PREVIEW_DELAY ms
+        # after the last one.
+        self.preview_timer = QtCore.QTimer( self )
+        self.preview_timer.setSingleShot( True )
+        self.preview_timer.timeout.connect( self.start_preview )
         # Set window icon.
         self.setWindowIcon( QtGui.QIcon( ':/images/logo_tray.png' ) )
 
         self.thread = GIFMakingThread()
         self.connect( self.thread, QtCore.SIGNAL( 'GIF_making_progress' ), self.update_status_bar_gif_progress )
         self.connect( self.thread, QtCore.SIGNAL( 'GIF_making_finished' ), self.gif_making_finished )
+        self.connect( self.thread, QtCore.SIGNAL( 'GIF_making_cancelled' ), self.gif_making_cancelled )
+        self.connect( self.thread, QtCore.SIGNAL( 'GIF_making_failed' ), self.gif_making_failed )
 
         self.init_ui( )
 
@@ -214,21 +203,62 @@ class MagicBoxGui( QtGui.QMainWindow ):
         open_gif.setShortcut( 'Ctrl+G' )
         open_gif.setStatusTip( 'Open New GIF Picture' )
         open_gif.triggered.connect( self.show_open_gif_dialog )
+        # Menu bar - optimize opened GIF
+        self.optimize_action = QtGui.QAction( 'Optimize GIF', self )
+        self.optimize_action.setShortcut( 'Ctrl+Shift+G' )
+        self.optimize_action.setStatusTip( 'Losslessly shrink the opened GIF file' )
+        self.optimize_action.setDisabled( True )
+        self.optimize_action.triggered.connect( self.optimize_opened_gif )
         # Menu bar - exit program
         exit_action = QtGui.QAction( '&Exit', self )
         exit_action.setShortcut( 'Ctrl+Q' )
         exit_action.setStatusTip( 'Exit application' )
         exit_action.triggered.connect( QtGui.qApp.quit )
+        # Menu bar - snap start time to keyframe
+        snap_keyframe = QtGui.QAction( 'Snap to Keyframe', self )
+        snap_keyframe.setCheckable( True )
+        snap_keyframe.setStatusTip( 'Start GIF at the keyframe before Start Time, fastest to extract' )
+        snap_keyframe.toggled.connect( self.handle_snap_keyframe_change )
+        # Menu bar - live preview
+        live_preview = QtGui.QAction( 'Live Preview', self )
+        live_preview.setCheckable( True )
+        live_preview.setStatusTip( 'Render a small preview whenever parameters change' )
+        live_preview.toggled.connect( self.handle_live_preview_change )
 
         menu      = self.menuBar()
         file_menu = menu.addMenu( '&File' )
         file_menu.addAction( open_file )
         file_menu.addAction( open_gif )
+        file_menu.addAction( self.optimize_action )
         file_menu.addSeparator()
         file_menu.addAction( exit_action )
+        options_menu = menu.addMenu( '&Options' )
+        options_menu.addAction( snap_keyframe )
+        options_menu.addAction( live_preview )
 
         ########### Setup central widget ##########
 
+        # Lossy LZW strength, under fps_input.
+        self.lossy_label = QtGui.QLabel( 'Lossy' )
+        self.lossy_label.setAlignment( QtCore.Qt.AlignRight | QtCore.Qt.AlignTrailing | QtCore.Qt.AlignVCenter )
+        self.lossy_input = QtGui.QLineEdit()
+        self.lossy_input.setPlaceholderText( '0' )
+        self.lossy_input.setToolTip( 'Color distance pixels may be off by for a smaller GIF, e.g. 20 to 80, '
+                                     '0 is lossless' )
+        self.central_widget.gridLayout.addWidget( self.lossy_label, 4, 0, 1, 1 )
+        self.central_widget.gridLayout.addWidget( self.lossy_input, 4, 1, 1, 1 )
+        # Size budget in MB, next to it.
+        self.max_size_label = QtGui.QLabel( 'Max MB' )
+        self.max_size_label.setAlignment( QtCore.Qt.AlignRight | QtCore.Qt.AlignTrailing | QtCore.Qt.AlignVCenter )
+        self.max_size_input = QtGui.QLineEdit()
+        self.max_size_input.setToolTip( 'Fit the GIF in this many MB, size, FPS, colors and lossy are then chosen '
+                                        'automatically' )
+        self.central_widget.gridLayout.addWidget( self.max_size_label, 4, 2, 1, 1 )
+        self.central_widget.gridLayout.addWidget( self.max_size_input, 4, 3, 1, 1 )
+        QtGui.QWidget.setTabOrder( self.central_widget.fps_input, self.lossy_input )
+        QtGui.QWidget.setTabOrder( self.lossy_input, self.max_size_input )
+        QtGui.QWidget.setTabOrder( self.max_size_input, self.central_widget.speed_input )
+
         # Validators.
         double_validator = QtGui.QDoubleValidator( self )
         double_validator.setBottom( 0 )
@@ -240,6 +270,8 @@ class MagicBoxGui( QtGui.QMainWindow ):
         self.central_widget.fps_input.setValidator( double_validator )
         self.central_widget.scale_input.setValidator( double_validator )
         self.central_widget.speed_input.setValidator( double_validator )
+        self.lossy_input.setValidator( double_validator )
+        self.max_size_input.setValidator( double_validator )
 
         # Signals and slots.
         # LineEdits
@@ -250,9 +282,19 @@ class MagicBoxGui( QtGui.QMainWindow ):
         self.central_widget.scale_input.textChanged.connect( self.handle_scale_value_change )
         self.central_widget.fps_input.textChanged.connect( self.handle_fps_change )
         self.central_widget.speed_input.textChanged.connect( self.handle_speed_change )
+        self.lossy_input.textChanged.connect( self.handle_lossy_change )
+        self.max_size_input.textChanged.connect( self.handle_max_size_change )
         # Checkboxes
         self.central_widget.scale_check.stateChanged.connect( self.handle_scale_state_change )
         self.central_widget.mirror_check.stateChanged.connect( self.handle_mirrored_change )
+        # Any parameter change schedules a live preview, after the handlers above.
+        for line_edit in [ self.central_widget.start_input, self.central_widget.end_input,
+                           self.central_widget.width_input, self.central_widget.height_input,
+                           self.central_widget.scale_input, self.central_widget.fps_input,
+                           self.central_widget.speed_input, self.lossy_input ]:
+            line_edit.textChanged.connect( self.schedule_preview )
+        self.central_widget.scale_check.stateChanged.connect( self.schedule_preview )
+        self.central_widget.mirror_check.stateChanged.connect( self.schedule_preview )
         # PushButtons
         self.central_widget.video_file_btn.clicked.connect( self.show_open_video_dialog )
         self.central_widget.generate_btn.clicked.connect( self.generate_gif )
@@ -262,6 +304,11 @@ class MagicBoxGui( QtGui.QMainWindow ):
         self.central_widget.pause_btn.clicked.connect( self.pause_loaded_gif )
         self.central_widget.stop_btn.clicked.connect( self.stop_loaded_gif )
         self.central_widget.next_frame_btn.clicked.connect( self.next_frame_loaded_gif )
+        # Scrub bar under the player, any frame of the loaded GIF can be shown.
+        self.scrub_bar = QtGui.QSlider( QtCore.Qt.Horizontal )
+        self.scrub_bar.setDisabled( True )
+        self.scrub_bar.valueChanged.connect( self.seek_loaded_gif )
+        self.central_widget.verticalLayout.insertWidget( 1, self.scrub_bar )
 
         # Set initial state for widgets in central_widget.
         self.central_widget.video_file_input.setReadOnly( True )
@@ -291,37 +338,72 @@ class MagicBoxGui( QtGui.QMainWindow ):
         self.last_video_dir = QtCore.QString( os.path.dirname( video_name ) )
 
         # Update movie name in statusBar.
+        msg = u'Opening: {name}'.format( name=video_name )
+        self.statusBar().showMessage( msg )
+
+        self.open_video( video_name )
+
+    def open_video( self, video_name ):
+        """
+        Probe video in a VideoProbeThread so the window stays responsive.
+        Only the latest request counts, older ones still in flight are
+        cancelled, and their results dropped if they arrive anyway.
+        """
+        for thread in self.probe_threads:
+            thread.cancel()
+        self.video_request += 1
+        thread = VideoProbeThread( video_name, self.video_request )
+        self.connect( thread, QtCore.SIGNAL( 'video_probed' ), self.video_probed )
+        self.connect( thread, QtCore.SIGNAL( 'video_probe_failed' ), self.video_probe_failed )
+        thread.finished.connect( self.prune_probe_threads )
+        # Keep a reference until the thread is finished.
+        self.probe_threads.append( thread )
+        thread.start()
+
+    def prune_probe_threads( self ):
+        self.probe_threads = [ thread for thread in self.probe_threads if not thread.isFinished() ]
+
+    def video_probed( self, request, video_name, metadata ):
+        """ Update video info, resolution, duration, fps, when its metadata arrives. """
+        if request != self.video_request:
+            # A newer video was opened meanwhile.
+            return
+
+        width, height = metadata[ 'size' ]
+        duration      = metadata[ 'duration' ]
+        fps           = metadata[ 'fps' ]
+
+        self.magic_box.info.update_video( video_name )
+        self.magic_box.info.original_duration = duration
+        self.magic_box.info.original_size = (width, height)
+        self.magic_box.info.original_fps = fps
+
+        # Update video info in main window.
+        self.central_widget.video_file_input.setText( video_name )
+        self.central_widget.start_input.setText( '0.0' )
+        self.central_widget.end_input.setText( str( duration ) )
+        self.central_widget.width_input.setText( str( width ) )
+        self.central_widget.height_input.setText( str( height ) )
+        self.central_widget.fps_input.setText( str( fps ) )
+        self.central_widget.speed_input.setText( '1.0' )
+
         msg = u'Selected: {name}'.format( name=video_name )
         self.statusBar().showMessage( msg )
 
-        try:
-            # Update video info, resolution, duration, fps, from VideoFileClip().
-            self.magic_box.info.update_video( video_name )
-            self.magic_box.clip = self.VideoFileClipCls( video_name )
-            width, height = self.magic_box.clip.size
-            duration = self.magic_box.clip.duration
-            fps = self.magic_box.clip.fps
-
-            self.magic_box.info.original_duration = duration
-            self.magic_box.info.original_size = (width, height)
-            self.magic_box.info.original_fps = fps
-
-            # Update video info in main window.
-            self.central_widget.video_file_input.setText( video_name )
-            self.central_widget.start_input.setText( '0.0' )
-            self.central_widget.end_input.setText( str( duration ) )
-            self.central_widget.width_input.setText( str( width ) )
-            self.central_widget.height_input.setText( str( height ) )
-            self.central_widget.fps_input.setText( str( fps ) )
-            self.central_widget.speed_input.setText( '1.0' )
-        except UnicodeEncodeError:
+    def video_probe_failed( self, request, video_name, err ):
+        if request != self.video_request:
+            return
+
+        if isinstance( err, UnicodeEncodeError ):
             # Bug of Python 2.X on Windows, subprocess.call fails with unicode input.
             # See https://bugs.python.org/issue1759845 for more details.
             err_msg = u"Due to a Python 2.X bug on Windows, "\
                       u"unicode in file name {} is not supported".format( video_name )
-            err_box = QtGui.QErrorMessage()
-            err_box.showMessage( err_msg )
-            self.statusBar().showMessage( None )
+        else:
+            err_msg = u"Could not open video {}: {}".format( video_name, err )
+        err_box = QtGui.QErrorMessage()
+        err_box.showMessage( err_msg )
+        self.statusBar().showMessage( None )
 
     def show_open_gif_dialog( self ):
         """Open GIF file and load it to GIF player."""
@@ -331,6 +413,40 @@ class MagicBoxGui( QtGui.QMainWindow ):
             # In case user close dialog without opening any files.
             self.last_gif_dir = QtCore.QString( os.path.dirname( str( gif_name ) ) )
             self.load_gif( gif_name )
+            self.set_opened_gif( unicode( gif_name ) )
+
+    def set_opened_gif( self, gif_name ):
+        self.opened_gif = gif_name
+        self.optimize_action.setDisabled( self.optimize_thread is not None )
+
+    def optimize_opened_gif( self ):
+        """ Optimize the opened GIF in place, it is closed meanwhile and shown again once done. """
+        if not self.opened_gif or self.optimize_thread is not None:
+            return
+        self.close_loaded_gif()
+        self.optimize_action.setDisabled( True )
+        self.optimize_thread = OptimizeThread( self.opened_gif )
+        self.connect( self.optimize_thread, QtCore.SIGNAL( 'GIF_making_progress' ),
+                      self.update_status_bar_gif_progress )
+        self.connect( self.optimize_thread, QtCore.SIGNAL( 'GIF_optimized' ), self.gif_optimized )
+        self.connect( self.optimize_thread, QtCore.SIGNAL( 'GIF_optimize_failed' ), self.gif_optimize_failed )
+        self.optimize_thread.finished.connect( self.optimize_thread_finished )
+        self.optimize_thread.start()
+
+    def optimize_thread_finished( self ):
+        self.optimize_thread = None
+        self.optimize_action.setDisabled( not self.opened_gif )
+
+    def gif_optimized( self, gif_name, before, after ):
+        self.load_gif( gif_name )
+        self.statusBar().showMessage( u'Optimized {}: {} -> {}'.format( os.path.basename( gif_name ),
+                                                                        format_bytes( before ),
+                                                                        format_bytes( after ) ) )
+
+    def gif_optimize_failed( self, gif_name, err ):
+        err_box = QtGui.QErrorMessage( self )
+        err_box.showMessage( u'Could not optimize {}: {}'.format( gif_name, err ) )
+        self.statusBar().showMessage( None )
 
     def update_status_bar_gif_progress( self, text ):
         self.statusBar().showMessage( text )
@@ -355,6 +471,8 @@ class MagicBoxGui( QtGui.QMainWindow ):
             self.central_widget.height_input.setText( '' )
             self.central_widget.fps_input.setText( '' )
             self.central_widget.speed_input.setText( '' )
+        self.lossy_input.setText( '' )
+        self.max_size_input.setText( '' )
 
         self.central_widget.scale_check.setCheckState( 0 )
         self.central_widget.mirror_check.setCheckState( 0 )
@@ -371,81 +489,155 @@ class MagicBoxGui( QtGui.QMainWindow ):
     def generate_gif( self ):
         """ Generate GIF animation using provided parameters. """
         if self.magic_box.info.is_valid():
-            if self.loaded_gif:
-                # Close opened gif.
-                self.loaded_gif.setFileName( QtCore.QString() )
+            # Close opened gif, it may be overwritten.
+            self.close_loaded_gif()
 
             gif_name = QtGui.QFileDialog.getSaveFileName( self, 'Save GIF File', self.last_gif_dir, "GIF (*.gif)" )
 
             if gif_name:
                 self.last_gif_dir = QtCore.QString( os.path.dirname( unicode( gif_name ) ) )
+                self.cancel_previews()
 
                 self.central_widget.generate_btn.setText( 'Cancel' )
                 self.central_widget.generate_btn.clicked.disconnect( self.generate_gif )
-                self.central_widget.generate_btn.clicked.connect( self.terminate_gif_making )
-
-                params = { 'video_name': self.magic_box.info.video,
-                           'start'     : self.magic_box.info.start,
-                           'end'       : self.magic_box.info.end,
-                           'scale'     : self.magic_box.info.scale,
-                           'size'      : self.magic_box.info.size,
-                           'speed'     : self.magic_box.info.speed,
-                           'fps'       : self.magic_box.info.fps,
-                           'mirrored'  : self.magic_box.info.mirrored,
-                           'gif_name'  : unicode( gif_name ), }
-                self.thread.set_params( params )
+                self.central_widget.generate_btn.clicked.connect( self.cancel_gif_making )
+
+                self.thread.set_params( self.magic_box.info, unicode( gif_name ) )
                 self.thread.start()
 
-    def terminate_gif_making( self ):
-        self.thread.terminate()
-        self.statusBar().showMessage( 'Terminated' )
+    def cancel_gif_making( self ):
+        """ Ask the GIF making thread to stop, the button is back once it has cleaned up. """
+        self.thread.cancel()
+        self.statusBar().showMessage( 'Cancelling' )
+        self.central_widget.generate_btn.setDisabled( True )
+
+    def reset_generate_button( self ):
         self.central_widget.generate_btn.setText( 'Generate GIF' )
-        self.central_widget.generate_btn.clicked.disconnect( self.terminate_gif_making )
+        self.central_widget.generate_btn.setDisabled( False )
+        self.central_widget.generate_btn.clicked.disconnect( self.cancel_gif_making )
         self.central_widget.generate_btn.clicked.connect( self.generate_gif )
 
+    def gif_making_cancelled( self ):
+        self.reset_generate_button()
+        self.statusBar().showMessage( 'Cancelled' )
+
+    def gif_making_failed( self, gif_name, err ):
+        self.reset_generate_button()
+        err_box = QtGui.QErrorMessage( self )
+        err_box.showMessage( u'Could not make {}: {}'.format( gif_name, err ) )
+        self.statusBar().showMessage( None )
+
     def gif_making_finished( self, gif_name ):
-        self.central_widget.generate_btn.setText( 'Generate GIF' )
-        self.central_widget.generate_btn.clicked.disconnect( self.terminate_gif_making )
-        self.central_widget.generate_btn.clicked.connect( self.generate_gif )
+        self.reset_generate_button()
         self.load_gif( gif_name )
+        self.set_opened_gif( gif_name )
+        self.remove_preview_gif()
 
-    def load_gif( self, gif_name ):
+    def schedule_preview( self, *args ):
         """
-        Load GIF file and fit its size to gif_player's size.
-        GIF frame number is displayed in status bar.
+        Render a preview PREVIEW_DELAY ms after the last parameter change,
+        arguments of the signal are ignored. A preview still rendering is
+        stale from now on and cancelled.
         """
-        self.loaded_gif = QtGui.QMovie()
-        self.loaded_gif.setFileName( gif_name )
+        if not self.preview_enabled:
+            return
+        self.cancel_previews()
+        self.preview_timer.start( PREVIEW_DELAY )
+
+    def cancel_previews( self ):
+        """ Drop the pending preview and cancel the ones rendering. """
+        self.preview_timer.stop()
+        self.preview_request += 1
+        for thread in self.preview_threads:
+            thread.cancel()
+
+    def start_preview( self ):
+        if not self.magic_box.info.is_valid() or self.thread.isRunning():
+            return
+        self.preview_request += 1
+        thread = PreviewThread( self.magic_box.info, self.preview_request )
+        self.connect( thread, QtCore.SIGNAL( 'preview_finished' ), self.preview_finished )
+        self.connect( thread, QtCore.SIGNAL( 'preview_failed' ), self.preview_failed )
+        thread.finished.connect( self.prune_preview_threads )
+        # Keep a reference until the thread is finished.
+        self.preview_threads.append( thread )
+        self.statusBar().showMessage( 'Rendering preview' )
+        thread.start()
+
+    def prune_preview_threads( self ):
+        self.preview_threads = [ thread for thread in self.preview_threads if not thread.isFinished() ]
+
+    def preview_finished( self, request, gif_name ):
+        """ Show the preview in gif_player, unless parameters changed since it started. """
+        if request != self.preview_request or self.thread.isRunning():
+            self.remove_file( gif_name )
+            return
+        self.load_gif( gif_name )
+        self.remove_preview_gif()
+        self.preview_gif = gif_name
 
-        player_size = self.central_widget.gif_player.size()
-        self.central_widget.gif_player.setMovie( self.loaded_gif )
+    def preview_failed( self, request, err ):
+        if request == self.preview_request:
+            # Parameters being typed may not make sense yet, no error box.
+            self.statusBar().showMessage( u'No preview: {}'.format( err ) )
 
-        self.loaded_gif.frameChanged.connect( self.update_status_bar_frame_number )
+    def remove_preview_gif( self ):
+        """ Remove the file of the preview shown last. """
+        if self.preview_gif:
+            self.remove_file( self.preview_gif )
+            self.preview_gif = None
+
+    def remove_file( self, file_name ):
+        try:
+            os.remove( file_name )
+        except OSError:
+            # Still open on Windows, left to the temporary directory.
+            pass
 
+    def closeEvent( self, event ):
+        if self.thread.isRunning():
+            # Cancelling kills ffmpeg and removes the partial GIF, wait for it.
+            self.thread.cancel()
+            self.thread.wait()
+        self.cancel_previews()
+        for thread in self.preview_threads:
+            thread.wait()
+        for thread in self.probe_threads:
+            thread.cancel()
+            thread.wait()
+        if self.optimize_thread is not None:
+            # The GIF is only replaced once complete, wait for it.
+            self.optimize_thread.wait()
+        self.close_loaded_gif()
+        self.remove_preview_gif()
+        super( MagicBoxGui, self ).closeEvent( event )
+
+    def load_gif( self, gif_name ):
+        """
+        Load GIF file in a GifPlayer fitting it to gif_player's size.
+        GIF frame number is displayed in status bar.
+        """
+        self.close_loaded_gif()
+        self.loaded_gif = GifPlayer( gif_name, self.central_widget.gif_player )
+        self.connect( self.loaded_gif, QtCore.SIGNAL( 'frame_changed' ), self.update_status_bar_frame_number )
+        self.scrub_bar.setRange( 0, self.loaded_gif.frameCount() - 1 )
+        self.scrub_bar.setDisabled( False )
         self.loaded_gif.start()
-        self.resize_loaded_gif( player_size )
+
+    def close_loaded_gif( self ):
+        """ Stop the GIF shown and release its file and frames. """
+        if self.loaded_gif:
+            self.loaded_gif.close()
+            self.loaded_gif = None
+            self.central_widget.gif_player.clear()
+            self.scrub_bar.setDisabled( True )
 
     def resize_loaded_gif( self, size ):
         """
         Resize GIF to fit gif_player's size while keep its aspect ratio unchanged.
+        Frames are rescaled once resizing stops, see GifPlayer.resize.
         """
-        movie          = self.loaded_gif
-        snapshot       = movie.currentImage()
-        current_size   = snapshot.size()
-        current_width  = float( current_size.width() )
-        current_height = float( current_size.height() )
-        screen_width   = float( size.width() )
-        screen_height  = float( size.height() )
-
-        if screen_height / screen_width > current_height / current_width:
-            # Need to scale by screen width
-            new_width  = int( screen_width )
-            new_height = int( current_height * new_width / current_width )
-        else:
-            # Need to scale by screen height.
-            new_height = int( screen_height )
-            new_width  = int( current_width * new_height / current_height )
-        movie.setScaledSize( QtCore.QSize( new_width, new_height ) )
+        self.loaded_gif.resize( size )
 
     def update_status_bar_frame_number( self, frame ):
         """ Show GIF animation frame number in status bar. """
@@ -453,6 +645,10 @@ class MagicBoxGui( QtGui.QMainWindow ):
         message = 'Frame: {frame}/{total_frame}'.format( frame=frame + 1,
                                                          total_frame=self.loaded_gif.frameCount() )
         self.statusBar().showMessage( message )
+        # Follow playback without seeking back.
+        self.scrub_bar.blockSignals( True )
+        self.scrub_bar.setValue( frame )
+        self.scrub_bar.blockSignals( False )
 
     def play_loaded_gif( self ):
         if self.loaded_gif:
@@ -470,6 +666,12 @@ class MagicBoxGui( QtGui.QMainWindow ):
         if self.loaded_gif:
             self.loaded_gif.jumpToNextFrame()
 
+    def seek_loaded_gif( self, frame ):
+        """ Triggered when the scrub bar is moved, pauses and shows frame. """
+        if self.loaded_gif:
+            self.loaded_gif.setPaused( True )
+            self.loaded_gif.seek( frame )
+
     def handle_start_change( self, start ):
         """ Triggered when central_widget.start_input changes. """
         if start:
@@ -538,6 +740,15 @@ class MagicBoxGui( QtGui.QMainWindow ):
         if speed:
             self.magic_box.info.update_speed( speed )
 
+    def handle_lossy_change( self, lossy ):
+        """ Triggered when lossy_input changes, empty is lossless. """
+        self.magic_box.info.update_lossy( lossy or 0 )
+
+    def handle_max_size_change( self, max_size ):
+        """ Triggered when max_size_input changes, in MB, empty for no budget. """
+        megabytes = float( max_size ) if max_size else 0
+        self.magic_box.info.update_max_bytes( megabytes * 1024 * 1024 )
+
     def handle_mirrored_change( self, mirrored ):
         """ Triggered when central_widget.mirror_check changes. """
         if mirrored:
@@ -545,6 +756,19 @@ class MagicBoxGui( QtGui.QMainWindow ):
         else:
             self.magic_box.info.update_mirror( False )
 
+    def handle_snap_keyframe_change( self, snap ):
+        """ Triggered when Snap to Keyframe in Options menu is toggled. """
+        self.magic_box.info.update_snap_keyframe( bool( snap ) )
+        self.schedule_preview()
+
+    def handle_live_preview_change( self, enabled ):
+        """ Triggered when Live Preview in Options menu is toggled. """
+        self.preview_enabled = bool( enabled )
+        if self.preview_enabled:
+            self.schedule_preview()
+        else:
+            self.cancel_previews()
+
 
 class MagicBoxCentralWidget( QtGui.QWidget, Ui_Form ):
     """
@@ -563,63 +787,33 @@ class MagicBoxCentralWidget( QtGui.QWidget, Ui_Form ):
         self.setupUi( self )
 
 
-class DownloadInfoCapturer( QtCore.QObject ):
-    """
-    Capture download info from stdout.
-    Need to redirect sys.stdout to this object to enable capturing.
-    """
-
-    text_written  = QtCore.pyqtSignal( unicode )
-    _text_content = ''
-    percent       = ''
-
-    def text_content( self ):
-        """" Return the text to be emitted """
-        if self.percent:
-            return ( self._text_content + '\n{}' ).format( self.percent )
-        else:
-            return self._text_content
-
-    def write( self, text ):
-        """ Replacement for stdout.write """
-        percent_pattern = r'(\(\d{1,3}\.\d%\))'
-        self.percent    = re.search( percent_pattern, text )
-
-        if self.percent:
-            self.percent = self.percent.group()[ 1:-1 ]
-        else:
-            self.percent = ''
-
-            if not self._text_content.endswith( '\n' ):
-                self._text_content = '\n'.join( [ self.text_content(), text ] )
-            else:
-                self._text_content = self._text_content + text
-
-        self.text_written.emit( self.text_content() )
-
-    def flush( self ):
-        """ Replacement for stdout.flush """
-        self.text_written.emit( self.text_content() )
-
-
 class DownloadThread( QtCore.QThread ):
     """ A QThread to manage download of ffmpeg """
 
-    def __int__(self):
+    def __init__( self ):
         QtCore.QThread.__init__( self )
+        self.cancel_token = CancelToken()
 
-    def run( self ):
-        import sys
-        output     = DownloadInfoCapturer( text_written=self.update_info )
-        sys.stdout = output
-        find_ffmpeg( auto=True )
-        self.emit( QtCore.SIGNAL( 'downloadFinished' ) )
+    def start( self ):
+        self.cancel_token = CancelToken()
+        QtCore.QThread.start( self )
+
+    def cancel( self ):
+        self.cancel_token.cancel()
 
-    def update_info( self, text ):
-        self.emit( QtCore.SIGNAL( 'hasOutput' ), text )
+    def run( self ):
+        try:
+            download_ffmpeg( progress=ProgressReporter( self.update_info, interval=PROGRESS_INTERVAL ),
+                             cancel=self.cancel_token )
+        except Cancelled:
+            return
+        except Exception as err:
+            self.emit( QtCore.SIGNAL( 'downloadFailed' ), err )
+        else:
+            self.emit( QtCore.SIGNAL( 'downloadFinished' ) )
 
-    def __del__(self):
-        sys.stdout = sys.__stdout__
+    def update_info( self, event ):
+        self.emit( QtCore.SIGNAL( 'hasOutput' ), u'Downloading ffmpeg\n' + event.message() )
 
 
 class PreStartingWidget( QtGui.QWidget ):
@@ -661,6 +855,7 @@ class PreStartingWidget( QtGui.QWidget ):
         self.thread = DownloadThread()
         self.connect( self.thread, QtCore.SIGNAL( 'hasOutput' ), self.label.setText )
         self.connect( self.thread, QtCore.SIGNAL( 'downloadFinished' ), self.download_finished )
+        self.connect( self.thread, QtCore.SIGNAL( 'downloadFailed' ), self.download_failed )
 
     def download_ffmpeg(self):
         self.setWindowTitle( 'GIFer - Downloading ffmpeg for you' )
@@ -677,9 +872,17 @@ class PreStartingWidget( QtGui.QWidget ):
         self.setDisabled( True )
         alert.exec_()
 
+    def download_failed( self, err ):
+        self.setWindowTitle( 'GIFer - Could not download ffmpeg' )
+        self.label.setText( u'Could not download ffmpeg: {}'.format( err ) )
+        self.yes_btn.setDisabled( False )
+        self.no_btn.setText( self.no_text[ 0 ] )
+        err_box = QtGui.QErrorMessage( self )
+        err_box.showMessage( u'Could not download ffmpeg: {}'.format( err ) )
+
     def stop_download_or_exit(self):
         if self.thread.isRunning():
-            self.thread.terminate()
+            self.thread.cancel()
             self.thread.wait()
             self.yes_btn.setDisabled( False )
             self.no_btn.setText( self.no_text[ 0 ] )
@@ -687,51 +890,6 @@ class PreStartingWidget( QtGui.QWidget ):
             self.close()
 
 
-    def __del__(self):
-        sys.stdout = sys.__stdout__
-
-
-def find_ffmpeg( auto=False ):
-    """ Get ffmpeg exe, modified from imageio.plugins.ffmpeg.get_exe """
-    # Is the ffmpeg exe overridden?
-    exe = os.getenv( 'IMAGEIO_FFMPEG_EXE', None )
-    if exe:  # pragma: no cover
-        return exe
-
-    # Check if ffmpeg is in PATH
-    try:
-        with open( os.devnull, "w" ) as null:
-            sp.check_call( [ "ffmpeg", "-version" ], stdout=null,
-                           stderr=sp.STDOUT )
-            return "ffmpeg"
-    # ValueError is raised on failure on OS X through Python 2.7.11
-    # https://bugs.python.org/issue26083
-    except (OSError, ValueError, sp.CalledProcessError):
-        pass
-
-    plat = get_platform( )
-
-    if plat and plat in FNAME_PER_PLATFORM:
-        try:
-            exe = get_remote_file( 'ffmpeg/' + FNAME_PER_PLATFORM[ plat ],
-                                   auto=auto )
-            os.chmod( exe, os.stat( exe ).st_mode | stat.S_IEXEC )  # executable
-            return exe
-        except NeedDownloadError:
-            raise NeedDownloadError( 'Need ffmpeg exe. '
-                                     'You can download it by calling:\n'
-                                     '  imageio.plugins.ffmpeg.download()' )
-        except InternetNotAllowedError:
-            pass  # explicitly disallowed by user
-        except OSError as err:  # pragma: no cover
-            logging.warning( "Warning: could not find imageio's "
-                             "ffmpeg executable:\n%s" %
-                             str( err ) )
-
-    # Fallback, let's hope the system has ffmpeg
-    return 'ffmpeg'
-
-
 def main( argv ):
     app = QtGui.QApplication( argv )
 
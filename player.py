@@ -0,0 +1,327 @@
+"""
+GIF player of the GUI.
+
+QMovie with a scaled size rescales every frame each time it is shown, which
+takes a whole core for large GIFs. GifPlayer decodes every frame once, in a
+background thread, already scaled to the size of the player, and keeps the
+scaled frames in a memory bounded LRU cache, so playing only hands cached
+images to the label. Resize events are coalesced, frames are rescaled once
+the size has settled and the old ones are shown meanwhile.
+
+Frames come from an engine.gifindex.GifIndex, so any frame can be shown
+right away for seeking, or from QImageReader, in order, for files it cannot
+index.
+"""
+import collections
+import threading
+
+import numpy as np
+from PyQt4 import QtCore, QtGui
+
+from engine.gifindex import GifIndex
+
+
+# Bytes of scaled frames kept in memory.
+CACHE_BYTES    = 256 * 1024 * 1024
+# Frames decoded ahead of the one shown.
+DECODE_AHEAD   = 32
+# Milliseconds the player size must stay the same before frames are rescaled.
+RESIZE_DELAY   = 150
+# Milliseconds between tries when the next frame is not decoded yet.
+RETRY_DELAY    = 10
+# Delay of frames without one, as browsers do.
+DEFAULT_DELAY  = 100
+# Frames composed per checkpoint building step, between frame requests.
+PREPARE_FRAMES = 4
+
+
+class FrameCache( object ):
+    """
+    Least recently used scaled frames, QImages by frame number, at most
+    max_bytes of them. Used by the GUI and decoder threads at once.
+    """
+
+    def __init__( self, max_bytes=CACHE_BYTES ):
+        self.max_bytes = max_bytes
+        self.bytes     = 0
+        self.frames    = collections.OrderedDict()
+        self.lock      = threading.Lock()
+
+    def get( self, index ):
+        """ Frame index, whatever its size, None if not cached. """
+        with self.lock:
+            image = self.frames.pop( index, None )
+            if image is not None:
+                self.frames[ index ] = image
+            return image
+
+    def has( self, index, size ):
+        """ Whether frame index is cached at size. """
+        with self.lock:
+            image = self.frames.get( index )
+            return image is not None and image.size() == size
+
+    def put( self, index, image ):
+        with self.lock:
+            old = self.frames.pop( index, None )
+            if old is not None:
+                self.bytes -= old.byteCount()
+            self.frames[ index ] = image
+            self.bytes          += image.byteCount()
+            while self.bytes > self.max_bytes and len( self.frames ) > 1:
+                _, evicted  = self.frames.popitem( last=False )
+                self.bytes -= evicted.byteCount()
+
+    def clear( self ):
+        with self.lock:
+            self.frames.clear()
+            self.bytes = 0
+
+
+class SequentialFrames( object ):
+    """
+    Frames of a GIF file read in order with QImageReader. Reading a frame
+    before the last one read starts over from the first frame.
+    """
+
+    def __init__( self, file_name ):
+        self.file_name = file_name
+        reader         = QtGui.QImageReader( file_name )
+        self.size      = reader.size()
+        self.count     = max( reader.imageCount(), 1 )
+        self.delays    = [ DEFAULT_DELAY ] * self.count
+        self.reader    = None
+        self.next      = 0
+
+    def frame( self, index ):
+        """ Full size QImage of frame index. """
+        if self.reader is None or index < self.next:
+            self.reader = QtGui.QImageReader( self.file_name )
+            self.next   = 0
+        while True:
+            image = self.reader.read()
+            if image.isNull():
+                # Fewer frames than announced, start over.
+                self.count  = max( self.next, 1 )
+                self.reader = None
+                return self.frame( index % self.count )
+            if self.next == len( self.delays ):
+                self.delays.append( DEFAULT_DELAY )
+            self.delays[ self.next ] = self.reader.nextImageDelay() or DEFAULT_DELAY
+            self.next  += 1
+            self.count  = max( self.count, self.next )
+            if self.next > index:
+                return image
+
+    def close( self ):
+        self.reader = None
+
+
+class IndexedFrames( object ):
+    """ Frames of a GIF file by number, composed by GifIndex. """
+
+    def __init__( self, file_name ):
+        self.index  = GifIndex( file_name )
+        self.size   = QtCore.QSize( self.index.width, self.index.height )
+        self.count  = len( self.index )
+        # GIF delays are in 1/100 s, browsers play 0 and 1 at 10 fps.
+        self.delays = [ frame.delay * 10 if frame.delay > 1 else DEFAULT_DELAY for frame in self.index.frames ]
+
+    def frame( self, index ):
+        """ Full size QImage of frame index. """
+        canvas = self.index.composed( index )
+        # ARGB32 is B, G, R, A in memory on little endian machines.
+        data   = np.ascontiguousarray( canvas[ :, :, [ 2, 1, 0, 3 ] ] ).tobytes()
+        image  = QtGui.QImage( data, self.index.width, self.index.height, self.index.width * 4,
+                               QtGui.QImage.Format_ARGB32 )
+        # The image only points to data, copy it before data goes away.
+        return image.copy()
+
+    def prepare( self ):
+        """ Build checkpoints of the index a few frames at a time, return whether there is more to do. """
+        return self.index.prepare( PREPARE_FRAMES )
+
+    def close( self ):
+        self.index.close()
+
+
+def open_frames( file_name ):
+    """ IndexedFrames of file_name, SequentialFrames if it cannot be indexed. """
+    try:
+        return IndexedFrames( file_name )
+    except ( IOError, ValueError ):
+        return SequentialFrames( file_name )
+
+
+class FrameDecoder( QtCore.QThread ):
+    """
+    Decode and scale the frames after the one shown into cache, skipping
+    the ones already cached at the right size. When there are none, build
+    checkpoints of the source so that seeking becomes fast.
+    """
+
+    def __init__( self, source, cache ):
+        QtCore.QThread.__init__( self )
+        self.source    = source
+        self.cache     = cache
+        self.condition = threading.Condition()
+        self.shown     = 0
+        self.size      = source.size
+        self.stopped   = False
+
+    def request( self, shown, size ):
+        """ Frame shown is on screen, frames should have size. """
+        with self.condition:
+            self.shown = shown
+            self.size  = size
+            self.condition.notify()
+
+    def stop( self ):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def missing( self ):
+        """ Next frame to decode and its size, None if all wanted are cached. """
+        size  = self.size
+        frame = max( size.width() * size.height() * 4, 1 )
+        ahead = min( DECODE_AHEAD, self.source.count - 1, self.cache.max_bytes // frame - 1 )
+        for offset in range( max( ahead, 0 ) + 1 ):
+            index = ( self.shown + offset ) % self.source.count
+            if not self.cache.has( index, size ):
+                return index, size
+        return None
+
+    def run( self ):
+        preparing = hasattr( self.source, 'prepare' )
+        while True:
+            with self.condition:
+                wanted = self.missing()
+                while not self.stopped and wanted is None and not preparing:
+                    self.condition.wait()
+                    wanted = self.missing()
+                if self.stopped:
+                    return
+            if wanted is None:
+                preparing = self.source.prepare()
+                continue
+            index, size = wanted
+            image = self.source.frame( index )
+            if image.size() != size:
+                image = image.scaled( size, QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation )
+            self.cache.put( index, image )
+
+
+class GifPlayer( QtCore.QObject ):
+    """
+    Play a GIF file in a QLabel, fitted to the label's size. Emits
+    frame_changed with the frame number whenever a frame is shown.
+    """
+
+    def __init__( self, file_name, label ):
+        QtCore.QObject.__init__( self )
+        self.label   = label
+        self.source  = open_frames( file_name )
+        self.cache   = FrameCache()
+        self.decoder = FrameDecoder( self.source, self.cache )
+        # Frame shown, None before the first one, and frame to show as soon
+        # as it is decoded.
+        self.current = None
+        self.wanted  = None
+        self.playing = False
+        self.size    = self.fitted( label.size() )
+
+        self.timer = QtCore.QTimer( self )
+        self.timer.setSingleShot( True )
+        self.timer.timeout.connect( self.advance )
+        # Resize events come in bursts while dragging, only the last counts.
+        self.pending_size = None
+        self.resize_timer = QtCore.QTimer( self )
+        self.resize_timer.setSingleShot( True )
+        self.resize_timer.timeout.connect( self.apply_size )
+
+        self.decoder.request( 0, self.size )
+        self.decoder.start()
+
+    def fitted( self, size ):
+        """ Size of frames fitting in size, aspect ratio kept. """
+        fitted = QtCore.QSize( self.source.size )
+        fitted.scale( size, QtCore.Qt.KeepAspectRatio )
+        return fitted
+
+    def frameCount( self ):
+        return self.source.count
+
+    def start( self ):
+        self.playing = True
+        if not self.timer.isActive():
+            self.timer.start( 0 if self.current is None else self.source.delays[ self.current ] )
+
+    def setPaused( self, paused ):
+        if paused:
+            self.playing = False
+            if self.wanted is None:
+                self.timer.stop()
+        else:
+            self.start()
+
+    def stop( self ):
+        self.setPaused( True )
+        self.seek( 0 )
+
+    def seek( self, index ):
+        """ Show frame index as soon as it is decoded. """
+        self.wanted = index
+        self.timer.stop()
+        self.advance()
+
+    def next_frame( self ):
+        """ Number of the frame after the one shown. """
+        return 0 if self.current is None else ( self.current + 1 ) % self.source.count
+
+    def jumpToNextFrame( self ):
+        self.seek( self.next_frame() )
+
+    def resize( self, size ):
+        """ Fit frames to size once it has not changed for RESIZE_DELAY ms. """
+        self.pending_size = size
+        self.resize_timer.start( RESIZE_DELAY )
+
+    def apply_size( self ):
+        self.size = self.fitted( self.pending_size )
+        self.decoder.request( self.current or 0, self.size )
+
+    def show_frame( self, index ):
+        """ Show frame index if it is decoded, at any size, return whether it was. """
+        self.decoder.request( index, self.size )
+        image = self.cache.get( index )
+        if image is None:
+            return False
+        self.label.setPixmap( QtGui.QPixmap.fromImage( image ) )
+        self.current = index
+        self.emit( QtCore.SIGNAL( 'frame_changed' ), index )
+        return True
+
+    def advance( self ):
+        """ Show the frame wanted or, when playing, the next one, and plan the one after. """
+        if self.wanted is None and not self.playing:
+            return
+        index = self.next_frame() if self.wanted is None else self.wanted
+        if not self.show_frame( index ):
+            self.wanted = index
+            self.timer.start( RETRY_DELAY )
+            return
+        self.wanted = None
+        if self.playing:
+            self.timer.start( self.source.delays[ index ] )
+
+    def close( self ):
+        """ Stop playing and decoding, free the cache and the file. """
+        self.playing = False
+        self.wanted  = None
+        self.timer.stop()
+        self.resize_timer.stop()
+        self.decoder.stop()
+        self.decoder.wait()
+        self.source.close()
+        self.cache.clear()
@@ -0,0 +1,5 @@
+"""
+Tests of the engine, run from the repository root:
+
+    python -m unittest discover -s tests -t .
+"""
@@ -0,0 +1,78 @@
+"""
+Batch manifests: reading JSON and CSV, turning rows into jobs and checking
+them before the batch starts.
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from engine.batch import check_jobs, estimated_cost, job_to_info, read_manifest
+
+
+CSV_MANIFEST = """video,start,end,size,fps,speed,mirrored,engine,quantizer,colors,dither,max_size,output
+a.mp4,1.5,4,320x180,12,2,yes,gifer,octree,64,bayer8,2M,a.gif
+b.mp4,,,,,,,,,,,,
+"""
+
+
+class ManifestTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+
+    def write( self, name, text ):
+        path = os.path.join( self.directory, name )
+        with open( path, 'w' ) as manifest:
+            manifest.write( text )
+        return path
+
+    def test_csv( self ):
+        jobs = read_manifest( self.write( 'jobs.csv', CSV_MANIFEST ) )
+        self.assertEqual( len( jobs ), 2 )
+        info = job_to_info( jobs[ 0 ] )
+        self.assertEqual( info.video, 'a.mp4' )
+        self.assertEqual( ( info.start, info.end ), ( 1.5, 4.0 ) )
+        self.assertEqual( ( info.width, info.height ), ( 320.0, 180.0 ) )
+        self.assertEqual( ( info.fps, info.speed, info.mirrored ), ( 12.0, 2.0, True ) )
+        self.assertEqual( ( info.engine, info.quantizer, info.colors, info.dither ), ( 'gifer', 'octree', 64, 'bayer8' ) )
+        self.assertEqual( info.max_bytes, 2 * 1024 * 1024 )
+
+        # Empty cells are missing values, defaults apply.
+        info = job_to_info( jobs[ 1 ] )
+        self.assertEqual( ( info.video, info.start, info.end, info.speed ), ( 'b.mp4', 0, None, 1.0 ) )
+        self.assertFalse( info.mirrored )
+
+    def test_json( self ):
+        rows = [ { 'video': 'a.mp4', 'size': [ 160, 90 ], 'mirrored': True, 'start': 2, 'end': 3 } ]
+        for manifest in ( rows, { 'jobs': rows } ):
+            jobs = read_manifest( self.write( 'jobs.json', json.dumps( manifest ) ) )
+            info = job_to_info( jobs[ 0 ] )
+            self.assertEqual( ( info.width, info.height, info.mirrored ), ( 160.0, 90.0, True ) )
+            self.assertEqual( estimated_cost( jobs[ 0 ] ), 2.0 )
+
+    def test_invalid_rows( self ):
+        jobs = [ { 'video': 'a.mp4', 'end': 1 },
+                 { 'video': 'b.mp4', 'start': 'abc' },
+                 { 'video': '' },
+                 { 'video': 'c.mp4', 'max_size': 'xyz' },
+                 { 'video': 'd.mp4' },
+                 { 'video': 'e.mp4', 'engine': 'foo' },
+                 { 'video': 'f.mp4', 'dither': 'bayer16' } ]
+        valid, invalid = check_jobs( jobs )
+        self.assertEqual( [ index for index, job, cost in valid ], [ 0, 4 ] )
+        self.assertEqual( sorted( invalid ), [ 1, 2, 3, 5, 6 ] )
+        for summary in invalid.values():
+            self.assertTrue( summary[ 'error' ].startswith( 'ValueError' ) )
+            self.assertIsNone( summary[ 'frames' ] )
+        self.assertEqual( invalid[ 1 ][ 'video' ], 'b.mp4' )
+        # Unknown end, long job first.
+        self.assertEqual( valid[ 1 ][ 2 ], float( 'inf' ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+"""
+Command line arguments turned into a GIF job.
+"""
+import unittest
+
+from engine.cli import build_parser, info_from_args
+from engine.render import default_gif_name
+
+
+class ArgumentsTest( unittest.TestCase ):
+
+    def info( self, argv ):
+        return info_from_args( build_parser().parse_args( argv ) )
+
+    def test_defaults( self ):
+        info = self.info( [ 'video.mp4' ] )
+        self.assertEqual( info.video, 'video.mp4' )
+        self.assertEqual( ( info.start, info.end, info.speed ), ( 0.0, None, 1.0 ) )
+        self.assertIsNone( info.fps )
+        self.assertFalse( info.mirrored )
+
+    def test_options( self ):
+        info = self.info( [ 'video.mp4', '--start', '10', '--end', '15.5', '--width', '320', '--scale', '0.5',
+                            '--fps', '15', '--speed', '2', '--mirror' ] )
+        self.assertEqual( ( info.start, info.end ), ( 10.0, 15.5 ) )
+        self.assertEqual( ( info.width, info.scale ), ( 320.0, 0.5 ) )
+        self.assertEqual( ( info.fps, info.speed, info.mirrored ), ( 15.0, 2.0, True ) )
+
+    def test_default_gif_name( self ):
+        self.assertEqual( default_gif_name( 'clips/video.mp4' ), 'clips/video.gif' )
+        self.assertEqual( default_gif_name( 'video' ), 'video.gif' )
+
+
+if __name__ == '__main__':
+    unittest.main()
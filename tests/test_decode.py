@@ -0,0 +1,101 @@
+"""
+Frame planning: which source frames a GIF shows, and the ffmpeg select
+expression sending only those through the pipe. In process resizing
+against a reference box filter.
+"""
+from __future__ import division
+import math
+import unittest
+
+import numpy as np
+
+from engine.decode import area_average, frame_plan, keyframe_plan, planned_frames, resize_frames, select_expression, selected_plan
+
+
+# Functions of ffmpeg's expression evaluator used by select_expression.
+FFMPEG_FUNCTIONS = { 'lt': lambda a, b: float( a < b ), 'lte': lambda a, b: float( a <= b ), 'ceil': math.ceil }
+
+CASES = [ ( 30, 10, 1, 2 ), ( 30, 12, 1, 2 ), ( 29.97, 15, 1, 3 ), ( 25, 10, 2, 4 ), ( 30, 30, 0.5, 1 ),
+          ( 60, 24, 1.5, 2 ), ( 24, 30, 1, 1 ), ( 30, 7, 3, 5 ) ]
+
+
+def selected( expression, count ):
+    """ Frame numbers below count that ffmpeg's select keeps with expression. """
+    return [ n for n in range( count ) if eval( expression, dict( FFMPEG_FUNCTIONS, n=n ) ) ]
+
+
+class PlanTest( unittest.TestCase ):
+
+    def test_frame_plan( self ):
+        self.assertEqual( frame_plan( 30, 10, 1, 1 ), list( range( 0, 30, 3 ) ) )
+        self.assertEqual( frame_plan( 30, 15, 2, 2 ), list( range( 0, 60, 4 ) ) )
+        # Slower than the source, frames are repeated.
+        self.assertEqual( frame_plan( 10, 20, 1, 0.5 ), [ 0, 0, 1, 1, 2, 2, 3, 3, 4, 4 ] )
+        # 29.97 fps source at 10 fps, exact frame times do not slip a frame.
+        self.assertEqual( frame_plan( 30000 / 1001, 30000 / 1001 / 3, 1, 1 )[ :4 ], [ 0, 3, 6, 9 ] )
+
+    def test_select_expression( self ):
+        for source_fps, fps, speed, duration in CASES:
+            plan       = frame_plan( source_fps, fps, speed, duration )
+            expression = select_expression( source_fps, fps, speed, plan )
+            if expression is None:
+                # Every source frame is shown.
+                self.assertEqual( sorted( set( plan ) ), list( range( plan[ -1 ] + 1 ) ) )
+                continue
+            count = int( math.ceil( source_fps * duration ) ) + 10
+            self.assertEqual( selected( expression, count ), sorted( set( plan ) ) )
+
+    def test_selected_plan( self ):
+        for source_fps, fps, speed, duration in CASES:
+            plan  = frame_plan( source_fps, fps, speed, duration )
+            kept  = sorted( set( plan ) )
+            ranks = selected_plan( plan )
+            self.assertEqual( [ kept[ rank ] for rank in ranks ], plan )
+
+    def test_planned_frames( self ):
+        self.assertEqual( list( planned_frames( 'abcdef', [ 0, 0, 2, 3, 3, 5 ] ) ), list( 'aacddf' ) )
+        # The video ends early, its last frame stays.
+        self.assertEqual( list( planned_frames( 'abc', [ 0, 2, 4, 6 ] ) ), list( 'accc' ) )
+        self.assertEqual( list( planned_frames( '', [ 0, 1 ] ) ), [] )
+
+    def test_keyframe_plan( self ):
+        times = [ 0.0, 2.0, 4.0, 6.0, 8.0 ]
+        self.assertEqual( keyframe_plan( times, 1, 1, 1, 5 ), [ 0, 1, 1, 2, 2 ] )
+        self.assertEqual( keyframe_plan( times, 1, 2, 1, 3 ), [ 0, 0, 1, 1, 1, 1 ] )
+        self.assertEqual( keyframe_plan( times, 1, 2, 1, 3, nearest=True ), [ 0, 1, 1, 1, 1, 2 ] )
+        self.assertEqual( keyframe_plan( times, 2, 1, 2, 6 ), [ 0, 1, 2 ] )
+
+
+def box_filter( frame, size ):
+    """ Reference downscale by integer factors: the rounded mean of every block. """
+    height, width = frame.shape[ :2 ]
+    blocks = frame.reshape( size[ 1 ], height // size[ 1 ], size[ 0 ], width // size[ 0 ], -1 )
+    means  = blocks.astype( np.float64 ).mean( axis=( 1, 3 ) )
+    return np.floor( means + 0.5 ).astype( np.uint8 ).reshape( ( size[ 1 ], size[ 0 ] ) + frame.shape[ 2: ] )
+
+
+class ResizeTest( unittest.TestCase ):
+
+    def test_area_average( self ):
+        random = np.random.RandomState( 0 )
+        for shape, size in [ ( ( 48, 64, 3 ), ( 32, 24 ) ), ( ( 45, 60, 3 ), ( 20, 15 ) ),
+                             ( ( 40, 40 ), ( 10, 5 ) ), ( ( 64, 64, 3 ), ( 4, 4 ) ), ( ( 12, 16, 3 ), ( 16, 12 ) ) ]:
+            frame = random.randint( 0, 256, shape ).astype( np.uint8 )
+            np.testing.assert_array_equal( area_average( frame, size ), box_filter( frame, size ) )
+        # Uniform blocks keep their color.
+        frame = np.repeat( np.repeat( random.randint( 0, 256, ( 6, 8, 3 ) ).astype( np.uint8 ), 4, 0 ), 4, 1 )
+        np.testing.assert_array_equal( area_average( frame, ( 8, 6 ) ), frame[ ::4, ::4 ] )
+
+    def test_resize_frames( self ):
+        random = np.random.RandomState( 1 )
+        frames = [ random.randint( 0, 256, ( 48, 64, 3 ) ).astype( np.uint8 ) for index in range( 3 ) ]
+        for frame, resized in zip( frames, resize_frames( frames, ( 16, 12 ), 'area' ) ):
+            np.testing.assert_array_equal( resized, box_filter( frame, ( 16, 12 ) ) )
+        # Other factors and filters go through PIL.
+        for resize_filter in [ 'area', 'lanczos' ]:
+            resized = list( resize_frames( frames, ( 50, 30 ), resize_filter ) )
+            self.assertEqual( [ frame.shape for frame in resized ], [ ( 30, 50, 3 ) ] * 3 )
+
+
+if __name__ == '__main__':
+    unittest.main()
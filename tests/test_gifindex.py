@@ -0,0 +1,74 @@
+"""
+GifIndex frame offsets, rectangles and composed canvases against PIL.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from engine.gif import write_gif
+from engine.gifindex import GifIndex
+
+
+def moving_box( count=6, size=( 40, 50 ) ):
+    """ RGB frames of a red box moving down over a noisy background. """
+    background = np.random.RandomState( 0 ).randint( 0, 256, size=size + ( 3, ) ).astype( np.uint8 )
+    for index in range( count ):
+        frame = background.copy()
+        frame[ 5 + 3 * index:15 + 3 * index, 10:20 ] = ( 255, 0, 0 )
+        yield frame
+
+
+class GifIndexTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.gif_name  = os.path.join( self.directory, 'index.gif' )
+
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+
+    def check( self ):
+        """ Every frame of the GIF where PIL finds it, composed like PIL does. """
+        from PIL import Image
+
+        index = GifIndex( self.gif_name )
+        image = Image.open( self.gif_name )
+        try:
+            self.assertEqual( len( index ), getattr( image, 'n_frames', len( index ) ) )
+            for number, frame in enumerate( index.frames ):
+                image.seek( number )
+                _, box, offset, _ = image.tile[ 0 ]
+                # PIL's tile starts after the LZW minimum code size byte.
+                self.assertEqual( offset, frame.data + 1 )
+                self.assertEqual( box, ( frame.left, frame.top, frame.left + frame.width, frame.top + frame.height ) )
+                image.load()
+                np.testing.assert_array_equal( index.composed( number )[ ..., :3 ],
+                                               np.asarray( image.convert( 'RGB' ) ) )
+        finally:
+            image.close()
+            index.close()
+
+    def test_full_frames( self ):
+        write_gif( moving_box(), self.gif_name, 10 )
+        self.check()
+
+    def test_delta_frames( self ):
+        write_gif( moving_box(), self.gif_name, 10, quantizer='median-cut', delta=True )
+        self.check()
+
+    def test_seek_back( self ):
+        write_gif( moving_box( 40 ), self.gif_name, 10, quantizer='median-cut', delta=True )
+        index = GifIndex( self.gif_name )
+        try:
+            forward = [ index.composed( number ).copy() for number in range( len( index ) ) ]
+            for number in [ 39, 3, 17, 0, 32 ]:
+                np.testing.assert_array_equal( index.composed( number ), forward[ number ] )
+        finally:
+            index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
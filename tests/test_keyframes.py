@@ -0,0 +1,63 @@
+"""
+Seeking with the keyframe index, against an accurate ffmpeg -ss decode.
+Skipped when ffmpeg cannot be found.
+"""
+import os
+import shutil
+import subprocess as sp
+import tempfile
+import unittest
+
+import numpy as np
+
+from engine.decode import FrameReader
+from engine.ffmpeg import ffmpeg_exe
+from engine.keyframes import seek_arguments
+
+
+SIZE      = ( 64, 48 )
+FPS       = 30
+KEYFRAMES = [ 0.0, 1.0, 2.0 ]
+
+
+def find_ffmpeg( ):
+    try:
+        return ffmpeg_exe()
+    except Exception:
+        return None
+
+
+@unittest.skipUnless( find_ffmpeg(), 'ffmpeg not found' )
+class SeekTest( unittest.TestCase ):
+
+    @classmethod
+    def setUpClass( cls ):
+        cls.directory = tempfile.mkdtemp()
+        cls.video     = os.path.join( cls.directory, 'keyframes.mp4' )
+        # A keyframe every second, every frame different.
+        sp.check_call( [ ffmpeg_exe(), '-v', 'error', '-nostdin', '-f', 'lavfi',
+                         '-i', 'testsrc2=size={}x{}:rate={}:duration=3'.format( SIZE[ 0 ], SIZE[ 1 ], FPS ),
+                         '-g', str( FPS ), '-pix_fmt', 'yuv420p', cls.video ] )
+
+    @classmethod
+    def tearDownClass( cls ):
+        shutil.rmtree( cls.directory )
+
+    def test_first_frame( self ):
+        for start in [ 1.0, 1 + 1 / float( FPS ), 1 + 5 / float( FPS ), 1.5, 2 - 1 / float( FPS ) ]:
+            accurate = list( FrameReader( self.video, SIZE, start, 0.2 ) )
+            indexed  = list( FrameReader( self.video, SIZE, start, 0.2, keyframes=KEYFRAMES ) )
+            self.assertEqual( len( indexed ), len( accurate ) )
+            for frame, expected in zip( indexed, accurate ):
+                np.testing.assert_array_equal( frame, expected )
+
+    def test_seek_arguments( self ):
+        self.assertEqual( seek_arguments( 0, KEYFRAMES ), ( [], 0 ) )
+        seek, offset = seek_arguments( 1.5, KEYFRAMES )
+        self.assertEqual( seek, [ '-noaccurate_seek', '-ss', '1.000500' ] )
+        self.assertAlmostEqual( offset, 0.4995 )
+        self.assertEqual( seek_arguments( 1.0, KEYFRAMES )[ 1 ], 0 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+"""
+LZW compression round trips, against a decoder written from the GIF spec and
+against PIL's GIF decoder, and the error bound of lossy compression.
+"""
+import io
+import struct
+import unittest
+
+import numpy as np
+
+from engine import lzw
+
+
+def decompress( data, code_size ):
+    """ Palette indices of GIF LZW data (without sub-blocks) of minimum code size code_size. """
+    clear, end = 1 << code_size, ( 1 << code_size ) + 1
+    size       = code_size + 1
+    table      = None
+    previous   = None
+    pixels     = bytearray()
+    bits = count = 0
+    for byte in bytearray( data ):
+        bits  |= byte << count
+        count += 8
+        while count >= size:
+            code    = bits & ( ( 1 << size ) - 1 )
+            bits  >>= size
+            count  -= size
+            if code == clear:
+                table    = [ bytearray( [ index ] ) for index in range( clear ) ] + [ None, None ]
+                size     = code_size + 1
+                previous = None
+                continue
+            if code == end:
+                return pixels
+            if code < len( table ):
+                string = table[ code ]
+            else:
+                string = previous + previous[ :1 ]
+            pixels += string
+            if previous is not None and len( table ) <= lzw.MAX_CODE:
+                table.append( previous + string[ :1 ] )
+                if len( table ) == 1 << size and size < lzw.MAX_BITS:
+                    size += 1
+            previous = string
+    raise ValueError( 'No end of information code' )
+
+
+def unblock( data ):
+    """ Bytes of GIF data sub-blocks, checking they end with an empty one. """
+    output = bytearray()
+    pos    = 0
+    while data[ pos:pos + 1 ] != b'\x00':
+        length  = bytearray( data[ pos:pos + 1 ] )[ 0 ]
+        output += data[ pos + 1:pos + 1 + length ]
+        pos    += length + 1
+    assert pos == len( data ) - 1, 'Bytes after the terminating sub-block'
+    return bytes( output )
+
+
+def pil_decoded( image_data, width, height ):
+    """ Palette indices PIL decodes from image data, in a one frame GIF with a 256 color table. """
+    from PIL import Image
+
+    screen = struct.pack( '<6sHHBBB', b'GIF89a', width, height, 0x87, 0, 0 ) + bytes( bytearray( range( 256 ) ) ) * 3
+    block  = struct.pack( '<BHHHHB', 0x2c, 0, 0, width, height, 0 ) + image_data
+    image  = Image.open( io.BytesIO( screen + block + b'\x3b' ) )
+    image.load()
+    return np.asarray( image, dtype=np.uint8 )
+
+
+def frames( ):
+    """ ( indices, code size ) of noisy, flat and striped frames for every code size. """
+    random = np.random.RandomState( 7 )
+    for code_size in range( 2, 9 ):
+        colors = 1 << code_size
+        yield random.randint( 0, colors, size=( 1, 1 ) ).astype( np.uint8 ), code_size
+        yield random.randint( 0, colors, size=( 90, 160 ) ).astype( np.uint8 ), code_size
+        yield np.full( ( 64, 64 ), colors - 1, dtype=np.uint8 ), code_size
+        yield ( np.arange( 120 * 200 ) // 7 % colors ).astype( np.uint8 ).reshape( 120, 200 ), code_size
+
+
+class CompressTest( unittest.TestCase ):
+
+    def test_round_trip( self ):
+        for indices, code_size in frames():
+            data = lzw.compress( indices, code_size )
+            self.assertEqual( bytes( decompress( data, code_size ) ), indices.tobytes() )
+
+    def test_table_clears( self ):
+        # Noise fills the 4096 code table many times over.
+        indices = np.random.RandomState( 3 ).randint( 0, 256, size=( 300, 400 ) ).astype( np.uint8 )
+        self.assertEqual( bytes( decompress( lzw.compress( indices, 8 ), 8 ) ), indices.tobytes() )
+
+    def test_empty( self ):
+        self.assertEqual( bytes( decompress( lzw.compress( np.zeros( 0, dtype=np.uint8 ), 2 ), 2 ) ), b'' )
+
+    def test_pil_decodes( self ):
+        for indices, code_size in frames():
+            height, width = indices.shape
+            data = bytes( bytearray( [ code_size ] ) ) + lzw.sub_blocks( lzw.compress( indices, code_size ) )
+            np.testing.assert_array_equal( pil_decoded( data, width, height ), indices )
+
+
+class LossyTest( unittest.TestCase ):
+
+    def setUp( self ):
+        random       = np.random.RandomState( 11 )
+        # A gradient palette, neighbors 4 apart in every channel.
+        self.palette = np.repeat( ( np.arange( 64 ) * 4 )[ :, None ], 3, axis=1 ).astype( np.uint8 )
+        base         = np.linspace( 0, 63, 160 )[ None, : ] + random.normal( 0, 2, size=( 90, 160 ) )
+        self.indices = np.clip( base.round(), 0, 63 ).astype( np.uint8 )
+
+    def error( self, data, code_size ):
+        """ Largest RGB distance of a decoded pixel to the original. """
+        decoded = np.frombuffer( bytes( decompress( data, code_size ) ), dtype=np.uint8 )
+        self.assertEqual( len( decoded ), self.indices.size )
+        offsets = self.palette[ decoded ].astype( np.float64 ) - self.palette[ self.indices.ravel() ]
+        return np.sqrt( ( offsets ** 2 ).sum( axis=1 ) ).max()
+
+    def test_error_bound( self ):
+        sizes = [ len( lzw.compress( self.indices, 6 ) ) ]
+        # Neighbors are about 7 apart, 5 is still lossless.
+        for lossy in [ 5, 10, 20, 40 ]:
+            similar = lzw.similar_colors( self.palette, lossy )
+            data    = lzw.compress( self.indices, 6, similar )
+            self.assertLessEqual( self.error( data, 6 ), lossy )
+            self.assertLessEqual( len( data ), sizes[ -1 ] )
+            sizes.append( len( data ) )
+        self.assertLess( sizes[ -1 ], sizes[ 0 ] )
+
+    def test_transparent_kept( self ):
+        similar = lzw.similar_colors( self.palette, 40, transparent=0 )
+        self.assertEqual( similar[ 0 ], () )
+        self.assertTrue( all( 0 not in others for others in similar ) )
+        decoded = np.frombuffer( bytes( decompress( lzw.compress( self.indices, 6, similar ), 6 ) ), dtype=np.uint8 )
+        np.testing.assert_array_equal( decoded == 0, self.indices.ravel() == 0 )
+
+    def test_lossless_without_similar( self ):
+        self.assertIsNone( lzw.similar_colors( self.palette, 0 ) )
+
+
+class ImageDataTest( unittest.TestCase ):
+
+    def test_lossless_round_trip( self ):
+        for indices, code_size in frames():
+            height, width = indices.shape
+            data = lzw.image_data( indices, 1 << code_size )
+            self.assertEqual( bytearray( data[ :1 ] )[ 0 ], code_size )
+            self.assertEqual( bytes( decompress( unblock( data[ 1: ] ), code_size ) ), indices.tobytes() )
+            np.testing.assert_array_equal( pil_decoded( data, width, height ), indices )
+
+    def test_python_fallback_matches( self ):
+        # Both encoders write the same pixels, whichever bytes they choose.
+        indices = np.random.RandomState( 5 ).randint( 0, 16, size=( 50, 70 ) ).astype( np.uint8 )
+        fast    = decompress( unblock( lzw.image_data( indices, 16 )[ 1: ] ), 4 )
+        slow    = decompress( lzw.compress( indices, 4 ), 4 )
+        self.assertEqual( fast, slow )
+
+
+if __name__ == '__main__':
+    unittest.main()
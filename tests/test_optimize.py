@@ -0,0 +1,85 @@
+"""
+The GIF optimizer is lossless: the optimized GIF shows the same canvases for
+the same time.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from engine.gif import write_gif
+from engine.gifindex import GifIndex
+from engine.optimize import optimize_gif
+
+
+def still_and_moving( ):
+    """ RGB frames of a box moving over a background, then standing still. """
+    background = np.random.RandomState( 0 ).randint( 0, 256, size=( 36, 48, 3 ) ).astype( np.uint8 )
+    for index in range( 12 ):
+        frame = background.copy()
+        frame[ 4:12, 2 + 3 * min( index, 6 ):10 + 3 * min( index, 6 ) ] = ( 0, 200, 0 )
+        yield frame
+
+
+def timeline( gif_name ):
+    """ ( RGBA canvas, delay ) of every frame, consecutive equal canvases merged. """
+    index  = GifIndex( gif_name )
+    frames = []
+    try:
+        for number, frame in enumerate( index.frames ):
+            canvas = index.composed( number ).copy()
+            if frames and np.array_equal( frames[ -1 ][ 0 ], canvas ):
+                frames[ -1 ][ 1 ] += frame.delay
+            else:
+                frames.append( [ canvas, frame.delay ] )
+    finally:
+        index.close()
+    return frames
+
+
+class OptimizeTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+
+    def check( self, **options ):
+        gif_name = os.path.join( self.directory, 'input.gif' )
+        output   = os.path.join( self.directory, 'output.gif' )
+        write_gif( still_and_moving(), gif_name, 10, **options )
+        before, after = optimize_gif( gif_name, output )
+        self.assertEqual( before, os.path.getsize( gif_name ) )
+        self.assertLessEqual( after, before )
+        expected, optimized = timeline( gif_name ), timeline( output )
+        self.assertEqual( len( optimized ), len( expected ) )
+        for ( canvas, delay ), ( expected_canvas, expected_delay ) in zip( optimized, expected ):
+            np.testing.assert_array_equal( canvas, expected_canvas )
+            self.assertEqual( delay, expected_delay )
+        return before, after
+
+    def test_adaptive_palettes( self ):
+        before, after = self.check()
+        self.assertLess( after, before )
+
+    def test_global_palette( self ):
+        self.check( quantizer='median-cut' )
+
+    def test_delta( self ):
+        self.check( quantizer='median-cut', delta=True )
+
+    def test_in_place( self ):
+        gif_name = os.path.join( self.directory, 'input.gif' )
+        write_gif( still_and_moving(), gif_name, 10 )
+        expected      = timeline( gif_name )
+        before, after = optimize_gif( gif_name )
+        self.assertEqual( after, os.path.getsize( gif_name ) )
+        self.assertEqual( len( timeline( gif_name ) ), len( expected ) )
+        self.assertFalse( any( name.endswith( '.partial.gif' ) for name in os.listdir( self.directory ) ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
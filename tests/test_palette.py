@@ -0,0 +1,63 @@
+"""
+Palettes and the mapping of frames to them.
+"""
+import unittest
+
+import numpy as np
+
+from engine.palette import lookup, median_cut, nearest, octree, palette_lut
+
+
+def distinct( colors ):
+    return set( map( tuple, np.asarray( colors ).reshape( -1, 3 ).tolist() ) )
+
+
+class QuantizerTest( unittest.TestCase ):
+
+    def setUp( self ):
+        random      = np.random.RandomState( 0 )
+        self.pixels = random.randint( 0, 256, size=( 4000, 3 ) ).astype( np.uint8 )
+        # Few colors, repeated a different number of times.
+        self.few    = np.repeat( random.randint( 0, 256, size=( 10, 3 ) ), [ 1, 2, 3, 50, 5, 5, 5, 100, 7, 1 ],
+                                 axis=0 ).astype( np.uint8 )
+
+    def check( self, quantizer ):
+        for colors in [ 1, 2, 3, 7, 8, 9, 64, 255, 256 ]:
+            palette = quantizer( self.pixels, colors )
+            self.assertEqual( len( palette ), colors )
+            self.assertEqual( len( distinct( palette ) ), colors )
+        for colors in [ 2, 5, 10, 20 ]:
+            self.assertEqual( len( quantizer( self.few, colors ) ), min( colors, 10 ) )
+        # Enough colors, the palette is the colors of the pixels.
+        self.assertEqual( distinct( quantizer( self.few, 256 ) ), distinct( self.few ) )
+
+    def test_median_cut( self ):
+        self.check( median_cut )
+
+    def test_octree( self ):
+        self.check( octree )
+
+
+class LookupTest( unittest.TestCase ):
+
+    def test_palette_colors_map_to_themselves( self ):
+        random = np.random.RandomState( 0 )
+        # Colors sharing lookup table cells, and spread ones.
+        palette = np.vstack( [ random.randint( 96, 104, size=( 16, 3 ) ),
+                               random.randint( 0, 256, size=( 64, 3 ) ) ] ).astype( np.uint8 )
+        palette = np.unique( palette, axis=0 )
+        lut     = palette_lut( palette )
+        np.testing.assert_array_equal( palette[ lookup( palette, palette, lut ) ], palette )
+
+    def test_close_to_nearest( self ):
+        random  = np.random.RandomState( 1 )
+        palette = random.randint( 0, 256, size=( 32, 3 ) ).astype( np.uint8 )
+        frame   = random.randint( 0, 256, size=( 48, 64, 3 ) ).astype( np.uint8 )
+        indices = lookup( frame, palette, palette_lut( palette ) )
+        exact   = nearest( frame, palette ).reshape( indices.shape )
+        error   = lambda found: np.sqrt( ( ( frame.astype( np.int64 ) - palette[ found ] ) ** 2 ).mean() )
+        self.assertLess( error( indices ), error( exact ) + 2 )
+
+
+if __name__ == '__main__':
+    unittest.main()